@@ -0,0 +1,62 @@
+"""
+比较 marshmallow Schema 和手写加载函数的反序列化速度
+
+    python benchmarks/bench_deserialize.py
+"""
+
+import argparse
+import json
+import time
+
+from fuo_xiami.models import (
+    _deserialize,
+    set_deserializer,
+    NestedSongSchema,
+    PlaylistSchema,
+    SearchSchema,
+)
+
+
+def _load_fixture(name):
+    with open('data/fixtures/{}.json'.format(name)) as f:
+        return json.load(f)
+
+
+def bench(items, schema_cls, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for item in items:
+            _deserialize(item, schema_cls)
+        count += len(items)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    playlist = _load_fixture('playlist')
+    cases = [
+        ('playlist songs', playlist['songs'], NestedSongSchema),
+        ('favorite songs', _load_fixture('user_favorite_songs'), NestedSongSchema),
+        ('playlist', [playlist], PlaylistSchema),
+        ('search', [_load_fixture('search')], SearchSchema),
+    ]
+    modes = [('marshmallow', False), ('fast', False), ('fast', True)]
+    print('{:<16} {:>14} {:>20} {:>20}'.format(
+        'items/sec', 'marshmallow', 'fast', 'fast(trusted)'))
+    for name, items, schema_cls in cases:
+        results = []
+        for mode, trusted in modes:
+            set_deserializer(mode, trusted=trusted)
+            results.append(bench(items, schema_cls, args.seconds))
+        set_deserializer('fast')
+        base = results[0]
+        print('{:<16} {:>14.0f} {:>12.0f} ({:>4.1f}x) {:>12.0f} ({:>4.1f}x)'.format(
+            name, base, results[1], results[1] / base, results[2], results[2] / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+导入 fuo_xiami 并调用 enable 的耗时
+
+feeluown 启动时会依次导入并启用所有插件，插件在导入时做的事情越多，启动越慢。
+这里在一个新的进程中模拟 feeluown 加载插件的过程（fuocore、feeluown 已经被
+导入），用 ``python -X importtime`` 列出加载插件时导入的模块::
+
+    python benchmarks/bench_import.py --top 20
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+MARKER = '-- fuo_xiami --'
+
+SCRIPT = '''
+import sys
+import time
+from unittest import mock
+
+# feeluown 加载插件之前已经导入了这些模块
+import feeluown.consts  # noqa
+import fuocore.models  # noqa
+import fuocore.provider  # noqa
+
+sys.stderr.write({marker!r} + '\\n')
+sys.stderr.flush()
+start = time.perf_counter()
+import fuo_xiami
+fuo_xiami.enable(mock.MagicMock(mode=0, GuiMode=1))
+print(time.perf_counter() - start)
+'''.format(marker=MARKER)
+
+
+def run_import(importtime=False):
+    """在子进程中导入 fuo_xiami 并调用 enable
+
+    返回 ``(耗时秒数, [(self us, cumulative us, 模块名)])``，
+    importtime 为 False 时模块列表为空。
+    """
+    with tempfile.TemporaryDirectory() as home:
+        # enable 会在 DATA_DIR 中创建缓存数据库
+        os.makedirs(os.path.join(home, '.FeelUOwn', 'data'))
+        env = dict(os.environ, HOME=home)
+        cmd = [sys.executable]
+        if importtime:
+            cmd += ['-X', 'importtime']
+        proc = subprocess.run(cmd + ['-c', SCRIPT], env=env, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+    elapsed = float(proc.stdout.split()[-1])
+    return elapsed, parse_importtime(proc.stderr.split(MARKER, 1)[-1])
+
+
+def parse_importtime(text):
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top', type=int, default=15,
+                        help='打印自身耗时最多的前几个模块')
+    args = parser.parse_args()
+
+    elapsed, modules = run_import(importtime=True)
+    print('import + enable: {:.1f} ms, {} modules imported'.format(
+        elapsed * 1000, len(modules)))
+    print('{:>10} {:>12}  {}'.format('self us', 'cumulative', 'module'))
+    for self_us, cumulative_us, name in sorted(modules, reverse=True)[:args.top]:
+        print('{:>10} {:>12}  {}'.format(self_us, cumulative_us, name))
+
+
+if __name__ == '__main__':
+    main()
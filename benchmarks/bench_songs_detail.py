@@ -0,0 +1,73 @@
+"""
+API.songs_detail 并发请求的 benchmark
+
+使用一个模拟网络延迟的假 transport，观察随着 worker 数量增加，
+获取大量歌曲详情的耗时变化::
+
+    python benchmarks/bench_songs_detail.py --ids 5000 --latency 0.05
+"""
+
+import argparse
+import json
+import time
+
+from fuo_xiami.api import API
+from fuo_xiami.scheduler import Scheduler
+
+
+class StubResponse:
+    def __init__(self, rv):
+        self._rv = rv
+
+    def json(self):
+        return self._rv
+
+
+class StubSession:
+    """每个请求等待 latency 秒，然后返回请求的歌曲"""
+
+    def __init__(self, latency):
+        self.headers = {}
+        self.latency = latency
+
+    def get(self, url, params=None, timeout=None):
+        time.sleep(self.latency)
+        request_str = json.loads(json.loads(params['data'])['requestStr'])
+        songs = [{'songId': str(song_id)}
+                 for song_id in request_str['model']['songIds']]
+        return StubResponse({'ret': ['SUCCESS::调用成功'],
+                             'data': {'data': {'songs': songs}}})
+
+
+def bench(song_ids, latency, workers):
+    api = API()
+    api._req_token = 'token'
+    api.set_http(StubSession(latency))
+    # 不限速，并发数由 workers 决定
+    api.set_scheduler(Scheduler(max_concurrency=64, rate=None, family_rate=None))
+    start = time.perf_counter()
+    songs = api.songs_detail(song_ids, workers=workers)
+    elapsed = time.perf_counter() - start
+    assert len(songs) == len(song_ids)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ids', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    song_ids = list(range(1, args.ids + 1))
+    baseline = None
+    print('{:>8} {:>10} {:>8}'.format('workers', 'seconds', 'speedup'))
+    for workers in args.workers:
+        elapsed = bench(song_ids, args.latency, workers)
+        if baseline is None:
+            baseline = elapsed
+        print('{:>8} {:>10.3f} {:>7.1f}x'.format(workers, elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,462 @@
+"""
+插件热点路径的 benchmark 集合
+
+数据来自 data/fixtures，网络请求使用假的 transport，所以结果只反映
+CPU 和内存的开销。每个 benchmark 会报告 ops/sec（对于批量操作，是每秒
+处理的条目数）和峰值内存::
+
+    python benchmarks/suite.py                    # 运行并打印结果
+    python benchmarks/suite.py --json out.json    # 同时保存结果
+    python benchmarks/suite.py --base master      # 和另一个版本比较
+
+比较两个版本时，会把 --base 指定的版本 checkout 到一个临时的 git worktree
+中，然后用同一份 benchmark 代码分别测试两个版本的 fuo_xiami。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+BENCHMARKS = []
+
+
+def benchmark(name, items=1, self_timed=False):
+    """注册一个 benchmark
+
+    被装饰的函数负责准备数据，返回一个不带参数的函数，只有后者会被计时。
+
+    :param items: 每次调用处理的条目数，用来计算每秒处理的条目数
+    :param self_timed: 被计时的函数自己返回这一次的耗时（秒），
+        用于在子进程中进行测量的 benchmark
+    """
+    def decorator(setup):
+        BENCHMARKS.append((name, items, setup, self_timed))
+        return setup
+    return decorator
+
+
+def _load_fixture(name):
+    with open(os.path.join('data', 'fixtures', name + '.json')) as f:
+        return json.load(f)
+
+
+def _create_api(http=None):
+    from fuo_xiami.api import API
+
+    api = API()
+    api._req_token = 'token'
+    if http is not None:
+        api.set_http(http)
+    try:
+        from fuo_xiami.scheduler import Scheduler
+    except ImportError:
+        pass
+    else:
+        # 只测量调度本身的开销，不限速
+        api.set_scheduler(Scheduler(max_concurrency=64, rate=None,
+                                    family_rate=None))
+    return api
+
+
+@benchmark('sign_payload')
+def bench_sign_payload():
+    api = _create_api()
+    payload = {'userId': 1, 'pagingVO': {'page': 1, 'pageSize': 50}}
+    return lambda: api._sign_payload(payload)
+
+
+def _register_deserialize(fixture, schema_name, many=False):
+    data = _load_fixture(fixture)
+    items = len(data) if many else 1
+
+    @benchmark('deserialize {} ({})'.format(fixture, schema_name), items=items)
+    def setup():
+        from fuo_xiami import models
+
+        schema_cls = getattr(models, schema_name)
+        deserialize = models._deserialize
+        if many:
+            return lambda: [deserialize(item, schema_cls) for item in data]
+        return lambda: deserialize(data, schema_cls)
+
+
+_register_deserialize('song', 'SongSchema')
+_register_deserialize('album', 'AlbumSchema')
+_register_deserialize('artist', 'ArtistSchema')
+_register_deserialize('playlist', 'PlaylistSchema')
+_register_deserialize('search', 'SearchSchema')
+_register_deserialize('user_favorite_songs', 'NestedSongSchema', many=True)
+_register_deserialize('artist_songs', 'NestedSongSchema', many=True)
+
+
+VISIBLE_ROWS = 20
+
+
+def _render_songs(songs):
+    """模拟界面展示前 VISIBLE_ROWS 首歌曲"""
+    for song in songs[:VISIBLE_ROWS]:
+        (song.title, song.artists_name, song.album_name, song.duration_ms)
+
+
+def _register_first_render(fixture, schema_name, deserializer, get_songs):
+    data = _load_fixture(fixture)
+
+    @benchmark('first render {} ({})'.format(fixture, deserializer))
+    def setup():
+        from fuo_xiami import models
+
+        schema_cls = getattr(models, schema_name)
+        # 旧版本可能不支持该 deserializer，这时抛出 ValueError
+        models.set_deserializer(deserializer)
+        models.set_deserializer('fast')
+
+        def render():
+            models.set_deserializer(deserializer)
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    _render_songs(get_songs(models._deserialize(data, schema_cls)))
+            finally:
+                models.set_deserializer('fast')
+        return render
+
+
+for _deserializer in ('fast', 'lazy'):
+    _register_first_render('search', 'SearchSchema', _deserializer,
+                           lambda search: search.songs)
+    _register_first_render('playlist', 'PlaylistSchema', _deserializer,
+                           lambda playlist: playlist.songs)
+
+
+def _listen_files():
+    files = []
+    for song in _load_fixture('artist_songs'):
+        for lfile in song['listenFiles']:
+            files.append({'url': lfile['listenFile'],
+                          'quality': lfile['quality'],
+                          'format': lfile['format']})
+    return files
+
+
+LISTEN_FILES = _listen_files()
+
+
+@benchmark('to_q_media_mapping', items=len(LISTEN_FILES))
+def bench_to_q_media_mapping():
+    from fuo_xiami.schemas import ListenFileSchema
+    return lambda: ListenFileSchema.to_q_media_mapping(LISTEN_FILES)
+
+
+@benchmark('to_q_media_mapping (fast)', items=len(LISTEN_FILES))
+def bench_to_q_media_mapping_fast():
+    from fuo_xiami.loaders import to_q_media_mapping
+    return lambda: to_q_media_mapping(LISTEN_FILES)
+
+
+def _list_body():
+    songs = _load_fixture('artist_songs')
+    rv = {'data': {'data': {'songs': songs * (200 // len(songs))}},
+          'ret': ['SUCCESS::调用成功']}
+    return json.dumps(rv, ensure_ascii=False).encode('utf-8')
+
+
+LIST_BODY = _list_body()
+LIST_BODY_CHUNKS = [LIST_BODY[i:i + 16 * 1024]
+                    for i in range(0, len(LIST_BODY), 16 * 1024)]
+
+
+@benchmark('decode 200 songs page (json)', items=1)
+def bench_decode_page_json():
+    return lambda: json.loads(b''.join(LIST_BODY_CHUNKS))
+
+
+@benchmark('decode 200 songs page (stream)', items=1)
+def bench_decode_page_stream():
+    from fuo_xiami.stream import ListResponseStream
+    return lambda: sum(1 for _ in ListResponseStream(LIST_BODY_CHUNKS))
+
+
+class _BodyResponse(object):
+    def __init__(self, body):
+        self.content = body
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class _BodySession(object):
+    """不走网络，总是返回同一个响应体"""
+
+    def __init__(self, body):
+        self.headers = {}
+        self.body = body
+
+    def get(self, url, params=None, timeout=None):
+        return _BodyResponse(self.body)
+
+
+@benchmark('sign + send + decode 200 songs page', items=1)
+def bench_request_path():
+    api = _create_api(_BodySession(LIST_BODY))
+    payload = {'listId': '1', 'pagingVO': {'page': 1, 'pageSize': 200}}
+    return lambda: api._request('mtop.alimusic.music.list.collectservice'
+                                '.getcollectdetail', payload, 3)
+
+
+CREATE_G_TOTAL = 10000
+CREATE_G_PAGE_SIZE = 200
+
+
+@benchmark('create_g 10k items', items=CREATE_G_TOTAL)
+def bench_create_g():
+    from fuo_xiami.models import create_g
+
+    song = _load_fixture('artist_songs')[0]
+    pages = CREATE_G_TOTAL // CREATE_G_PAGE_SIZE
+    # 提前构造好所有的页面，只测量 create_g 本身
+    data_pages = {}
+    for page in range(1, pages + 1):
+        songs = []
+        for i in range(CREATE_G_PAGE_SIZE):
+            song_data = dict(song)
+            song_data['songId'] = str(page * 1000 + i)
+            songs.append(song_data)
+        data_pages[page] = {
+            'songs': songs,
+            'pagingVO': {'count': str(CREATE_G_TOTAL),
+                         'page': str(page),
+                         'pageSize': str(CREATE_G_PAGE_SIZE),
+                         'pages': str(pages)},
+        }
+
+    def func(identifier, page=1, page_size=CREATE_G_PAGE_SIZE):
+        return data_pages.get(page)
+
+    return lambda: sum(1 for _ in create_g(func, 1))
+
+
+LYRIC = '\n'.join('[{:02}:{:05.2f}]line {}'.format(i * 3 // 60, i * 3 % 60, i)
+                  for i in range(80))
+
+
+@benchmark('lyric line at position (re-parse)', items=1)
+def bench_lyric_reparse():
+    from fuocore.lyric import parse
+
+    def line_at():
+        ms_map = parse(LYRIC)
+        return max((ms for ms in ms_map if ms <= 123456), default=None)
+    return line_at
+
+
+@benchmark('lyric line at position (LyricTimeline)', items=1)
+def bench_lyric_timeline():
+    from fuo_xiami.lyric import LyricTimeline
+
+    timeline = LyricTimeline(LYRIC)
+    return lambda: timeline.line_at(123.456)
+
+
+LARGE_COLLECTION = 20000
+
+
+def _large_collection():
+    songs = _load_fixture('user_favorite_songs')
+    items = []
+    for i in range(LARGE_COLLECTION):
+        song = dict(songs[i % len(songs)])
+        song['songId'] = str(i + 1)
+        items.append(song)
+    return items
+
+
+@benchmark('hold 20k songs (models)', items=LARGE_COLLECTION)
+def bench_hold_models():
+    from fuo_xiami.models import _deserialize, NestedSongSchema
+
+    items = _large_collection()
+    return lambda: [_deserialize(item, NestedSongSchema) for item in items]
+
+
+@benchmark('hold 20k songs (SongTable)', items=LARGE_COLLECTION)
+def bench_hold_table():
+    from fuo_xiami.table import SongTable
+
+    items = _large_collection()
+
+    def fill():
+        table = SongTable()
+        table.extend(items)
+        return table
+    return fill
+
+
+def _song_index():
+    from fuo_xiami.index import SongIndex
+
+    index = SongIndex()
+    for item in _large_collection():
+        index.add(item)
+    return index
+
+
+@benchmark('build song index 20k songs', items=LARGE_COLLECTION)
+def bench_index_build():
+    _song_index()  # 旧版本没有 index 模块时跳过
+    items = _large_collection()
+
+    def build():
+        from fuo_xiami.index import SongIndex
+
+        index = SongIndex()
+        for item in items:
+            index.add(item)
+        index.flush()
+    return build
+
+
+@benchmark('local search in 20k songs', items=1)
+def bench_index_search():
+    index = _song_index()
+    index.flush()
+    song = _load_fixture('user_favorite_songs')[0]
+    keywords = [song['songName'], song['singerVOs'][0]['artistName'], 'zhou']
+    return lambda: [index.search(keyword) for keyword in keywords]
+
+
+SONGS_DETAIL_IDS = 5000
+
+
+@benchmark('songs_detail chunking 5k ids', items=SONGS_DETAIL_IDS)
+def bench_songs_detail():
+    from bench_songs_detail import StubSession
+
+    api = _create_api(StubSession(latency=0))
+    song_ids = list(range(1, SONGS_DETAIL_IDS + 1))
+    return lambda: api.songs_detail(song_ids)
+
+
+@benchmark('import fuo_xiami + enable', self_timed=True)
+def bench_import():
+    from bench_import import run_import
+
+    return lambda: run_import()[0]
+
+
+def measure(items, func, min_time, self_timed=False):
+    """返回 (每秒处理的条目数, 峰值内存 KiB)
+
+    self_timed 的 benchmark 不统计峰值内存，返回 0。
+    """
+    func()  # warm up
+    count = 0
+    timed = 0
+    start = time.perf_counter()
+    while True:
+        spent = func()
+        count += 1
+        elapsed = time.perf_counter() - start
+        if self_timed:
+            timed += spent
+        if elapsed >= min_time:
+            break
+    if self_timed:
+        return count * items / timed, 0
+    ops = count * items / elapsed
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ops, peak / 1024
+
+
+def run(min_time, pattern=None):
+    results = {}
+    for name, items, setup, self_timed in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        try:
+            func = setup()
+        except (ImportError, AttributeError, ValueError) as e:
+            # 旧版本可能没有对应的功能
+            print('skip {}: {}'.format(name, e), file=sys.stderr)
+            continue
+        ops, peak = measure(items, func, min_time, self_timed)
+        results[name] = {'ops': ops, 'peak_kib': peak}
+    return results
+
+
+def print_results(results):
+    print('{:<52} {:>14} {:>12}'.format('benchmark', 'ops/sec', 'peak KiB'))
+    for name, result in results.items():
+        print('{:<52} {:>14.0f} {:>12.1f}'.format(
+            name, result['ops'], result['peak_kib']))
+
+
+def print_comparison(base, current):
+    print('{:<52} {:>12} {:>12} {:>8} {:>10} {:>10}'.format(
+        'benchmark', 'base ops', 'ops', 'change', 'base KiB', 'KiB'))
+    for name, result in current.items():
+        if name not in base:
+            continue
+        b = base[name]
+        change = (result['ops'] / b['ops'] - 1) * 100
+        print('{:<52} {:>12.0f} {:>12.0f} {:>+7.1f}% {:>10.1f} {:>10.1f}'.format(
+            name, b['ops'], result['ops'], change, b['peak_kib'], result['peak_kib']))
+
+
+def run_revision(rev, args):
+    """在临时 worktree 中测试 rev 版本的 fuo_xiami，返回结果"""
+    tmpdir = tempfile.mkdtemp(prefix='fuo_xiami_bench_')
+    worktree = os.path.join(tmpdir, 'src')
+    out = os.path.join(tmpdir, 'result.json')
+    subprocess.check_call(['git', 'worktree', 'add', '--detach', worktree, rev],
+                          stdout=subprocess.DEVNULL)
+    try:
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [worktree, env.get('PYTHONPATH')]))
+        cmd = [sys.executable, os.path.abspath(__file__),
+               '--min-time', str(args.min_time), '--json', out, '--quiet']
+        if args.filter:
+            cmd += ['--filter', args.filter]
+        subprocess.check_call(cmd, env=env)
+        with open(out) as f:
+            return json.load(f)
+    finally:
+        subprocess.call(['git', 'worktree', 'remove', '--force', worktree])
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='每个 benchmark 至少运行的时间（秒）')
+    parser.add_argument('--filter', help='只运行名字中包含该字符串的 benchmark')
+    parser.add_argument('--json', help='把结果保存到该文件')
+    parser.add_argument('--base', help='和该 git 版本进行比较')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+
+    if args.base:
+        base = run_revision(args.base, args)
+    results = run(args.min_time, args.filter)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.base:
+        print_comparison(base, results)
+    elif not args.quiet:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,17 @@
 import json
 import logging
 import os
+import threading
 
+# 这里只导入注册 provider 需要的模块，models、schemas 等模块在第一次使用时
+# 才会被导入，参考 tests/test_import.py
+from .cache import ResponseCache
 from .excs import XiamiIOError
+from .lyric import LyricPrefetcher, LyricStore
 from .provider import provider
-from .models import XUserModel
+from .refresher import UrlRefresher
+from .scheduler import AsyncScheduler, Scheduler
+from .tasks import TaskRunner
 
 from feeluown.consts import DATA_DIR
 
@@ -16,6 +23,23 @@ __desc__ = '虾米音乐'
 
 logger = logging.getLogger(__name__)
 USER_INFO_FILE = DATA_DIR + '/xiami_user_info.json'
+RESPONSE_CACHE_FILE = DATA_DIR + '/xiami_response_cache.sqlite'
+LYRIC_STORE_FILE = DATA_DIR + '/xiami_lyrics.sqlite'
+TOKEN_FILE = DATA_DIR + '/xiami_token.json'
+LIBRARY_FILE = DATA_DIR + '/xiami_library.sqlite'
+AUDIO_CACHE_FILE = DATA_DIR + '/xiami_audio_heads.sqlite'
+
+#: 是否把 API 响应缓存到本地（参考 cache 模块），默认关闭。
+#: feeluown 不允许在 rc 文件中设置插件没有声明的配置项，可以在 rc 文件中开启::
+#:
+#:     import fuo_xiami
+#:     fuo_xiami.RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_ENABLED = False
+#: 是否通过 Scheduler 调度和限速请求（参考 scheduler 模块），默认关闭
+REQUEST_SCHEDULER_ENABLED = False
+#: 是否在切歌时预取接下来几首歌曲的开头，并通过本地代理播放（参考 audio 模块），
+#: 默认关闭。每次切歌会多下载约 1MB 的数据
+AUDIO_PREFETCH_ENABLED = False
 
 
 def dump_user(user):
@@ -30,6 +54,8 @@ def dump_user(user):
 
 
 def load_user():
+    from .models import XUserModel
+
     if not os.path.exists(USER_INFO_FILE):
         return None
     with open(USER_INFO_FILE) as f:
@@ -42,13 +68,29 @@ def load_user():
 
 
 class Xiami(object):
-    """GUI 控制"""
+    """GUI 控制
+
+    网络请求都在 TaskRunner 的工作线程中进行，结果再交回 Qt 主线程展示；
+    同一个区域（歌曲表格、左侧歌单列表）的新请求会取消旧的请求。
+
+    :param runner: 测试时可以传入一个同步 deliver 的 TaskRunner
+    """
 
     instance = None
 
-    def __init__(self, app):
+    def __init__(self, app, runner=None):
         self._app = app
         self._user = None
+        self._library = None
+        if runner is None:
+            from .ui import Dispatcher
+            self._dispatcher = Dispatcher()
+            runner = TaskRunner(deliver=self._dispatcher.dispatch)
+        self._runner = runner
+        #: 歌曲表格当前展示的收藏列表，本地曲库同步之后用来判断是否需要刷新
+        self._showing = None
+        #: 左侧展示的歌单，playlists/fav_playlists -> 歌单列表
+        self._playlists = {}
 
         self._pm = self._app.pvd_uimgr.create_item(
             name=provider.identifier,
@@ -57,6 +99,7 @@ class Xiami(object):
             desc='')
         self._pm.clicked.connect(self.show_provider)
         self._app.pvd_uimgr.add_item(self._pm)
+        provider.on_remote_search = self._on_remote_search
 
         Xiami.instance = self
 
@@ -71,18 +114,96 @@ class Xiami(object):
             dump_user(user)
         self._user = user
         provider.auth(user)
+        from .library import LibraryStore, LibrarySync
+        self._library = LibrarySync(provider.api, LibraryStore(LIBRARY_FILE),
+                                    user.identifier)
+
+    def _library_g(self, kind, default):
+        """优先从本地曲库中读取，本地没有时使用 default"""
+        objs_g = self._library.load_g(kind) if self._library else None
+        return default() if objs_g is None else objs_g
+
+    def _show_in_table(self, kind, load, show):
+        """在工作线程中调用 load，然后在主线程中调用 show 展示结果"""
+        self._showing = kind
+        return self._runner.submit('table', load, show)
 
     def show_fav_songs(self):
-        self._app.ui.songs_table_container.show_songs(songs_g=self._user.fav_songs)
+        return self._show_in_table(
+            'songs',
+            lambda: self._library_g('songs', lambda: self._user.fav_songs),
+            lambda songs_g: self._app.ui.songs_table_container.show_songs(
+                songs_g=songs_g))
 
     def show_fav_albums(self):
-        self._app.ui.songs_table_container.show_albums_coll(self._user.fav_albums)
+        return self._show_in_table(
+            'albums',
+            lambda: self._library_g('albums', lambda: self._user.fav_albums),
+            self._app.ui.songs_table_container.show_albums_coll)
 
     def show_fav_artists(self):
-        self._app.ui.songs_table_container.show_artists_coll(self._user.fav_artists)
+        return self._show_in_table(
+            'artists',
+            lambda: self._library_g('artists', lambda: self._user.fav_artists),
+            self._app.ui.songs_table_container.show_artists_coll)
 
     def show_rec_songs(self):
-        self._app.ui.songs_table_container.show_songs(self._user.rec_songs)
+        return self._show_in_table('rec_songs', lambda: self._user.rec_songs,
+                                   self._app.ui.songs_table_container.show_songs)
+
+    def _load_playlists(self, kind):
+        playlists = self._library.load(kind)
+        if playlists is None:
+            playlists = getattr(self._user, kind)
+        return playlists
+
+    def _show_playlists(self, kind):
+        def show(playlists):
+            self._playlists[kind] = playlists
+            self._render_playlists()
+
+        return self._runner.submit(kind, self._load_playlists, show, kind)
+
+    def _render_playlists(self):
+        # 两种歌单分别返回，先返回的先展示
+        self._app.pl_uimgr.clear()
+        if 'playlists' in self._playlists:
+            self._app.pl_uimgr.add(self._playlists['playlists'])
+        if 'fav_playlists' in self._playlists:
+            self._app.pl_uimgr.add(self._playlists['fav_playlists'], is_fav=True)
+
+    def _on_library_synced(self, kind, status):
+        """在同步线程中调用"""
+        from .library import UNCHANGED
+
+        if status != UNCHANGED:
+            self._runner.deliver(self._refresh, kind)
+
+    def _refresh(self, kind):
+        if kind in ('playlists', 'fav_playlists'):
+            if kind in self._playlists:
+                self._show_playlists(kind)
+        elif kind == self._showing:
+            getattr(self, 'show_fav_' + kind)()
+
+    def _on_remote_search(self, keyword, result):
+        """在搜索线程中调用，参考 provider.on_remote_search"""
+        self._runner.deliver(self._merge_search_result, result)
+
+    def _merge_search_result(self, result):
+        """歌曲表格还在展示本地命中的搜索结果时，追加服务端返回的其它歌曲"""
+        table = self._app.ui.songs_table_container.songs_table
+        model = table.model()
+        if hasattr(model, 'sourceModel'):
+            model = model.sourceModel()
+        shown = list(getattr(model, 'songs', None) or [])
+        if not result.songs or result.songs[0] not in shown:
+            return
+        ids = {(song.source, song.identifier) for song in shown}
+        songs = [song for song in result.songs
+                 if (song.source, song.identifier) not in ids]
+        if songs:
+            self._app.ui.songs_table_container.show_songs(songs=shown + songs)
 
     def show_provider(self):
         """展示虾米首页
@@ -101,11 +222,6 @@ class Xiami(object):
         if self._user is not None:
             # 显示用户名
             self._pm.text = '虾米音乐 - {}'.format(self._user.name)
-            # 显示播放列表/歌单
-            self._app.pl_uimgr.clear()
-            self._app.pl_uimgr.add(self._user.playlists)
-            self._app.pl_uimgr.add(self._user.fav_playlists, is_fav=True)
-            # self._app.pl_uimgr.add(self._user.rec_playlists)
             # 显示用户收藏的歌曲
             self._app.ui.left_panel.my_music_con.show()
             self._app.ui.left_panel.playlists_con.show()
@@ -127,6 +243,14 @@ class Xiami(object):
             mymusic_artists_item.clicked.connect(self.show_fav_artists)
             self._app.mymusic_uimgr.add_item(mymusic_artists_item)
 
+            # 显示播放列表/歌单：本地曲库中有歌单时直接使用，没有时在后台请求
+            self._playlists.clear()
+            self._app.pl_uimgr.clear()
+            self._show_playlists('playlists')
+            self._show_playlists('fav_playlists')
+            # 在后台和服务端同步本地曲库，有变化时刷新正在展示的内容
+            self._library.start_sync(on_synced=self._on_library_synced)
+
     def activate_fm(self):
         self._app.fm.activate(self.fetch_fm_songs)
 
@@ -137,11 +261,71 @@ class Xiami(object):
         return songs
 
 
+def _enable_audio_prefetch(app, playlist):
+    """切歌时预取接下来几首歌曲的开头，播放时通过本地代理拼接"""
+    from .audio import AudioPrefetcher, HeadCache, HeadProxy
+
+    head_cache = HeadCache(AUDIO_CACHE_FILE)
+    policy = getattr(getattr(app, 'config', None), 'AUDIO_SELECT_POLICY', None)
+    audio_prefetcher = AudioPrefetcher(
+        source=playlist.list, cache=head_cache,
+        policy=policy if isinstance(policy, str) else None)
+    playlist.song_changed.connect(audio_prefetcher.on_song_changed, weak=False)
+    app.__xiami_audio_prefetcher = audio_prefetcher
+    provider.media_proxy = HeadProxy(head_cache)
+
+
 def enable(app):
+    if RESPONSE_CACHE_ENABLED:
+        cache = ResponseCache(RESPONSE_CACHE_FILE)
+        provider.api.set_cache(cache)
+        provider.aapi.set_cache(cache)
+    if REQUEST_SCHEDULER_ENABLED:
+        provider.api.set_scheduler(Scheduler())
+        provider.aapi.set_scheduler(AsyncScheduler())
+    provider.api.set_token_file(TOKEN_FILE)
+    # 在后台预先和虾米的服务器建立连接，第一次请求时不用再等待握手
+    threading.Thread(target=provider.api.warm_up, name='xiami-warm-up',
+                     daemon=True).start()
+    lyric_store = LyricStore(LYRIC_STORE_FILE)
+    provider.api.set_lyric_store(lyric_store)
+    provider.aapi.set_lyric_store(lyric_store)
     app.library.register(provider)
+    playlist = getattr(app, 'playlist', None)
+    if playlist is not None:
+        # 播放列表中的歌曲在过期之前批量刷新播放链接
+        refresher = UrlRefresher(source=playlist.list)
+        playlist.song_changed.connect(refresher.refresh_soon, weak=False)
+        refresher.start()
+        app.__xiami_url_refresher = refresher
+        # 切歌时预取接下来几首歌曲的歌词
+        prefetcher = LyricPrefetcher(source=playlist.list)
+        playlist.song_changed.connect(prefetcher.on_song_changed, weak=False)
+        app.__xiami_lyric_prefetcher = prefetcher
+        if AUDIO_PREFETCH_ENABLED:
+            _enable_audio_prefetch(app, playlist)
     if app.mode & app.GuiMode:
         app.__ui_ctl = Xiami(app)
 
 
 def disable(app):
     app.library.deregister(provider)
+    refresher = getattr(app, '__xiami_url_refresher', None)
+    if refresher is not None:
+        app.playlist.song_changed.disconnect(refresher.refresh_soon)
+        refresher.stop()
+    prefetcher = getattr(app, '__xiami_lyric_prefetcher', None)
+    if prefetcher is not None:
+        app.playlist.song_changed.disconnect(prefetcher.on_song_changed)
+        prefetcher.shutdown()
+    audio_prefetcher = getattr(app, '__xiami_audio_prefetcher', None)
+    if audio_prefetcher is not None:
+        app.playlist.song_changed.disconnect(audio_prefetcher.on_song_changed)
+        audio_prefetcher.shutdown()
+    if provider.media_proxy is not None:
+        provider.media_proxy.stop()
+        provider.media_proxy = None
+    ui_ctl = getattr(app, '__ui_ctl', None)
+    if ui_ctl is not None:
+        provider.on_remote_search = None
+        ui_ctl._runner.shutdown()
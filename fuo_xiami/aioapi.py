@@ -0,0 +1,289 @@
+"""
+基于 asyncio 的虾米 API 客户端
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+AsyncAPI 和 API 的接口保持一致：同样的 action/payload（都定义在 endpoints
+模块中），同样的签名方式，同样的 token 过期重试逻辑，只是每个方法都是 coroutine。
+HTTP 层默认使用 aiohttp，它是一个可选依赖，只有真正发送请求时才会导入。
+"""
+
+import asyncio
+import logging
+
+from . import endpoints
+from .api import BaseAPI, _gen_url
+from .coalesce import AsyncCoalescer
+from .codec import loads
+from .excs import XiamiIOError
+from .retry import action_class, is_throttled
+from .transport import DEFAULT_POOL_MAXSIZE
+
+logger = logging.getLogger(__name__)
+
+_ClientTimeout = None
+
+
+def _client_timeout(total):
+    """aiohttp 的 timeout 参数需要是 ClientTimeout（传数字已经废弃）
+
+    兼容 aiohttp 接口的 session 不一定需要安装 aiohttp，这时原样返回 total。
+    """
+    global _ClientTimeout
+    if _ClientTimeout is None:
+        try:
+            import aiohttp
+        except ImportError:
+            _ClientTimeout = False
+        else:
+            _ClientTimeout = aiohttp.ClientTimeout
+    if _ClientTimeout is False:
+        return total
+    return _ClientTimeout(total=total)
+
+
+class AsyncAPI(BaseAPI):
+    """
+    和 API 共用签名、解析响应、缓存和重试的逻辑（参考 BaseAPI）。
+    token 在第一次请求时获取，过期时重新获取，不会保存到文件中，
+    也不会在后台提前刷新；API 的 iter_songs_detail、request_stream、
+    warm_up 等依赖同步 HTTP 的方法这里没有。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._token_lock = None
+        self._coalescer = AsyncCoalescer()
+
+    def set_http(self, http):
+        """设置 HTTP session
+
+        session 需要兼容 aiohttp.ClientSession 的 get 接口，
+        即 ``async with http.get(url, params=..., timeout=...) as resp``。
+        """
+        self._http = http
+
+    @property
+    def http(self):
+        if self._http is None:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit=DEFAULT_POOL_MAXSIZE,
+                                             keepalive_timeout=60)
+            self.set_http(aiohttp.ClientSession(headers=self._headers,
+                                                connector=connector))
+        return self._http
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    @property
+    def token_lock(self):
+        # asyncio.Lock 需要在事件循环中创建，所以这里延迟初始化
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        return self._token_lock
+
+    async def _fetch_token(self):
+        endpoint = endpoints.song_detail('1')
+        cookies = await self.request(endpoint.action, endpoint.payload,
+                                     need_token=False)
+        token, expires_at = self._parse_token(cookies)
+        self._req_token = token
+        self._req_token_expires_at = expires_at
+        return token
+
+    async def _ensure_token(self):
+        # 多个请求同时发现没有 token 时，只让其中一个去获取
+        async with self.token_lock:
+            if self._req_token is None:
+                await self._fetch_token()
+
+    async def request(self, action, payload, timeout=3,
+                      need_token=True, retry_on_tokenexpired=True,
+                      base_url=None):
+        """请求流程和 API.request 一致"""
+        if need_token is False:
+            return await self._request(action, payload, timeout,
+                                       need_token=False, base_url=base_url)
+
+        cached = self._get_cached(action, payload)
+        if cached is not None:
+            return cached
+        key = self._request_key(action, payload, base_url)
+        return await self._coalescer.do(key, lambda: self._request_with_retry(
+            action, payload, timeout,
+            retry_on_tokenexpired=retry_on_tokenexpired,
+            base_url=base_url))
+
+    async def _request_with_retry(self, action, payload, timeout, **kwargs):
+        retry = self._new_retry(action)
+        while True:
+            retry.before_attempt()
+            try:
+                result = await self._scheduled_request(action, payload, timeout,
+                                                       **kwargs)
+            except BaseException:
+                retry.on_error()
+                raise
+            delay = retry.on_result(result)
+            if delay is None:
+                return result
+            await asyncio.sleep(delay)
+
+    async def _scheduled_request(self, action, payload, timeout, **kwargs):
+        if self._scheduler is None:
+            return await self._request(action, payload, timeout, **kwargs)
+        async with self._scheduler.slot(action_class(action)) as slot:
+            result = await self._request(action, payload, timeout, **kwargs)
+            slot.throttled = result is not None and is_throttled(result[0])
+        return result
+
+    async def _request(self, action, payload, timeout,
+                       need_token=True, retry_on_tokenexpired=True,
+                       base_url=None):
+        if need_token is True and self._req_token is None:
+            await self._ensure_token()
+
+        url = _gen_url(action, base_url=base_url)
+        token = self._req_token
+        params = self._sign_payload(payload)
+        async with self.http.get(url, params=params,
+                                 timeout=_client_timeout(timeout)) as response:
+            if need_token is False:
+                return {name: morsel.value
+                        for name, morsel in response.cookies.items()}
+            # 虾米接口返回的 Content-Type 不一定是 application/json
+            rv = await response.json(content_type=None, loads=loads)
+
+        code, msg = self._parse_response(action, payload, rv)
+        if code == 'FAIL_SYS_TOKEN_EXOIRED':  # 刷新 token
+            async with self.token_lock:
+                # 其它请求可能已经刷新过 token 了
+                if self._req_token == token:
+                    await self._fetch_token()
+            if retry_on_tokenexpired:
+                return await self._request(action, payload, timeout,
+                                           retry_on_tokenexpired=False,
+                                           base_url=base_url)
+            return None
+        self._set_cached(action, payload, (code, msg, rv))
+        return code, msg, rv
+
+    async def _call(self, endpoint):
+        """参考 API._call"""
+        return endpoint.parse(await self.request(endpoint.action, endpoint.payload,
+                                                 base_url=endpoint.base_url))
+
+    # 用户登陆
+    async def login(self, email, password):
+        """
+        :password: user password md5 digest
+        """
+        code, msg, rv = await self._call(endpoints.login(email, password))
+        if code == 'SUCCESS':
+            accessToken = rv['data']['data']['accessToken']
+            self.set_access_token(accessToken)
+        return rv
+
+    async def search(self, keywords, type_=1, page=1, limit=30):
+        return await self._call(endpoints.search(keywords, type_, page, limit))
+
+    async def song_detail(self, song_id):
+        return await self._call(endpoints.song_detail(song_id))
+
+    async def songs_detail(self, song_ids, workers=None, on_missing=None):
+        """参考 API.songs_detail"""
+        chunks = [song_ids[start:start + 200]
+                  for start in range(0, len(song_ids), 200)]
+        semaphore = asyncio.Semaphore(workers or self.songs_detail_workers)
+
+        async def fetch(chunk):
+            async with semaphore:
+                return await self._songs_detail_chunk(chunk)
+
+        chunks_songs = await asyncio.gather(*[fetch(chunk) for chunk in chunks])
+        return self._merge_songs_chunks(chunks, chunks_songs, on_missing)
+
+    async def _songs_detail_chunk(self, song_ids):
+        try:
+            return await self._call(endpoints.songs(song_ids))
+        except (XiamiIOError, OSError, asyncio.TimeoutError) as e:
+            # aiohttp.ClientError 也是 OSError 的子类
+            logger.warning('songs_detail: request failed: {}'.format(e))
+            return []
+
+    async def song_lyric(self, song_id):
+        if self._lyric_store is not None:
+            content = self._lyric_store.get(song_id)
+            if content is not None:
+                return content
+        content = await self._call(endpoints.song_lyric(song_id))
+        if self._lyric_store is not None:
+            self._lyric_store.set(song_id, content)
+        return content
+
+    async def mv_detail(self, mv_id):
+        return await self._call(endpoints.mv_detail(mv_id))
+
+    async def album_detail(self, album_id):
+        return await self._call(endpoints.album_detail(album_id))
+
+    async def artist_detail(self, artist_id):
+        return await self._call(endpoints.artist_detail(artist_id))
+
+    async def artist_songs(self, artist_id, page=1, page_size=50):
+        return await self._call(endpoints.artist_songs(artist_id, page, page_size))
+
+    async def artist_albums(self, artist_id, page=1, page_size=20):
+        return await self._call(endpoints.artist_albums(artist_id, page, page_size))
+
+    async def playlist_detail(self, playlist_id):
+        return await self._call(endpoints.playlist_detail(playlist_id))
+
+    async def playlist_detail_v2(self, playlist_id, page=1, page_size=200):
+        return await self._call(
+            endpoints.playlist_detail_v2(playlist_id, page, page_size))
+
+    async def user_detail(self, user_id):
+        return await self._call(endpoints.user_detail(user_id))
+
+    async def user_playlists(self, user_id, page=1, limit=30):
+        return await self._call(endpoints.user_playlists(user_id, page, limit))
+
+    async def user_favorite_playlists(self, user_id, page=1, limit=30):
+        return await self._call(
+            endpoints.user_favorite_playlists(user_id, page, limit))
+
+    async def user_favorite_songs(self, user_id, page=1, page_size=50):
+        return await self._call(
+            endpoints.user_favorite_songs(user_id, page, page_size))
+
+    async def update_favorite_song(self, song_id, op):
+        return await self._call(endpoints.update_favorite_song(song_id, op))
+
+    async def update_playlist_song(self, playlist_id, song_id, op):
+        return await self._call(
+            endpoints.update_playlist_song(playlist_id, song_id, op))
+
+    async def user_favorite_artists(self, user_id, page=1, page_size=50):
+        return await self._call(
+            endpoints.user_favorite_artists(user_id, page, page_size))
+
+    async def user_favorite_albums(self, user_id, page=1, page_size=50):
+        return await self._call(
+            endpoints.user_favorite_albums(user_id, page, page_size))
+
+    async def personal_fm(self):
+        return await self._call(endpoints.personal_fm())
+
+    async def recommend_songs(self):
+        return await self._call(endpoints.recommend_songs())
+
+    async def recommend_playlists(self):
+        return await self._call(endpoints.recommend_playlists())
+
+    async def recent_song_playlog(self, user_id, page=1, page_size=200):
+        return await self._call(
+            endpoints.recent_song_playlog(user_id, page, page_size))
@@ -1,16 +1,38 @@
+import os
 import time
 import hashlib
 import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+from . import endpoints
+from .coalesce import Coalescer
+from .codec import RequestStrEncoder, response_json
+from .endpoints import BASE_URL_H5, BASE_URL_ACS
 from .excs import XiamiIOError
+from .retry import (
+    action_class,
+    is_throttled,
+    CircuitBreaker,
+    Retry,
+    DEFAULT_RETRY_POLICY,
+    RETRY_POLICIES,
+)
+from .scheduler import current_priority, run_with_priority
+from .stream import ListResponseStream
+from .transport import PooledSession
 
 logger = logging.getLogger(__name__)
 
-BASE_URL_H5 = 'http://h5api.m.xiami.com'
-BASE_URL_ACS = 'https://acs.m.xiami.com'
+#: 签名使用的 token 保存在这两个 cookie 中
+TOKEN_COOKIE_NAMES = ('_m_h5_tk', '_m_h5_tk_enc')
+#: 根据观察，token 一般是 7 天过期
+TOKEN_TTL = 7 * 24 * 60 * 60
+#: 在 token 过期之前多久开始刷新 token
+TOKEN_REFRESH_AHEAD = 12 * 60 * 60
 
 
 def _gen_url(action, base_url=None):
@@ -19,7 +41,12 @@ def _gen_url(action, base_url=None):
     return base_url + '/h5/{}/1.0/'.format(action)
 
 
-class API(object):
+class BaseAPI(object):
+    """API 和 AsyncAPI（参考 aioapi 模块）共用的部分
+
+    包括签名、解析响应、缓存、重试和熔断的状态等，不涉及发送请求。
+    """
+
     def __init__(self):
         self._headers = {
             'Accept': '*/*',
@@ -35,34 +62,97 @@ class API(object):
         self._cookies = {}
         self._app_key = '23649156'  # NOTE: appId 和 app_key 是配对使用
         self._req_header = {'appId': 200, 'platformId': 'h5'}
+        self._request_str_encoder = RequestStrEncoder()
         self._req_token = None
+        self._req_token_expires_at = None
         self._http = None
+        self._cache = None
+        self._lyric_store = None
+        #: action 类别 -> RetryPolicy，参考 fuo_xiami.retry
+        self.retry_policies = RETRY_POLICIES.copy()
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        #: 默认不调度、不限速，参考 set_scheduler
+        self._scheduler = None
+        #: 熔断器状态变化时的回调，参数为 (breaker, old, new)
+        self.on_breaker_state_change = None
+        #: songs_detail 并发请求的数量
+        self.songs_detail_workers = 4
+
+    @property
+    def coalesced_requests(self):
+        """因为合并而省掉的请求数"""
+        return self._coalescer.coalesced
+
+    def breaker_stats(self):
+        """各类 action 的熔断器状态，以及状态变化的次数"""
+        with self._breakers_lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.stats() for breaker in breakers}
+
+    def _breaker(self, action):
+        name = action_class(action)
+        with self._breakers_lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(
+                    name, on_state_change=self._on_breaker_state_change)
+        return breaker
+
+    def _on_breaker_state_change(self, breaker, old, new):
+        if self.on_breaker_state_change is not None:
+            self.on_breaker_state_change(breaker, old, new)
+
+    def _new_retry(self, action):
+        policy = self.retry_policies.get(action_class(action), DEFAULT_RETRY_POLICY)
+        return Retry(action, policy, self._breaker(action))
 
     def set_access_token(self, access_token):
         self._req_header['accessToken'] = access_token
 
-    def set_http(self, http):
-        self._http = http
-        self._http.headers.update(self._headers)
+    def set_cache(self, cache):
+        """设置响应缓存，参考 fuo_xiami.cache.ResponseCache
+
+        :param cache: 为 None 时不使用缓存
+        """
+        self._cache = cache
+
+    def set_lyric_store(self, store):
+        """设置歌词存储，参考 fuo_xiami.lyric.LyricStore
+
+        :param store: 为 None 时不保存歌词
+        """
+        self._lyric_store = store
+
+    def set_scheduler(self, scheduler):
+        """设置请求调度器，参考 fuo_xiami.scheduler.Scheduler
+
+        :param scheduler: 为 None 时不做任何调度和限速
+        """
+        self._scheduler = scheduler
 
     @property
-    def http(self):
-        # TODO: 将来可能会使用是一个全局唯一的 Request 对象
-        # 目前开发时，我们默认未来的 Request 对象接口兼容官方 requests
-        if self._http is None:
-            self.set_http(requests.Session())
-        return self._http
+    def scheduler(self):
+        return self._scheduler
+
+    def _get_cached(self, action, payload):
+        if self._cache is None:
+            return None
+        return self._cache.get(action, payload,
+                               salt=self._req_header.get('accessToken', ''))
+
+    def _set_cached(self, action, payload, value):
+        if self._cache is not None:
+            self._cache.set(action, payload, value,
+                            salt=self._req_header.get('accessToken', ''))
 
     def _sign_payload(self, payload):
         """使用 appkey 对 payload 进行签名，返回新的请求参数
         """
         app_key = self._app_key
         t = int(time.time() * 1000)
-        request_str = {
-            'header': self._req_header,
-            'model': payload
-        }
-        data = json.dumps({'requestStr': json.dumps(request_str)})
+        # 等价于 json.dumps({'requestStr': json.dumps({'header': ..., 'model': ...})})
+        data = self._request_str_encoder.encode(self._req_header, payload)
         data_str = '{}&{}&{}&{}'.format(self._req_token, t, app_key, data)
         sign = hashlib.md5(data_str.encode('utf-8')).hexdigest()
         params = {
@@ -73,11 +163,202 @@ class API(object):
         }
         return params
 
-    def _fetch_token(self):
-        action = 'mtop.alimusic.music.songservice.getsongdetail'
-        token = self.request(action, {'songId': '1'}, need_token=False)
+    @staticmethod
+    def _parse_token(cookies):
+        """从响应 cookie 中解析出 token 和它的过期时间
+
+        _m_h5_tk 的格式为 ``{token}_{timestamp in ms}``。
+
+        :param dict cookies: 响应中的 cookie，name -> value
+        """
+        token, _, timestamp = cookies['_m_h5_tk'].partition('_')
+        now = time.time()
+        try:
+            expires_at = int(timestamp) / 1000
+        except ValueError:
+            expires_at = now + TOKEN_TTL
+        # 时间戳不一定是过期时间，这里保证它是一个合理的值
+        if not now < expires_at <= now + TOKEN_TTL:
+            expires_at = now + TOKEN_TTL
+        return token, expires_at
+
+    def _parse_response(self, action, payload, rv):
+        """检查响应中的 ret 字段，返回 (code, msg)
+
+        对于不可恢复的错误，直接抛出 XiamiIOError；token 过期由调用方处理。
+        """
+        code, _, msg = rv['ret'][0].partition('::')
+        if not msg and len(rv['ret']) > 1:
+            # for exmample:
+            # ['FAIL_SYS_USER_VALIDATE', 'RGV587_ERROR::SM::哎哟喂,被挤爆啦,请稍后重试']
+            msg = rv['ret'][1]
+        # app id 和 key 不匹配，一般应该不会出现这种情况
+        if code == 'FAIL_SYS_PARAMINVALID_ERROR':
+            raise XiamiIOError('unexpected error, app id or app key mismatch')
+        elif code == 'FAIL_BIZ_GLOBAL_NEED_LOGIN':
+            # TODO: 单独定义一个 Exception
+            raise XiamiIOError('you need login first')
+        elif code == 'FAIL_SYS_WJAS_DENIED':
+            # FAIL_SYS_WJAS_DENIED::请下载升级最新版本APP
+            raise XiamiIOError('this API is unavailable anymore')
+        elif is_throttled(code):
+            # 由 Retry 负责重试
+            logger.info('Xiami request throttled: {}, {}'.format(code, msg))
+        elif code not in ('SUCCESS', 'FAIL_SYS_TOKEN_EXOIRED'):
+            logger.warning('Xiami request failed:: '
+                           'req_action: {}, req_payload: {}\n'
+                           'response: {}'
+                           .format(action, payload, rv))
+        return code, msg
+
+    def _request_key(self, action, payload, base_url):
+        """相同 key 的请求会得到相同的结果"""
+        return (action,
+                json.dumps(payload, sort_keys=True),
+                base_url,
+                self._req_header.get('accessToken'))
+
+    @staticmethod
+    def _merge_songs_chunks(chunks, chunks_songs, on_missing=None):
+        """按 id 顺序合并各批次的结果，并报告缺失的歌曲"""
+        songs = []
+        for i, (chunk, chunk_songs) in enumerate(zip(chunks, chunks_songs)):
+            id_song_map = {str(song['songId']): song for song in chunk_songs}
+            missing_ids = []
+            for song_id in chunk:
+                song = id_song_map.get(str(song_id))
+                if song is None:
+                    missing_ids.append(song_id)
+                else:
+                    songs.append(song)
+            if missing_ids:
+                logger.warning('songs_detail: {} songs of chunk {} are missing'
+                               .format(len(missing_ids), i))
+                if on_missing is not None:
+                    on_missing(i, missing_ids)
+        return songs
+
+
+class API(BaseAPI):
+    def __init__(self):
+        super().__init__()
+        self._token_lock = threading.Lock()
+        self._token_file = None
+        self._token_auto_refresh = False
+        self._token_timer = None
+        self._coalescer = Coalescer()
+
+    def set_http(self, http):
+        self._http = http
+        self._http.headers.update(self._headers)
+
+    @property
+    def http(self):
+        # TODO: 将来可能会使用是一个全局唯一的 Request 对象
+        # 目前开发时，我们默认未来的 Request 对象接口兼容官方 requests
+        if self._http is None:
+            # 连接池的大小和最大并发数保持一致，避免连接用完即弃
+            maxsize = max(self._scheduler.max_concurrency if self._scheduler else 0,
+                          self.songs_detail_workers) * 2
+            self.set_http(PooledSession(pool_maxsize=maxsize))
+        return self._http
+
+    def warm_up(self):
+        """预先和虾米的服务器建立连接，session 不支持时什么也不做"""
+        warm_up = getattr(self.http, 'warm_up', None)
+        if warm_up is not None:
+            warm_up([BASE_URL_H5, BASE_URL_ACS])
+
+    def transport_stats(self):
+        """连接池的使用情况，session 不支持时返回 None"""
+        stats = getattr(self.http, 'stats', None)
+        return stats() if stats is not None else None
+
+    def set_token_file(self, path, auto_refresh=True):
+        """持久化 token
+
+        如果文件中的 token 还没有过期，直接使用它，省去一次获取 token 的请求；
+        之后每次获取到新的 token，都会写入这个文件。
+
+        :param auto_refresh: 是否在 token 过期之前，在后台刷新 token
+        """
+        self._token_file = path
+        self._token_auto_refresh = auto_refresh
+        self._load_token()
+
+    def _load_token(self):
+        if not os.path.exists(self._token_file):
+            return
+        try:
+            with open(self._token_file) as f:
+                data = json.load(f)
+            token, expires_at = data['token'], data['expires_at']
+            cookies = data['cookies']
+        except (OSError, ValueError, KeyError):
+            logger.warning('invalid token file: {}'.format(self._token_file))
+            return
+        if expires_at <= time.time():
+            return
+        for name, value in cookies.items():
+            self.http.cookies.set(name, value)
+        self._set_token(token, expires_at)
+
+    def _dump_token(self, cookies):
+        data = {
+            'token': self._req_token,
+            'expires_at': self._req_token_expires_at,
+            'cookies': {name: cookies[name]
+                        for name in TOKEN_COOKIE_NAMES if name in cookies},
+        }
+        try:
+            with open(self._token_file, 'w') as f:
+                json.dump(data, f)
+        except OSError:
+            logger.exception('dump token failed')
+
+    def _set_token(self, token, expires_at):
         self._req_token = token
-        return token
+        self._req_token_expires_at = expires_at
+        if self._token_auto_refresh:
+            self._schedule_token_refresh()
+
+    def _schedule_token_refresh(self, delay=None):
+        if self._token_timer is not None:
+            self._token_timer.cancel()
+        if delay is None:
+            delay = max(self._req_token_expires_at - TOKEN_REFRESH_AHEAD - time.time(),
+                        0)
+        self._token_timer = threading.Timer(delay, self._refresh_token)
+        self._token_timer.daemon = True
+        self._token_timer.start()
+
+    def _refresh_token(self):
+        logger.info('token will expire soon, refresh it')
+        try:
+            self._fetch_token(stale=self._req_token)
+        except Exception:  # noqa
+            logger.exception('refresh token failed, retry later')
+            self._schedule_token_refresh(delay=10 * 60)
+
+    def _fetch_token(self, stale=None):
+        """获取一个新的 token
+
+        多个线程同时发现 token 失效时，只有一个线程会真正发送请求，
+        其它线程等待并复用它获取到的 token。
+
+        :param stale: 调用方认为已经失效的 token。如果当前的 token
+            已经不是它，说明其它线程刷新过了，直接返回当前 token。
+        """
+        with self._token_lock:
+            if self._req_token != stale:
+                return self._req_token
+            endpoint = endpoints.song_detail('1')
+            cookies = self.request(endpoint.action, endpoint.payload, need_token=False)
+            token, expires_at = self._parse_token(cookies)
+            self._set_token(token, expires_at)
+            if self._token_file is not None:
+                self._dump_token(cookies)
+            return token
 
     def request(self, action, payload, timeout=3,
                 need_token=True, retry_on_tokenexpired=True,
@@ -86,67 +367,126 @@ class API(object):
         虾米 API 请求流程：
 
         1. 获取一个 token：这里 need_token 为 False 时，意为获取 token，
-           根据观察，这个 token 一般是 7 天过期
+           此时返回响应中的 cookie。根据观察，这个 token 一般是 7 天过期
         2. 对请求签名：见 _sign_payload 方法
         3. 发送请求
+
+        同时发出的相同请求（action 和 payload 都相同）会被合并成一个。
+        被限流时会按照 retry_policies 退避重试，重试失败或者熔断时抛出
+        XiamiThrottledError。
+        """
+        if need_token is False:
+            return self._request(action, payload, timeout,
+                                 need_token=False, base_url=base_url)
+
+        cached = self._get_cached(action, payload)
+        if cached is not None:
+            return cached
+        key = self._request_key(action, payload, base_url)
+        return self._coalescer.do(key, lambda: self._request_with_retry(
+            action, payload, timeout,
+            retry_on_tokenexpired=retry_on_tokenexpired,
+            base_url=base_url))
+
+    def _request_with_retry(self, action, payload, timeout, **kwargs):
+        retry = self._new_retry(action)
+        while True:
+            retry.before_attempt()
+            try:
+                result = self._scheduled_request(action, payload, timeout, **kwargs)
+            except BaseException:
+                retry.on_error()
+                raise
+            delay = retry.on_result(result)
+            if delay is None:
+                return result
+            time.sleep(delay)
+
+    def _scheduled_request(self, action, payload, timeout, **kwargs):
+        if self._scheduler is None:
+            return self._request(action, payload, timeout, **kwargs)
+        with self._scheduler.slot(action_class(action)) as slot:
+            result = self._request(action, payload, timeout, **kwargs)
+            slot.throttled = result is not None and is_throttled(result[0])
+        return result
+
+    def request_stream(self, action, payload, timeout=3, base_url=None,
+                       chunk_size=16 * 1024):
+        """以流的方式请求列表类接口，返回一个 ListResponseStream
+
+        遍历返回值时才会真正发送请求，参考 fuo_xiami.stream。
+        流式请求不经过缓存和请求合并；请求失败时（比如 token 过期）
+        会回退到 request 方法，由它负责刷新 token 和重试。
         """
+        def open_chunks():
+            if self._req_token is None:
+                self._fetch_token()
+            url = _gen_url(action, base_url=base_url)
+            params = self._sign_payload(payload)
+            # 只在建立连接、发送请求时占用调度器的名额，
+            # 读取响应的速度取决于调用方
+            if self._scheduler is None:
+                response = self.http.get(url, params=params, timeout=timeout,
+                                         stream=True)
+            else:
+                with self._scheduler.slot(action_class(action)):
+                    response = self.http.get(url, params=params, timeout=timeout,
+                                             stream=True)
+            try:
+                yield from response.iter_content(chunk_size)
+            finally:
+                response.close()
+
+        def fallback():
+            _, _, rv = self.request(action, payload, timeout, base_url=base_url)
+            return rv.get('data', {}).get('data')
+
+        return ListResponseStream(open_chunks, fallback=fallback)
+
+    def _request(self, action, payload, timeout,
+                 need_token=True, retry_on_tokenexpired=True, base_url=None):
         if need_token is True and self._req_token is None:  # 获取 token
             self._fetch_token()
 
         url = _gen_url(action, base_url=base_url)
+        token = self._req_token
         params = self._sign_payload(payload)
         response = self.http.get(url, params=params,
                                  timeout=timeout)
-        # if need_token is False, this request must be used for fetching token
+        # if need_token is False, this request must be used for fetching token,
+        # return the cookies which contain the token
         if need_token is False:
-            resp_cookies = response.cookies.get_dict()
-            m_h5_tk = resp_cookies['_m_h5_tk']
-            return m_h5_tk.split('_')[0]
+            return response.cookies.get_dict()
 
-        rv = response.json()
-        ret0 = rv['ret'][0].split('::')
-
-        if len(ret0) > 1:
-            code, msg = ret0
-        else:
-            # for exmample:
-            # ['FAIL_SYS_USER_VALIDATE', 'RGV587_ERROR::SM::哎哟喂,被挤爆啦,请稍后重试']
-            code, msg = ret0, ''
-        # app id 和 key 不匹配，一般应该不会出现这种情况
-        if code == 'FAIL_SYS_PARAMINVALID_ERROR':
-            raise XiamiIOError('unexpected error, app id or app key mismatch')
-        elif code == 'FAIL_SYS_TOKEN_EXOIRED':  # 刷新 token
-            self._fetch_token()
+        rv = response_json(response)
+        code, msg = self._parse_response(action, payload, rv)
+        if code == 'FAIL_SYS_TOKEN_EXOIRED':  # 刷新 token
+            self._fetch_token(stale=token)
             if retry_on_tokenexpired:
-                return self.request(action, payload, timeout=timeout,
-                                    retry_on_tokenexpired=False)
-        elif code == 'FAIL_BIZ_GLOBAL_NEED_LOGIN':
-            # TODO: 单独定义一个 Exception
-            raise XiamiIOError('you need login first')
-        elif code == 'FAIL_SYS_WJAS_DENIED':
-            # FAIL_SYS_WJAS_DENIED::请下载升级最新版本APP
-            raise XiamiIOError('this API is unavailable anymore')
-        else:
-            if code != 'SUCCESS':
-                logger.warning('Xiami request failed:: '
-                               'req_action: {}, req_payload: {}\n'
-                               'response: {}'
-                               .format(action, payload, rv))
-            return code, msg, rv
+                return self._request(action, payload, timeout,
+                                     retry_on_tokenexpired=False,
+                                     base_url=base_url)
+            return None
+        self._set_cached(action, payload, (code, msg, rv))
+        return code, msg, rv
+
+    def _call(self, endpoint, stream=False):
+        """请求 endpoint（参考 fuo_xiami.endpoints），返回 endpoint.parse 的结果
+
+        :param stream: 为 True 时返回 ListResponseStream，参考 request_stream
+        """
+        if stream:
+            return self.request_stream(endpoint.action, endpoint.payload,
+                                       base_url=endpoint.base_url)
+        return endpoint.parse(self.request(endpoint.action, endpoint.payload,
+                                           base_url=endpoint.base_url))
 
     # 用户登陆
     def login(self, email, password):
         """
         :password: user password md5 digest
         """
-        payload = {
-            'account': email,
-            'password': password
-        }
-        code, msg, rv = self.request(
-            'mtop.alimusic.xuser.facade.xiamiuserservice.login',
-            payload
-        )
+        code, msg, rv = self._call(endpoints.login(email, password))
         if code == 'SUCCESS':
             # TODO: 保存 refreshToken 和过期时间等更多信息
             # 根据目前观察，token 过期时间有三年
@@ -154,99 +494,88 @@ class API(object):
             self.set_access_token(accessToken)
         return rv  # rv -> return value
 
-    def search(self, keywords, type_=1, page=1, limit=30):
-        if type_ == 1:
-            action = 'mtop.alimusic.search.searchservice.searchsongs'
-        elif type_ == 10:
-            action = 'mtop.alimusic.search.searchservice.searchalbums'
-        elif type_ == 100:
-            action = 'mtop.alimusic.search.searchservice.searchartists'
-        elif type_ == 1000:
-            action = 'mtop.alimusic.search.searchservice.searchcollects'
-        else:
-            raise ValueError('invalid type_:%d', type_)
-
-        payload = {
-            'key': keywords,
-            'pagingVO': {
-                'page': page,
-                'pageSize': limit
-            }
-        }
-        _, _, rv = self.request(action, payload, base_url=BASE_URL_ACS)
-        return rv['data']['data']
+    def search(self, keywords, type_=1, page=1, limit=30, stream=False):
+        return self._call(endpoints.search(keywords, type_, page, limit),
+                          stream=stream)
 
     def song_detail(self, song_id):
-        action = 'mtop.alimusic.music.songservice.getsongdetail'
-        payload = {'songId': song_id}
-        code, msg, rv = self.request(action, payload)
-        if code == 'SUCCESS':
-            return rv['data']['data']['songDetail']
-        return None
+        return self._call(endpoints.song_detail(song_id))
 
-    def songs_detail(self, song_ids):
-        action = 'mtop.alimusic.music.songservice.getsongs'
-        songs = []
-        # FIXME: 这里写个 for 循环可能会有点问题
-        for start in range(0, len(song_ids), 200):
-            payload = {'songIds': song_ids[start:min(start + 200, len(song_ids))]}
-            code, msg, rv = self.request(action, payload)
-            songs.extend(rv['data']['data']['songs'])
-        return songs
+    def songs_detail(self, song_ids, workers=None, on_missing=None):
+        """批量获取歌曲详情
+
+        歌曲 id 每 200 个分为一批，各批次并发请求，返回结果的顺序和
+        song_ids 保持一致。服务端没有返回的歌曲（或者整批请求失败）
+        不会导致整个调用失败，而是按批次通过 on_missing 回调报告。
+
+        :param workers: 并发数，默认为 self.songs_detail_workers
+        :param on_missing: ``on_missing(chunk_index, missing_ids)``
+        """
+        chunks, chunks_songs = [], []
+        for chunk, chunk_songs in self.iter_songs_detail(song_ids, workers):
+            chunks.append(chunk)
+            chunks_songs.append(chunk_songs)
+        return self._merge_songs_chunks(chunks, chunks_songs, on_missing)
+
+    def iter_songs_detail(self, song_ids, workers=None):
+        """和 songs_detail 一样分批并发请求，按顺序返回 ``(chunk, songs)``
+
+        每一批的结果一返回（并且它之前的批次都已经返回）就交给调用方，
+        调用方可以逐步展示结果。请求失败的批次 songs 为空列表。
+        """
+        chunks = [song_ids[start:start + 200]
+                  for start in range(0, len(song_ids), 200)]
+        if not chunks:
+            return
+        workers = min(workers or self.songs_detail_workers, len(chunks))
+        if workers <= 1:
+            for chunk in chunks:
+                yield chunk, self._songs_detail_chunk(chunk)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # 工作线程使用和调用方相同的优先级
+            priority = current_priority()
+            chunks_songs = executor.map(
+                lambda chunk: run_with_priority(
+                    priority, self._songs_detail_chunk, chunk),
+                chunks)
+            yield from zip(chunks, chunks_songs)
+
+    def _songs_detail_chunk(self, song_ids):
+        try:
+            return self._call(endpoints.songs(song_ids))
+        except (XiamiIOError, requests.RequestException) as e:
+            logger.warning('songs_detail: request failed: {}'.format(e))
+            return []
 
     def song_lyric(self, song_id):
-        action = 'mtop.alimusic.music.lyricservice.getsonglyrics'
-        payload = {'songId': song_id}
-        code, msg, rv = self.request(action, payload)
-        for lyric in rv['data']['data']['lyrics']:
-            if int(lyric['type']) == 2:
-                return lyric['content']
-        return ''
+        if self._lyric_store is not None:
+            content = self._lyric_store.get(song_id)
+            if content is not None:
+                return content
+        content = self._call(endpoints.song_lyric(song_id))
+        if self._lyric_store is not None:
+            self._lyric_store.set(song_id, content)
+        return content
 
     def mv_detail(self, mv_id):
-        action = 'mtop.alimusic.music.mvservice.getmvdetail'
-        payload = {'mvId': mv_id}
-        _, _, rv = self.request(action, payload)
-        # 当 id 不存在时，rv['data']['data'] 为空字典
-        return rv['data']['data'].get('mvDetailVO')
+        return self._call(endpoints.mv_detail(mv_id))
 
     # 专辑详情 专辑评论
     def album_detail(self, album_id):
-        action = 'mtop.alimusic.music.albumservice.getalbumdetail'
-        payload = {'albumId': album_id}
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']['albumDetail']
+        return self._call(endpoints.album_detail(album_id))
 
     # 歌手详情 歌手专辑 歌手歌曲 歌手评论
     def artist_detail(self, artist_id):
-        action = 'mtop.alimusic.music.artistservice.getartistdetail'
-        payload = {'artistId': artist_id}
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']['artistDetailVO']
-
-    def artist_songs(self, artist_id, page=1, page_size=50):
-        action = 'mtop.alimusic.music.songservice.getartistsongs'
-        payload = {
-            'artistId': artist_id,
-            'pagingVO': {
-                'page': page,
-                'pageSize': page_size
-            }
-        }
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']
-
-    def artist_albums(self, artist_id, page=1, page_size=20):
-        action = 'mtop.alimusic.music.albumservice.getartistalbums'
-        payload = {
-            'artistId': artist_id,
-            'pagingVO': {
-                'page': page,
-                'pageSize': page_size
-            }
-        }
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']
+        return self._call(endpoints.artist_detail(artist_id))
+
+    def artist_songs(self, artist_id, page=1, page_size=50, stream=False):
+        return self._call(endpoints.artist_songs(artist_id, page, page_size),
+                          stream=stream)
+
+    def artist_albums(self, artist_id, page=1, page_size=20, stream=False):
+        return self._call(endpoints.artist_albums(artist_id, page, page_size),
+                          stream=stream)
 
     def playlist_detail(self, playlist_id):
         """获取歌单详情
@@ -254,90 +583,43 @@ class API(object):
         如果歌单歌曲数超过 100 时，该接口的 songs 字段不会包含所有歌曲，
         但是它有个 allSongs 字段，会包含所有歌曲的 ID。
         """
-        action = 'mtop.alimusic.music.list.collectservice.getcollectdetail'
-        payload = {'listId': playlist_id}
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']['collectDetail']
+        return self._call(endpoints.playlist_detail(playlist_id))
 
-    def playlist_detail_v2(self, playlist_id, page=1, page_size=200):
+    def playlist_detail_v2(self, playlist_id, page=1, page_size=200, stream=False):
         """获取歌单详情
 
         NOTE: 当设置 limit 大于 200 时，虾米服务端好像会忽略这个设置，将 limit 设为 200
         """
-        action = 'mtop.alimusic.music.list.collectservice.getcollectsongs'
-        payload = {
-            'listId': playlist_id,
-            'pagingVO': {
-                'page': page,
-                'pageSize': page_size
-            }
-        }
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']
+        return self._call(endpoints.playlist_detail_v2(playlist_id, page, page_size),
+                          stream=stream)
 
     # 用户详情 用户歌单 用户收藏(歌曲 专辑 歌手 歌单)
     def user_detail(self, user_id):
-        action = 'mtop.alimusic.xuser.facade.xiamiuserservice.getuserinfobyuserid'
-        payload = {'userId': user_id}
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']
+        return self._call(endpoints.user_detail(user_id))
 
     def user_playlists(self, user_id, page=1, limit=30):
         """
         NOTE: 用户歌单有可能是仅自己可见
         """
-        action = 'mtop.alimusic.music.list.collectservice.getcollectbyuser'
-        payload = {
-            'userId': user_id,
-            'pagingVO': {
-                'page': page,
-                'pageSize': limit
-            }
-        }
-        code, msg, rv = self.request(action, payload)
         # TODO: 支持获取更多
-        return rv['data']['data']['collects']
+        return self._call(endpoints.user_playlists(user_id, page, limit))
 
     def user_favorite_playlists(self, user_id, page=1, limit=30):
-        action = 'mtop.alimusic.fav.collectfavoriteservice.getfavoritecollects'
-        payload = {
-            'userId': user_id,
-            'pagingVO': {
-                'page': page,
-                'pageSize': limit
-            }
-        }
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']['collects']
+        return self._call(endpoints.user_favorite_playlists(user_id, page, limit))
 
-    def user_favorite_songs(self, user_id, page=1, page_size=50):
+    def user_favorite_songs(self, user_id, page=1, page_size=50, stream=False):
         """获取用户收藏的歌曲
 
         NOTE: 当设置 limit 大于 200 时，虾米服务端好像会忽略这个设置，将 limit 设为 20
         """
-        action = 'mtop.alimusic.fav.songfavoriteservice.getfavoritesongs'
-        payload = {
-            'userId': user_id,
-            'pagingVO': {
-                'page': page,
-                'pageSize': page_size
-            }
-        }
-        code, msg, rv = self.request(action, payload)
-        # TODO: 支持获取更多
-        return rv['data']['data']
+        return self._call(endpoints.user_favorite_songs(user_id, page, page_size),
+                          stream=stream)
 
     def update_favorite_song(self, song_id, op):
         """
         :param str op: `add` or `del`
         """
-        op = 'un' if op == 'del' else ''
-        action = 'mtop.alimusic.fav.songfavoriteservice.{}favoritesong'.format(op)
-        payload = {
-            'songId': song_id
-        }
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']['status'] == 'true'
+        return self._call(endpoints.update_favorite_song(song_id, op))
 
     def update_playlist_song(self, playlist_id, song_id, op):
         """从播放列表删除或者增加一首歌曲
@@ -345,80 +627,36 @@ class API(object):
         如果歌曲不存在与歌单中，删除时返回 True；如果歌曲已经存在于
         歌单，添加时也返回 True。
         """
-        action = 'mtop.alimusic.music.list.collectservice.{}songs'.format(
-            'delete' if op == 'del' else 'add')
-        payload = {
-            'listId': playlist_id,
-            'songIds': [song_id]
-        }
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']['success'] == 'true'
+        return self._call(endpoints.update_playlist_song(playlist_id, song_id, op))
 
-    def user_favorite_artists(self, user_id, page=1, page_size=50):
+    def user_favorite_artists(self, user_id, page=1, page_size=50, stream=False):
         """获取用户收藏的歌手
 
         NOTE: 当设置 limit 大于 200 时，虾米服务端好像会忽略这个设置，将 limit 设为 20
         """
-        action = 'mtop.alimusic.fav.artistfavoriteservice.getfavoriteartists'
-        payload = {
-            'userId': user_id,
-            'pagingVO': {
-                'page': page,
-                'pageSize': page_size
-            }
-        }
-        code, msg, rv = self.request(action, payload)
-        # TODO: 支持获取更多
-        return rv['data']['data']
+        return self._call(endpoints.user_favorite_artists(user_id, page, page_size),
+                          stream=stream)
 
-    def user_favorite_albums(self, user_id, page=1, page_size=50):
+    def user_favorite_albums(self, user_id, page=1, page_size=50, stream=False):
         """获取用户收藏的专辑
 
         NOTE: 当设置 limit 大于 200 时，虾米服务端好像会忽略这个设置，将 limit 设为 20
         """
-        action = 'mtop.alimusic.fav.albumfavoriteservice.getfavoritealbums'
-        payload = {
-            'userId': user_id,
-            'pagingVO': {
-                'page': page,
-                'pageSize': page_size
-            }
-        }
-        code, msg, rv = self.request(action, payload)
-        # TODO: 支持获取更多
-        return rv['data']['data']
+        return self._call(endpoints.user_favorite_albums(user_id, page, page_size),
+                          stream=stream)
 
     # 私人FM 每日推荐歌曲 每日推荐歌单
     def personal_fm(self):
-        action = 'mtop.alimusic.music.radio.getradiosongs'
-        payload = {
-            'radioType': 1
-        }
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']['list']
+        return self._call(endpoints.personal_fm())
 
     def recommend_songs(self):
-        action = 'mtop.alimusic.recommend.songservice.getdailysongs'
-        code, msg, rv = self.request(action, dict())
-        return rv['data']['data']['songs']
+        return self._call(endpoints.recommend_songs())
 
     def recommend_playlists(self):
-        action = 'mtop.alimusic.music.list.collectservice.getcollects'
-        code, msg, rv = self.request(action, dict())
-        return rv['data']['data']['collects']
+        return self._call(endpoints.recommend_playlists())
 
     def recent_song_playlog(self, user_id, page=1, page_size=200):
-        action = 'mtop.alimusic.playlog.facade.playlogservice.getrecentsongplaylog'
-        payload = {
-            'userId': user_id,
-            'fullView': 1,
-            'pagingVO': {
-                'page': page,
-                'pageSize': page_size,
-            }
-        }
-        code, msg, rv = self.request(action, payload)
-        return rv['data']['data']
+        return self._call(endpoints.recent_song_playlog(user_id, page, page_size))
 
 
 api = API()
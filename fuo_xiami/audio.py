@@ -0,0 +1,411 @@
+"""
+音频开头预取
+~~~~~~~~~~~~
+
+切歌之后，播放器要先连接虾米的 CDN、下载一段数据才能开始播放，网络不好时
+要等一两秒。
+
+- HeadCache：基于 SQLite 的磁盘缓存，保存歌曲某个音质的前几百 KB，
+  总大小超出上限时淘汰最久没有被访问的；
+- AudioPrefetcher：切歌时通过 HTTP Range 请求下载播放列表中接下来几首歌曲
+  （按照播放器的音质策略选择音质）的开头；
+- HeadProxy：本地的 HTTP 服务。开头已经缓存时，XSongModel.get_media
+  返回它的地址，它先从缓存中返回开头的数据，再用 Range 请求从远程获取剩下
+  的部分，播放器看到的是一个完整的、支持 seek 的文件。缓存中没有的歌曲
+  仍然使用原来的链接。
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+import requests
+from fuocore.media import Media
+
+from .prefetch import QueuePrefetcher
+from .provider import provider
+
+logger = logging.getLogger(__name__)
+
+#: total 是完整文件的大小
+Head = namedtuple('Head', ['data', 'total', 'content_type'])
+
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+_CHUNK_SIZE = 64 * 1024
+
+
+class HeadCache(object):
+    """
+    :param path: 数据库文件路径，``:memory:`` 表示使用内存数据库
+    :param max_bytes: 所有开头加起来的最大字节数
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS heads ('
+            'song_id INTEGER NOT NULL, '
+            'quality TEXT NOT NULL, '
+            'content_type TEXT NOT NULL, '
+            'total INTEGER NOT NULL, '
+            'data BLOB NOT NULL, '
+            'accessed_at REAL NOT NULL, '
+            'PRIMARY KEY (song_id, quality))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS heads_accessed_at '
+                           'ON heads (accessed_at)')
+        self._conn.commit()
+
+    def get(self, song_id, quality):
+        """返回 Head，没有缓存时返回 None"""
+        key = (int(song_id), quality)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data, total, content_type FROM heads '
+                'WHERE song_id=? AND quality=?', key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                'UPDATE heads SET accessed_at=? WHERE song_id=? AND quality=?',
+                (time.time(), ) + key)
+            self._conn.commit()
+            self.hits += 1
+        return Head(bytes(row[0]), row[1], row[2])
+
+    def set(self, song_id, quality, head):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO heads (song_id, quality, content_type, '
+                'total, data, accessed_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (int(song_id), quality, head.content_type, head.total,
+                 head.data, time.time()))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        size = self._conn.execute(
+            'SELECT COALESCE(SUM(LENGTH(data)), 0) FROM heads').fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            'SELECT song_id, quality, LENGTH(data) FROM heads '
+            'ORDER BY accessed_at').fetchall()
+        for song_id, quality, length in rows:
+            if size <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM heads WHERE song_id=? AND quality=?',
+                               (song_id, quality))
+            size -= length
+
+    def __contains__(self, key):
+        """:param key: ``(song_id, quality)``"""
+        song_id, quality = key
+        with self._lock:
+            return self._conn.execute(
+                'SELECT 1 FROM heads WHERE song_id=? AND quality=?',
+                (int(song_id), quality)).fetchone() is not None
+
+    def delete(self, song_id, quality):
+        with self._lock:
+            self._conn.execute('DELETE FROM heads WHERE song_id=? AND quality=?',
+                               (int(song_id), quality))
+            self._conn.commit()
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COALESCE(SUM(LENGTH(data)), 0) FROM heads').fetchone()[0]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def fetch_head(session, url, size, timeout=10):
+    """下载 url 的前 size 个字节，返回 Head
+
+    服务端不支持 Range 时读取前 size 个字节后断开连接；
+    不知道文件的总大小时返回 None，这时没办法拼接出完整的文件。
+    """
+    response = session.get(url, headers={'Range': 'bytes=0-{}'.format(size - 1)},
+                           stream=True, timeout=timeout)
+    try:
+        response.raise_for_status()
+        if response.status_code == 206:
+            m = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+            if m is None or int(m.group(1)) != 0:
+                return None
+            total = int(m.group(3))
+        else:
+            total = int(response.headers.get('Content-Length') or 0)
+            if not total:
+                return None
+        chunks = []
+        length = 0
+        for chunk in response.iter_content(_CHUNK_SIZE):
+            chunks.append(chunk)
+            length += len(chunk)
+            if length >= size:
+                break
+        data = b''.join(chunks)[:size]
+    finally:
+        response.close()
+    if len(data) < min(size, total):
+        return None
+    content_type = response.headers.get('Content-Type') or 'audio/mpeg'
+    return Head(data, total, content_type)
+
+
+class AudioPrefetcher(QueuePrefetcher):
+    """在后台下载播放列表中当前歌曲之后 count 首歌曲的开头
+
+    :param cache: HeadCache
+    :param head_size: 每首歌曲下载的字节数，320kbps 的 512KB 大约是 13 秒
+    :param policy: 音质选择策略，和播放器使用的保持一致，
+        参考 ``fuocore.media.Quality.SortPolicy``
+    """
+
+    def __init__(self, source, cache, count=2, head_size=512 * 1024,
+                 policy=None, session=None):
+        super().__init__(source, count=count)
+        self.cache = cache
+        self.head_size = head_size
+        self.policy = policy
+        self.session = session or requests.Session()
+
+    def prefetch(self, songs):
+        """下载这些歌曲的开头，已经缓存的会被跳过，返回下载的数量"""
+        count = 0
+        for song in songs:
+            if getattr(song, 'source', None) != provider.identifier:
+                continue
+            try:
+                _, quality = song.select_media(self.policy)
+                if quality is None or (song.identifier, quality) in self.cache:
+                    continue
+                media = song.get_remote_media(quality)
+                head = fetch_head(self.session, media.url, self.head_size)
+                if head is not None:
+                    self.cache.set(song.identifier, quality, head)
+                    count += 1
+            except Exception:  # noqa
+                logger.exception('prefetch audio head of {} failed'.format(song))
+        return count
+
+
+def parse_range(value, total):
+    """解析 Range 请求头，返回 ``(start, end)``（包含 end），
+    没有 Range 时返回 None，范围不合法时抛出 ValueError
+
+    >>> parse_range('bytes=100-', 1000), parse_range('bytes=-100', 1000)
+    ((100, 999), (900, 999))
+    """
+    if not value:
+        return None
+    m = _RANGE.match(value.strip())
+    if m is None or m.group() == 'bytes=-':
+        raise ValueError(value)
+    start, end = m.groups()
+    if not start:
+        start, end = max(total - int(end), 0), total - 1
+    else:
+        start = int(start)
+        end = min(int(end), total - 1) if end else total - 1
+    if start > end:
+        raise ValueError(value)
+    return start, end
+
+
+class _ProxyHandler(object):
+    """和 http.server.BaseHTTPRequestHandler 一起使用，
+    http.server 在启动服务时才导入，参考 HeadProxy._ensure_started"""
+
+    server_version = 'XiamiHeadProxy'
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        m = re.match(r'/songs/(\d+)/(\w+)$', self.path)
+        song = proxy._songs.get(int(m.group(1))) if m is not None else None
+        if song is None:
+            self.send_error(404)
+            return
+        quality = m.group(2)
+        head = proxy.cache.get(song.identifier, quality)
+        if head is None:
+            # 开头在返回 url 之后被淘汰了，直接使用原来的链接
+            self._redirect(song, quality)
+            return
+        try:
+            range_ = parse_range(self.headers.get('Range'), head.total)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(head.total))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = range_ or (0, head.total - 1)
+        tail = None
+        if end >= len(head.data):
+            # 在发送响应头之前请求剩下的部分，出错时还可以返回错误码
+            try:
+                url = song.get_remote_media(quality).url
+                tail = proxy.open_tail(url, max(start, len(head.data)), end,
+                                       head.total)
+            except Exception:  # noqa
+                logger.exception('fetch tail of {} failed'.format(song))
+                self.send_error(502)
+                return
+            if tail is None:
+                # 远程文件变了（比如刷新链接之后文件被重新编码），缓存的开头
+                # 不能再和它拼接
+                proxy.cache.delete(song.identifier, quality)
+                self._redirect(song, quality, url)
+                return
+        self.send_response(200 if range_ is None else 206)
+        self.send_header('Content-Type', head.content_type)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if range_ is not None:
+            self.send_header('Content-Range',
+                             'bytes {}-{}/{}'.format(start, end, head.total))
+        self.end_headers()
+        try:
+            if start < len(head.data):
+                self.wfile.write(head.data[start:end + 1])
+                start = len(head.data)
+            if tail is not None:
+                for chunk in proxy.iter_tail(tail, start, end):
+                    self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # 播放器 seek 或者切歌时会直接断开连接
+            pass
+        except (requests.RequestException, OSError) as e:
+            # 响应头已经发送了，只能断开连接
+            logger.warning('stream tail of {} failed: {}'.format(song, e))
+            self.close_connection = True
+        finally:
+            if tail is not None:
+                tail.close()
+
+    def _redirect(self, song, quality, url=None):
+        if url is None:
+            try:
+                url = song.get_remote_media(quality).url
+            except Exception:  # noqa
+                logger.exception('get media of {} failed'.format(song))
+                self.send_error(502)
+                return
+        self.send_response(302)
+        self.send_header('Location', url)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class HeadProxy(object):
+    """本地 HTTP 服务，把缓存的开头和远程剩下的部分拼接成完整的文件
+
+    第一次调用 wrap 并且开头已经缓存时才会启动服务。
+    """
+
+    def __init__(self, cache, session=None, host='127.0.0.1'):
+        self.cache = cache
+        self.session = session or requests.Session()
+        self.host = host
+        self._server = None
+        self._lock = threading.Lock()
+        #: song_id -> XSongModel，拼接时用来获取（可能已经刷新过的）播放链接
+        self._songs = weakref.WeakValueDictionary()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._server is None:
+                # 大部分时候用不到代理，避免启动时导入 http.server
+                import socketserver
+                from http.server import BaseHTTPRequestHandler, HTTPServer
+
+                # http.server.ThreadingHTTPServer 是 Python 3.7 才有的
+                server_cls = type('_Server', (socketserver.ThreadingMixIn, HTTPServer),
+                                  {'daemon_threads': True})
+                handler = type('_Handler', (_ProxyHandler, BaseHTTPRequestHandler), {})
+                server = server_cls((self.host, 0), handler)
+                server.proxy = self
+                threading.Thread(target=server.serve_forever,
+                                 name='xiami-head-proxy', daemon=True).start()
+                self._server = server
+            return self._server
+
+    def url_for(self, song, quality):
+        server = self._ensure_started()
+        self._songs[song.identifier] = song
+        return 'http://{}:{}/songs/{}/{}'.format(
+            self.host, server.server_address[1], song.identifier, quality)
+
+    def wrap(self, song, quality, media):
+        """开头已经缓存时返回指向本地服务的 Media，否则原样返回 media"""
+        if media is None or (song.identifier, quality) not in self.cache:
+            return media
+        metadata = media.metadata
+        return Media(self.url_for(song, quality), format=metadata.format,
+                     bitrate=metadata.bitrate)
+
+    def open_tail(self, url, start, end, total):
+        """请求远程 [start, end] 之间的数据，返回 response
+
+        远程文件的大小和 total 不一致时返回 None，这时缓存的开头不能使用。
+        """
+        headers = {'Range': 'bytes={}-{}'.format(start, end)}
+        response = self.session.get(url, headers=headers, stream=True, timeout=10)
+        try:
+            response.raise_for_status()
+            if response.status_code == 206:
+                m = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+                remote_total = int(m.group(3)) if m is not None else None
+            else:
+                remote_total = int(response.headers.get('Content-Length') or 0)
+        except BaseException:
+            response.close()
+            raise
+        if remote_total != total:
+            response.close()
+            return None
+        return response
+
+    def iter_tail(self, response, start, end):
+        """读取 open_tail 返回的 response，返回 [start, end] 之间的数据"""
+        skip = start if response.status_code == 200 else 0
+        remaining = end - start + 1
+        for chunk in response.iter_content(_CHUNK_SIZE):
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk = chunk[dropped:]
+                skip -= dropped
+            chunk = chunk[:remaining]
+            if chunk:
+                yield chunk
+                remaining -= len(chunk)
+            if not remaining:
+                break
+
+    def stop(self):
+        with self._lock:
+            if self._server is not None:
+                self._server.shutdown()
+                self._server.server_close()
+                self._server = None
@@ -0,0 +1,180 @@
+"""
+虾米 API 响应的本地缓存
+~~~~~~~~~~~~~~~~~~~~~~
+
+很多只读接口（歌手详情、用户信息等）的结果在一段时间内不会变化，
+ResponseCache 把这些接口的响应存到 SQLite 中，下次启动时可以直接复用。
+
+缓存的 key 由 action 和 payload（签名之前的部分）计算得到，每个 action
+有独立的过期时间。带有播放链接的响应不会被缓存，歌词保存在 LyricStore 中。
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+#: 可以缓存的 action 以及它们的过期时间（秒）
+#:
+#: 包含播放链接（listenFiles/mp4Url）的响应不能缓存：反序列化时按照当前时间
+#: 计算链接的过期时间（参考 loaders.load_song），从缓存中读出的链接会被认为
+#: 还能使用一个小时。歌曲详情、专辑详情、歌单详情、歌手的歌曲、MV 详情都是这样。
+DEFAULT_TTLS = {
+    'mtop.alimusic.music.artistservice.getartistdetail': 3 * DAY,
+    'mtop.alimusic.music.albumservice.getartistalbums': DAY,
+    'mtop.alimusic.xuser.facade.xiamiuserservice.getuserinfobyuserid': DAY,
+    'mtop.alimusic.music.list.collectservice.getcollectbyuser': HOUR,
+}
+
+#: “资源不存在”之类的响应的缓存时间
+NEGATIVE_TTL = HOUR
+
+
+def _is_negative(code, rv):
+    """判断响应是否表示资源不存在
+
+    业务错误（FAIL_BIZ_*）一般意味着资源不存在，另外，有些接口在
+    id 不存在时会返回成功，但 data 为空，比如 mv_detail。
+    """
+    if code == 'SUCCESS':
+        return not rv.get('data', {}).get('data')
+    return isinstance(code, str) and code.startswith('FAIL_BIZ')
+
+
+class ResponseCache(object):
+    """基于 SQLite 的 API 响应缓存
+
+    :param path: 数据库文件路径，``:memory:`` 表示使用内存数据库
+    :param ttls: action -> 过期时间（秒），不在其中的 action 不会被缓存
+    :param max_entries: 缓存的最大条目数，超出时淘汰最久没有被访问的条目
+    """
+
+    def __init__(self, path, ttls=None, max_entries=10000,
+                 negative_ttl=NEGATIVE_TTL):
+        self.ttls = DEFAULT_TTLS.copy() if ttls is None else ttls
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, '
+            'action TEXT NOT NULL, '
+            'value TEXT NOT NULL, '
+            'negative INTEGER NOT NULL, '
+            'expires_at REAL NOT NULL, '
+            'accessed_at REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at '
+                           'ON responses (accessed_at)')
+        self._conn.commit()
+        # 条目数保存在内存中，避免每次 set 都执行 COUNT(*)（需要扫描整个索引）
+        self._count = self._conn.execute(
+            'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def make_key(action, payload, salt=''):
+        """根据 action 和 payload 生成缓存 key
+
+        payload 会被序列化为规范形式（key 排序、无多余空白），
+        salt 用来区分不同用户（比如 accessToken）。
+        """
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'),
+                               ensure_ascii=False)
+        raw = '{}\n{}\n{}'.format(action, canonical, salt)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def is_cacheable(self, action):
+        return action in self.ttls
+
+    def get(self, action, payload, salt=''):
+        """返回缓存的 (code, msg, rv)，没有缓存或者已过期时返回 None"""
+        if not self.is_cacheable(action):
+            return None
+        key = self.make_key(action, payload, salt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, negative, expires_at FROM responses WHERE key=?',
+                (key,)).fetchone()
+            if row is None or row[2] < now:
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE responses SET accessed_at=? WHERE key=?',
+                               (now, key))
+            self._conn.commit()
+            self.hits += 1
+            if row[1]:
+                self.negative_hits += 1
+        code, msg, rv = codec.loads(row[0])
+        return code, msg, rv
+
+    def set(self, action, payload, value, salt=''):
+        """缓存一个响应
+
+        系统错误（比如限流、token 过期）不会被缓存。
+        """
+        if not self.is_cacheable(action):
+            return
+        code, msg, rv = value
+        negative = _is_negative(code, rv)
+        if code != 'SUCCESS' and not negative:
+            return
+        ttl = self.negative_ttl if negative else self.ttls[action]
+        key = self.make_key(action, payload, salt)
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM responses WHERE key=?',
+                                        (key,)).fetchone() is not None
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(key, action, value, negative, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, action, codec.dumps(value), int(negative), now + ttl, now))
+            if not exists:
+                self._count += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            cursor = self._conn.execute(
+                'DELETE FROM responses WHERE key IN ('
+                'SELECT key FROM responses ORDER BY accessed_at LIMIT ?)',
+                (overflow,))
+            self._count -= cursor.rowcount
+            self.evictions += cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+            self._count = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'negative_hits': self.negative_hits,
+            'evictions': self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,76 @@
+"""
+合并同时发出的相同请求
+~~~~~~~~~~~~~~~~~~~~
+
+界面展示一个专辑时，控制器和 model 的懒加载字段常常会在同一时刻请求
+同一个 album_detail/song_detail。Coalescer 保证相同 key 的调用在同一时刻
+只会执行一次，结果（或者异常）会返回给所有调用方。
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class Coalescer(object):
+    """线程版本
+
+    >>> coalescer = Coalescer()
+    >>> coalescer.do('key', lambda: 1)
+    1
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+        #: 被合并（即省掉）的调用次数
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                future = self._futures[key] = Future()
+                is_leader = True
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._futures[key]
+
+
+class AsyncCoalescer(object):
+    """asyncio 版本，func 是一个返回 coroutine 的函数"""
+
+    def __init__(self):
+        self._futures = {}
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        future = self._futures.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # 某个调用方被取消时，不应该影响其它调用方
+            return await asyncio.shield(future)
+
+        future = self._futures[key] = asyncio.ensure_future(func())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                del self._futures[key]
+            else:
+                # leader 被取消了，等请求结束之后再清理
+                future.add_done_callback(lambda _: self._futures.pop(key, None))
@@ -0,0 +1,104 @@
+"""
+JSON 编解码
+~~~~~~~~~~~
+
+每个请求都要把 header 和 payload 序列化两次再签名，每个响应都要解析一次，
+请求多的时候 JSON 编解码在 profile 中很显眼。
+
+- 解码：安装了 orjson 或 pysimdjson 时使用它们，否则使用标准库 json；
+- 签名：签名是对序列化之后的字符串计算的，必须和服务端、以及之前的版本
+  保持一致，所以编码仍然使用标准库 json 的默认格式。不变的 header 部分只
+  序列化一次，每次请求只需要序列化 payload。
+"""
+
+import json
+from json.encoder import encode_basestring_ascii
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+
+def _stdlib_loads(s):
+    return json.loads(s)
+
+
+if orjson is not None:
+    BACKEND = 'orjson'
+    _fast_loads = orjson.loads
+elif simdjson is not None:  # pragma: no cover
+    BACKEND = 'simdjson'
+    _fast_loads = simdjson.loads
+else:  # pragma: no cover
+    BACKEND = 'json'
+    _fast_loads = _stdlib_loads
+
+
+def loads(s):
+    """解析 JSON（bytes 或者 str）
+
+    第三方库拒绝的输入（比如超出 64 位的整数、NaN）交给标准库再解析一次，
+    所以结果和异常（json.JSONDecodeError）都和 ``json.loads`` 一致。
+    """
+    if _fast_loads is _stdlib_loads:
+        return json.loads(s)
+    try:
+        return _fast_loads(s)
+    except ValueError:
+        return json.loads(s)
+
+
+def dumps(obj):
+    """序列化为紧凑的 JSON 字符串，只用于本地存储，格式和 json.dumps 不同"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def response_json(response):
+    """解析 requests.Response（或者兼容的对象）的 JSON 内容"""
+    content = getattr(response, 'content', None)
+    if not isinstance(content, (bytes, str)):
+        return response.json()
+    return loads(content)
+
+
+class RequestStrEncoder(object):
+    """生成签名用的 data 参数
+
+    结果和 ``json.dumps({'requestStr': json.dumps({'header': header,
+    'model': model})})`` 完全一致：外层只是把内层字符串转义之后用引号包起来，
+    而转义是逐个字符进行的，所以 header 部分可以提前转义好。
+
+    >>> header = {'appId': 200, 'platformId': 'h5'}
+    >>> model = {'keyword': '周杰伦'}
+    >>> encoder = RequestStrEncoder()
+    >>> encoder.encode(header, model) == json.dumps(
+    ...     {'requestStr': json.dumps({'header': header, 'model': model})})
+    True
+    """
+
+    _SUFFIX = '}"}'
+
+    def __init__(self):
+        # (header 的快照, 转义之后的前缀)，整体替换，不需要加锁
+        self._prefix = ((), None)
+
+    def _header_prefix(self, header):
+        snapshot = tuple(header.items())
+        cached_snapshot, prefix = self._prefix
+        if prefix is None or cached_snapshot != snapshot:
+            inner = '{"header": ' + json.dumps(header) + ', "model": '
+            prefix = '{"requestStr": "' + encode_basestring_ascii(inner)[1:-1]
+            self._prefix = (snapshot, prefix)
+        return prefix
+
+    def encode(self, header, model):
+        model_str = encode_basestring_ascii(json.dumps(model))[1:-1]
+        return self._header_prefix(header) + model_str + self._SUFFIX
@@ -0,0 +1,237 @@
+"""
+虾米接口的 action 和 payload
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+API 和 AsyncAPI 共用这里的定义：每个函数根据参数返回一个 Endpoint，
+API/AsyncAPI 只负责签名、发送请求（以及重试等），再用 Endpoint.parse
+从 ``(code, msg, rv)`` 中取出调用方需要的部分。
+"""
+
+from collections import namedtuple
+
+BASE_URL_H5 = 'http://h5api.m.xiami.com'
+BASE_URL_ACS = 'https://acs.m.xiami.com'
+
+#: base_url 为 None 时使用 BASE_URL_H5
+Endpoint = namedtuple('Endpoint', ['action', 'payload', 'parse', 'base_url'])
+Endpoint.__new__.__defaults__ = (None, )
+
+
+def _data(result):
+    return result[2]['data']['data']
+
+
+def _field(name):
+    def parse(result):
+        return _data(result)[name]
+    return parse
+
+
+def _paging(page, page_size):
+    # pagingVO 中的 page 和 pageSize
+    return {'page': page, 'pageSize': page_size}
+
+
+def login(email, password):
+    """parse 原样返回 ``(code, msg, rv)``，accessToken 由调用方保存"""
+    payload = {
+        'account': email,
+        'password': password
+    }
+    return Endpoint('mtop.alimusic.xuser.facade.xiamiuserservice.login', payload,
+                    lambda result: result)
+
+
+_SEARCH_ACTIONS = {
+    1: 'mtop.alimusic.search.searchservice.searchsongs',
+    10: 'mtop.alimusic.search.searchservice.searchalbums',
+    100: 'mtop.alimusic.search.searchservice.searchartists',
+    1000: 'mtop.alimusic.search.searchservice.searchcollects',
+}
+
+
+def search(keywords, type_=1, page=1, limit=30):
+    if type_ not in _SEARCH_ACTIONS:
+        raise ValueError('invalid type_:%d', type_)
+    payload = {
+        'key': keywords,
+        'pagingVO': _paging(page, limit)
+    }
+    return Endpoint(_SEARCH_ACTIONS[type_], payload, _data, BASE_URL_ACS)
+
+
+def _parse_song_detail(result):
+    if result[0] == 'SUCCESS':
+        return _data(result)['songDetail']
+    return None
+
+
+def song_detail(song_id):
+    return Endpoint('mtop.alimusic.music.songservice.getsongdetail',
+                    {'songId': song_id}, _parse_song_detail)
+
+
+def _parse_songs(result):
+    # token 过期且重试失败时，request 返回 None
+    if result is None or result[0] != 'SUCCESS':
+        return []
+    return _data(result)['songs'] or []
+
+
+def songs(song_ids):
+    """一次最多 200 首，参考 API.songs_detail"""
+    return Endpoint('mtop.alimusic.music.songservice.getsongs',
+                    {'songIds': song_ids}, _parse_songs)
+
+
+def _parse_lyric(result):
+    for lyric in _data(result)['lyrics']:
+        if int(lyric['type']) == 2:
+            return lyric['content']
+    return ''
+
+
+def song_lyric(song_id):
+    return Endpoint('mtop.alimusic.music.lyricservice.getsonglyrics',
+                    {'songId': song_id}, _parse_lyric)
+
+
+def mv_detail(mv_id):
+    # 当 id 不存在时，rv['data']['data'] 为空字典
+    return Endpoint('mtop.alimusic.music.mvservice.getmvdetail', {'mvId': mv_id},
+                    lambda result: _data(result).get('mvDetailVO'))
+
+
+def album_detail(album_id):
+    return Endpoint('mtop.alimusic.music.albumservice.getalbumdetail',
+                    {'albumId': album_id}, _field('albumDetail'))
+
+
+def artist_detail(artist_id):
+    return Endpoint('mtop.alimusic.music.artistservice.getartistdetail',
+                    {'artistId': artist_id}, _field('artistDetailVO'))
+
+
+def artist_songs(artist_id, page=1, page_size=50):
+    payload = {
+        'artistId': artist_id,
+        'pagingVO': _paging(page, page_size)
+    }
+    return Endpoint('mtop.alimusic.music.songservice.getartistsongs', payload, _data)
+
+
+def artist_albums(artist_id, page=1, page_size=20):
+    payload = {
+        'artistId': artist_id,
+        'pagingVO': _paging(page, page_size)
+    }
+    return Endpoint('mtop.alimusic.music.albumservice.getartistalbums', payload,
+                    _data)
+
+
+def playlist_detail(playlist_id):
+    return Endpoint('mtop.alimusic.music.list.collectservice.getcollectdetail',
+                    {'listId': playlist_id}, _field('collectDetail'))
+
+
+def playlist_detail_v2(playlist_id, page=1, page_size=200):
+    payload = {
+        'listId': playlist_id,
+        'pagingVO': _paging(page, page_size)
+    }
+    return Endpoint('mtop.alimusic.music.list.collectservice.getcollectsongs',
+                    payload, _data)
+
+
+def user_detail(user_id):
+    return Endpoint('mtop.alimusic.xuser.facade.xiamiuserservice.getuserinfobyuserid',
+                    {'userId': user_id}, _data)
+
+
+def user_playlists(user_id, page=1, limit=30):
+    payload = {
+        'userId': user_id,
+        'pagingVO': _paging(page, limit)
+    }
+    return Endpoint('mtop.alimusic.music.list.collectservice.getcollectbyuser',
+                    payload, _field('collects'))
+
+
+def user_favorite_playlists(user_id, page=1, limit=30):
+    payload = {
+        'userId': user_id,
+        'pagingVO': _paging(page, limit)
+    }
+    return Endpoint('mtop.alimusic.fav.collectfavoriteservice.getfavoritecollects',
+                    payload, _field('collects'))
+
+
+def user_favorite_songs(user_id, page=1, page_size=50):
+    payload = {
+        'userId': user_id,
+        'pagingVO': _paging(page, page_size)
+    }
+    return Endpoint('mtop.alimusic.fav.songfavoriteservice.getfavoritesongs',
+                    payload, _data)
+
+
+def update_favorite_song(song_id, op):
+    """:param str op: `add` or `del`"""
+    op = 'un' if op == 'del' else ''
+    return Endpoint('mtop.alimusic.fav.songfavoriteservice.{}favoritesong'.format(op),
+                    {'songId': song_id},
+                    lambda result: _data(result)['status'] == 'true')
+
+
+def update_playlist_song(playlist_id, song_id, op):
+    action = 'mtop.alimusic.music.list.collectservice.{}songs'.format(
+        'delete' if op == 'del' else 'add')
+    payload = {
+        'listId': playlist_id,
+        'songIds': [song_id]
+    }
+    return Endpoint(action, payload,
+                    lambda result: _data(result)['success'] == 'true')
+
+
+def user_favorite_artists(user_id, page=1, page_size=50):
+    payload = {
+        'userId': user_id,
+        'pagingVO': _paging(page, page_size)
+    }
+    return Endpoint('mtop.alimusic.fav.artistfavoriteservice.getfavoriteartists',
+                    payload, _data)
+
+
+def user_favorite_albums(user_id, page=1, page_size=50):
+    payload = {
+        'userId': user_id,
+        'pagingVO': _paging(page, page_size)
+    }
+    return Endpoint('mtop.alimusic.fav.albumfavoriteservice.getfavoritealbums',
+                    payload, _data)
+
+
+def personal_fm():
+    return Endpoint('mtop.alimusic.music.radio.getradiosongs', {'radioType': 1},
+                    _field('list'))
+
+
+def recommend_songs():
+    return Endpoint('mtop.alimusic.recommend.songservice.getdailysongs', {},
+                    _field('songs'))
+
+
+def recommend_playlists():
+    return Endpoint('mtop.alimusic.music.list.collectservice.getcollects', {},
+                    _field('collects'))
+
+
+def recent_song_playlog(user_id, page=1, page_size=200):
+    payload = {
+        'userId': user_id,
+        'fullView': 1,
+        'pagingVO': _paging(page, page_size)
+    }
+    return Endpoint('mtop.alimusic.playlog.facade.playlogservice.getrecentsongplaylog',
+                    payload, _data)
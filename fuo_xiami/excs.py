@@ -4,3 +4,16 @@ from fuocore.excs import ProviderIOError
 class XiamiIOError(ProviderIOError):
     def __init__(self, message=''):
         super().__init__(message, provider='xiami')
+
+
+class XiamiThrottledError(XiamiIOError):
+    """请求被虾米限流，并且重试之后仍然失败（或者熔断器处于 open 状态）"""
+
+    def __init__(self, message='', retry_after=None):
+        super().__init__(message)
+        #: 建议多久（秒）之后再重试
+        self.retry_after = retry_after
+
+
+class SearchCancelled(XiamiIOError):
+    """关键词已经变化，这次搜索的结果不再需要，参考 fuo_xiami.search"""
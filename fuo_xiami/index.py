@@ -0,0 +1,374 @@
+"""
+本地歌曲索引
+~~~~~~~~~~~~
+
+搜索每次都要请求虾米的接口，即使要找的歌曲就在收藏、歌单或者刚刚的搜索结果里。
+
+SongIndex 是一个倒排索引，记录插件反序列化过的所有歌曲的标题、歌手名和
+专辑名（通过 IdentityMap 的 listener 得到），搜索时可以在几毫秒之内返回
+本地的结果。匹配规则：
+
+- 中日韩文字：关键词中的连续文字需要在字段中连续出现；
+- 其它文字：关键词中的每个单词需要是字段中某个单词开头的前缀，
+  可以跨越单词，``heyju`` 能匹配 “Hey Jude”；
+- 安装了 pypinyin 时，汉字还可以通过全拼和首字母匹配，``zjl``、``zhoujie``、
+  ``jie lun`` 都能匹配“周杰伦”。首字母需要从一段汉字的开头开始，
+  并且至少三个字母（或者正好是一整段汉字，比如 ``sq`` 匹配“山丘”）。
+  为了速度，拼音是逐字转换并缓存的，多音字使用最常见的读音。
+
+倒排表只保存很短的 token（单字、两个字、每个单词或音节开头的一两个字母），
+用来快速找到候选歌曲，然后再逐个校验。这样 token 的数量很少，内存占用也小。
+
+新看到的歌曲只是放在一个队列中，下一次搜索（或者 flush）时才提取字段、
+分词，这样不会拖慢反序列化；队列太长时在后台线程中 flush。
+"""
+
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+
+from .search import normalize
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+
+#: 中日韩文字（假名、谚文、汉字）
+_CJK_RANGES = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+_TOKEN = re.compile('(?P<cjk>[{0}]+)|(?P<word>[^\\W_{0}]+)'.format(_CJK_RANGES))
+_HAN = re.compile('[㐀-䶿一-鿿豈-﫿]')
+
+TITLE, ARTIST, ALBUM = 0, 1, 2
+#: 关键词匹配到标题、歌手、专辑时的得分
+WEIGHTS = (4, 2, 1)
+#: 只匹配一段汉字开头的首字母时，关键词最少的字母数
+MIN_INITIALS = 3
+
+
+@lru_cache(maxsize=None)
+def _char_pinyin(ch):
+    return lazy_pinyin(ch)[0]
+
+
+class _Field(object):
+    """一个字段分词之后的结果
+
+    :ivar text: 规范化之后的文本
+    :ivar spelling: 所有单词和汉字拼音连在一起的字符串
+    :ivar starts: spelling 中每个单词/音节开始的位置
+    :ivar initials: 汉字拼音的首字母
+    :ivar initial_starts: initials 中每一段连续汉字开始的位置
+    """
+
+    __slots__ = ('text', 'spelling', 'starts', 'initials', 'initial_starts')
+
+    def __init__(self, text):
+        self.text = normalize(text or '')
+        units = []
+        initials = []
+        initial_starts = []
+        for m in _TOKEN.finditer(self.text):
+            if m.group('word') is not None:
+                units.append(m.group('word'))
+            elif lazy_pinyin is not None:
+                syllables = [_char_pinyin(ch) for ch in m.group('cjk')
+                             if _HAN.match(ch)]
+                if syllables:
+                    initial_starts.append(len(initials))
+                units.extend(syllables)
+                initials.extend(s[0] for s in syllables)
+        starts = []
+        pos = 0
+        for unit in units:
+            starts.append(pos)
+            pos += len(unit)
+        self.spelling = ''.join(units)
+        self.starts = tuple(starts)
+        self.initials = ''.join(initials)
+        self.initial_starts = tuple(initial_starts)
+
+    def tokens(self):
+        tokens = set()
+        for m in _TOKEN.finditer(self.text):
+            run = m.group('cjk')
+            if run is not None:
+                tokens.update(run)
+                tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+        for pos in self.starts:
+            tokens.add(self.spelling[pos:pos + 1])
+            tokens.add(self.spelling[pos:pos + 2])
+        for pos in self.initial_starts:
+            tokens.add(self.initials[pos:pos + 1])
+            tokens.add(self.initials[pos:pos + 2])
+        return tokens
+
+    def match(self, term):
+        """term 是 parse_query 返回的 ``(是否是中日韩文字, 文本)``"""
+        is_cjk, text = term
+        if is_cjk:
+            return text in self.text
+        spelling = self.spelling
+        if any(spelling.startswith(text, pos) for pos in self.starts):
+            return True
+        return text in self.initials and self._match_initials(text)
+
+    def _match_initials(self, text):
+        """首字母需要从一段汉字的开头开始匹配
+
+        一两个字母的首字母太容易碰巧匹配（比如 xx 和“谢谢侬”），
+        少于 MIN_INITIALS 个字母时需要正好是一整段汉字的首字母。
+        """
+        initials = self.initials
+        starts = self.initial_starts
+        for i, pos in enumerate(starts):
+            if not initials.startswith(text, pos):
+                continue
+            if len(text) >= MIN_INITIALS:
+                return True
+            end = starts[i + 1] if i + 1 < len(starts) else len(initials)
+            if pos + len(text) == end:
+                return True
+        return False
+
+
+def parse_query(keyword):
+    """把关键词切分成 ``[(是否是中日韩文字, 文本)]``
+
+    >>> parse_query('周杰伦 Qing')
+    [(True, '周杰伦'), (False, 'qing')]
+    """
+    return [(m.group('cjk') is not None, m.group())
+            for m in _TOKEN.finditer(normalize(keyword))]
+
+
+def _term_token(term):
+    """在倒排表中查找候选歌曲时使用的 token"""
+    return term[1][:2]
+
+
+def song_doc(fields):
+    """从 IdentityMap 的 ``get_or_create(model_cls, identifier, **fields)`` 中
+    提取索引需要的数据，字段不完整时返回 None
+
+    返回 ``(title, mvid, duration, (album_id, album_name, album_cover),
+    ((artist_id, artist_name), ...))``，比 dict 节省很多内存。
+
+    延迟解析的歌曲（参考 lazy 模块）从原始数据中读取，避免触发解析。
+    原始数据还没有校验，缺少字段时同样返回 None。
+    """
+    title = fields.get('title')
+    if title is None:
+        return None
+    raw = fields.get('raw')
+    if raw is not None:
+        try:
+            album = (int(raw['albumId']), raw['albumName'], raw['albumLogo'])
+            artists = tuple((int(artist['artistId']), artist['artistName'])
+                            for artist in raw['singerVOs'])
+        except (KeyError, TypeError, ValueError):
+            return None
+    else:
+        album = fields.get('album')
+        artists = fields.get('artists')
+        if album is None or artists is None:
+            return None
+        # 不能直接访问 name 等字段，值为 None 时 model 会自动调用 get
+        get = object.__getattribute__
+        album = (get(album, 'identifier'), get(album, 'name'), get(album, 'cover'))
+        artists = tuple((get(artist, 'identifier'), get(artist, 'name'))
+                        for artist in artists)
+    return (title, fields.get('mvid') or '', fields.get('duration') or 0,
+            album, artists)
+
+
+def data_to_doc(data):
+    """NestedSongSchema 格式的 dict -> song_doc 格式"""
+    return (data['songName'], data.get('mvId') or '', int(data.get('length') or 0),
+            (int(data['albumId']), data['albumName'], data['albumLogo']),
+            tuple((int(artist['artistId']), artist['artistName'])
+                  for artist in data['singerVOs']))
+
+
+def doc_to_data(song_id, doc):
+    """song_doc 格式 -> NestedSongSchema 格式的 dict"""
+    title, mvid, duration, album, artists = doc
+    return {'songId': str(song_id), 'songName': title, 'mvId': mvid,
+            'length': str(duration), 'albumId': str(album[0]),
+            'albumName': album[1], 'albumLogo': album[2],
+            'singerVOs': [{'artistId': str(artist_id), 'artistName': name}
+                          for artist_id, name in artists]}
+
+
+def _doc_texts(doc):
+    """song_doc -> (标题, 歌手名, 专辑名)"""
+    return (doc[0], ' '.join(name or '' for _, name in doc[4]), doc[3][1] or '')
+
+
+class SongIndex(object):
+    """
+    :param max_songs: 最多索引的歌曲数，超出时丢弃最久没有出现过的歌曲
+    :param max_pending: 队列中的歌曲超过这个数量时，在后台线程中 flush
+    """
+
+    def __init__(self, max_songs=50000, max_pending=5000):
+        self.max_songs = max_songs
+        self.max_pending = max_pending
+        self._flushing = False
+        self._lock = threading.Lock()
+        #: 只保护 _pending 和 _flushing，持有的时间很短，
+        #: 反序列化的线程不需要等待正在进行的 flush
+        self._pending_lock = threading.Lock()
+        #: song_id -> (song_doc, (_Field, ...), seq)，按最近出现的顺序排列
+        self._docs = OrderedDict()
+        #: token -> [song_id]，可能包含已经删除或者重复的 song_id，查询时过滤
+        self._postings = defaultdict(list)
+        self._stale = 0
+        self._seq = 0
+        #: 文本 -> _Field，相同的歌手名、专辑名只保存一份
+        self._fields = {}
+        #: 同一张专辑、同一组歌手的 tuple 只保存一份
+        self._interned = {}
+        #: 还没有分词的 (song_id, get_or_create 的 fields, song_doc)，
+        #: fields 和 song_doc 最多只有一个不为 None，都为 None 时只更新最近出现的顺序
+        self._pending = []
+
+    def observe(self, model, fields):
+        """IdentityMap 的 listener，只把歌曲放进队列
+
+        歌曲的标题、歌手和专辑基本不会变化，已经索引过的歌曲只更新最近出现的顺序。
+        """
+        if model.identifier in self._docs:
+            fields = None
+        with self._pending_lock:
+            self._pending.append((model.identifier, fields, None))
+            if len(self._pending) < self.max_pending or self._flushing:
+                return
+            self._flushing = True
+        threading.Thread(target=self.flush, name='xiami-song-index',
+                         daemon=True).start()
+
+    def add(self, data):
+        """:param data: NestedSongSchema 格式的 dict，比如 LibraryStore 中保存的歌曲"""
+        doc = data_to_doc(data)
+        with self._pending_lock:
+            self._pending.append((int(data['songId']), None, doc))
+
+    def get(self, song_id):
+        """返回 NestedSongSchema 格式的 dict，没有索引这首歌曲时返回 None"""
+        entry = self._docs.get(song_id)
+        return doc_to_data(song_id, entry[0]) if entry is not None else None
+
+    def _intern(self, doc):
+        title, mvid, duration, album, artists = doc
+        album = self._interned.setdefault(album, album)
+        artists = self._interned.setdefault(artists, artists)
+        return title, mvid, duration, album, artists
+
+    def _field(self, text):
+        field = self._fields.get(text)
+        if field is None:
+            field = self._fields[text] = _Field(text)
+        return field
+
+    def flush(self):
+        """对队列中的歌曲分词，返回新索引（或者内容有变化）的歌曲数"""
+        with self._lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+                self._flushing = False
+            count = 0
+            for song_id, fields, doc in pending:
+                self._seq += 1
+                old = self._docs.get(song_id)
+                if doc is None and fields is None:
+                    if old is not None:
+                        self._docs.move_to_end(song_id)
+                        self._docs[song_id] = old[:2] + (self._seq, )
+                    continue
+                if doc is None:
+                    doc = song_doc(fields)
+                    if doc is None:
+                        continue
+                if old is not None:
+                    self._docs.move_to_end(song_id)
+                    if old[0] == doc:
+                        self._docs[song_id] = (doc, old[1], self._seq)
+                        continue
+                    self._stale += 1
+                doc = self._intern(doc)
+                fields = tuple(self._field(text) for text in _doc_texts(doc))
+                self._docs[song_id] = (doc, fields, self._seq)
+                tokens = set()
+                for field in fields:
+                    tokens.update(field.tokens())
+                for token in tokens:
+                    self._postings[token].append(song_id)
+                count += 1
+            while len(self._docs) > self.max_songs:
+                self._docs.popitem(last=False)
+                self._stale += 1
+            if self._stale > max(len(self._docs), 1000):
+                self._compact()
+            return count
+
+    def _compact(self):
+        """重建倒排表，去掉已经删除的歌曲和旧的 token"""
+        postings = defaultdict(list)
+        self._fields = {}
+        self._interned = {}
+        for song_id, (_, fields, _) in self._docs.items():
+            tokens = set()
+            for field in fields:
+                tokens.update(field.tokens())
+            for token in tokens:
+                postings[token].append(song_id)
+        self._postings = postings
+        self._stale = 0
+
+    def search(self, keyword, limit=30):
+        """返回匹配的 song_id 列表，按得分和最近出现的顺序排序"""
+        self.flush()
+        terms = parse_query(keyword)
+        if not terms:
+            return []
+        with self._lock:
+            candidates = None
+            for term in terms:
+                postings = self._postings.get(_term_token(term))
+                if not postings:
+                    return []
+                if candidates is None or len(postings) < len(candidates):
+                    candidates = postings
+            scored = []
+            for song_id in set(candidates):
+                entry = self._docs.get(song_id)
+                if entry is None:
+                    continue
+                _, fields, seq = entry
+                score = 0
+                for term in terms:
+                    weight = max((WEIGHTS[i] for i, field in enumerate(fields)
+                                  if field.match(term)), default=0)
+                    if not weight:
+                        break
+                    score += weight
+                else:
+                    scored.append((score, seq, song_id))
+        scored.sort(reverse=True)
+        return [song_id for _, _, song_id in scored[:limit]]
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._fields.clear()
+            self._interned.clear()
+            self._stale = 0
+            with self._pending_lock:
+                self._pending = []
+
+    def __len__(self):
+        self.flush()
+        return len(self._docs)
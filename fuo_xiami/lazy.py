@@ -0,0 +1,268 @@
+"""
+延迟解析字段的 model
+~~~~~~~~~~~~~~~~~~~~
+
+歌单详情包含 100 首完整的歌曲，搜索结果包含歌曲、专辑、歌单以及它们嵌套的
+歌手和播放链接，而界面一般只会展示其中可见的几行。这里的 model 是
+XSongModel/XAlbumModel/XPlaylistModel 的子类，它们保存原始的 dict，
+只立即解析展示需要的简单字段（标题、名字等），其它字段（歌手、专辑、
+播放链接、歌曲列表）在第一次访问时才解析。对于使用者来说，它们和普通的
+model 没有区别。
+
+通过 ``set_deserializer('lazy')`` 启用。延迟解析的字段在访问时才会校验，
+校验失败时访问该字段会抛出 marshmallow.ValidationError。
+"""
+
+import time
+
+from . import loaders
+from .loaders import (
+    _int,
+    _list,
+    _str,
+    load_artist,
+    load_listen_file,
+    to_q_media_mapping,
+)
+from .models import (
+    identity_map,
+    XAlbumModel,
+    XPlaylistModel,
+    XSearchModel,
+    XSongModel,
+)
+from .schemas import (
+    AlbumSchema,
+    NestedSongSchema,
+    PlaylistSchema,
+    SearchSchema,
+    SongSchema,
+)
+
+
+class LazyField(object):
+    """第一次访问时通过 ``loader(model, raw, trusted)`` 计算字段的值
+
+    赋值会覆盖延迟解析的值。多个线程同时第一次访问时，loader 可能会被
+    调用多次，结果是一样的（嵌套的 model 来自 IdentityMap）。
+
+    :param name: 字段名。Python 3.5 没有 __set_name__，需要显式传入
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        d = obj.__dict__
+        try:
+            return d[self.name]
+        except KeyError:
+            pass
+        raw = d.get('_raw')
+        if raw is None:
+            return None
+        value = self.loader(obj, raw, d['_trusted'])
+        d[self.name] = value
+        obj._on_field_loaded(self.name)
+        return value
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+
+
+class LazyModelMixin(object):
+    """
+    :param raw: 原始数据，所有延迟字段都解析之后会被释放
+    :param trusted: 参考 loaders 模块
+    """
+
+    #: 延迟解析的属性名
+    _lazy_fields = ()
+
+    def __init__(self, raw=None, trusted=False, **kwargs):
+        super().__init__(**kwargs)
+        d = self.__dict__
+        # Model.__init__ 会把所有字段设置为 None，这里去掉它们，让 LazyField 生效
+        for name in self._lazy_fields:
+            if name not in kwargs:
+                d.pop(name, None)
+        d['_raw'] = raw
+        d['_trusted'] = trusted
+
+    def _on_field_loaded(self, name):
+        d = self.__dict__
+        if all(field in d for field in self._lazy_fields):
+            d['_raw'] = None
+
+
+def _load_song_album(song, raw, trusted):
+    if trusted:
+        identifier = int(raw['albumId'])
+        name, cover = raw['albumName'], raw['albumLogo']
+    else:
+        identifier = _int(raw, 'albumId', required=True)
+        name = _str(raw, 'albumName', required=True)
+        cover = _str(raw, 'albumLogo', required=True)
+    return identity_map.get_or_create(XAlbumModel, identifier=identifier,
+                                      name=name, cover=cover)
+
+
+def _load_artists(model, raw, trusted):
+    if trusted:
+        return [load_artist(artist, True) for artist in raw['singerVOs']]
+    return _list(raw, 'singerVOs', load_artist, False, required=True)
+
+
+def _load_listen_files(song, raw, trusted):
+    if trusted:
+        return [load_listen_file(lfile, True)
+                for lfile in raw.get('listenFiles') or []]
+    return _list(raw, 'listenFiles', load_listen_file, False, default=[])
+
+
+def _load_q_media_mapping(song, raw, trusted):
+    return to_q_media_mapping(_load_listen_files(song, raw, trusted))
+
+
+def _load_url(song, raw, trusted):
+    files = _load_listen_files(song, raw, trusted)
+    return files[0]['url'] if files else ''
+
+
+class LazySongModel(LazyModelMixin, XSongModel):
+    _identity_cls = XSongModel
+    # XSongModel.url 是一个 property，真正的值保存在 _url 中
+    _lazy_fields = ('album', 'artists', 'q_media_mapping', '_url')
+
+    album = LazyField('album', _load_song_album)
+    artists = LazyField('artists', _load_artists)
+    q_media_mapping = LazyField('q_media_mapping', _load_q_media_mapping)
+    _url = LazyField('_url', _load_url)
+
+    def __hash__(self):
+        # 和 XSongModel 保持一致，SongModel.__hash__ 中用到了 type(self)
+        return int(self.identifier) * 1000 + id(XSongModel) % 1000
+
+
+def _load_album_songs(album, raw, trusted):
+    if trusted:
+        songs = raw.get('songs')
+        return None if songs is None else [load_song(song, True) for song in songs]
+    return _list(raw, 'songs', load_song, False, default=None)
+
+
+def _load_album_artists(album, raw, trusted):
+    if trusted:
+        artists = raw.get('artists')
+        return None if artists is None else [load_artist(a, True) for a in artists]
+    return _list(raw, 'artists', load_artist, False, default=None)
+
+
+class LazyAlbumModel(LazyModelMixin, XAlbumModel):
+    _identity_cls = XAlbumModel
+    _lazy_fields = ('songs', 'artists')
+
+    songs = LazyField('songs', _load_album_songs)
+    artists = LazyField('artists', _load_album_artists)
+
+
+def _load_playlist_songs(playlist, raw, trusted):
+    if trusted:
+        songs = raw.get('songs')
+        return None if songs is None else [load_song(song, True) for song in songs]
+    return _list(raw, 'songs', load_song, False, allow_none=True, default=None)
+
+
+class LazyPlaylistModel(LazyModelMixin, XPlaylistModel):
+    _identity_cls = XPlaylistModel
+    _lazy_fields = ('songs', )
+
+    songs = LazyField('songs', _load_playlist_songs)
+
+
+def load_song(data, trusted=False):
+    """和 loaders.load_song 等价，歌手、专辑和播放链接延迟解析"""
+    identifier = int(data['songId']) if trusted else \
+        _int(data, 'songId', required=True)
+    if identity_map.get(XSongModel, identifier) is not None:
+        # 已有的实例需要合并所有字段
+        return loaders.load_song(data, trusted)
+    if trusted:
+        mvid, title = data['mvId'], data['songName']
+        duration = data.get('length', '0')
+    else:
+        mvid = _str(data, 'mvId', required=True)
+        title = _str(data, 'songName', required=True)
+        duration = _str(data, 'length', default='0')
+    return identity_map.get_or_create(LazySongModel,
+                                      identifier=identifier,
+                                      raw=data,
+                                      trusted=trusted,
+                                      mvid=mvid,
+                                      title=title,
+                                      duration=int(duration),
+                                      expired_at=int(time.time()) + 60 * 60)
+
+
+def load_album(data, trusted=False):
+    identifier = int(data['albumId']) if trusted else \
+        _int(data, 'albumId', required=True)
+    if identity_map.get(XAlbumModel, identifier) is not None:
+        return loaders.load_album(data, trusted)
+    if trusted:
+        fields = loaders._present(name=data['albumName'],
+                                  cover=data['albumLogo'],
+                                  desc=data.get('description', loaders._MISSING))
+    else:
+        fields = loaders._present(name=_str(data, 'albumName', required=True),
+                                  cover=_str(data, 'albumLogo', required=True),
+                                  desc=_str(data, 'description'))
+    return identity_map.get_or_create(LazyAlbumModel, identifier=identifier,
+                                      raw=data, trusted=trusted, **fields)
+
+
+def load_playlist(data, trusted=False):
+    identifier = data['listId'] if trusted else \
+        _str(data, 'listId', required=True)
+    if identity_map.get(XPlaylistModel, identifier) is not None:
+        return loaders.load_playlist(data, trusted)
+    if trusted:
+        fields = dict(uid=int(data['userId']),
+                      name=data['collectName'],
+                      cover=data['collectLogo'],
+                      desc=data.get('description'))
+    else:
+        fields = dict(uid=_int(data, 'userId', required=True),
+                      name=_str(data, 'collectName', required=True),
+                      cover=_str(data, 'collectLogo', required=True),
+                      desc=_str(data, 'description', allow_none=True, default=None))
+    return identity_map.get_or_create(LazyPlaylistModel, identifier=identifier,
+                                      raw=data, trusted=trusted, **fields)
+
+
+def load_search(data, trusted=False):
+    if trusted:
+        fields = loaders._present(
+            songs=loaders._trusted_list(data, 'songs', load_song),
+            albums=loaders._trusted_list(data, 'albums', load_album),
+            artists=loaders._trusted_list(data, 'artists', load_artist),
+            playlists=loaders._trusted_list(data, 'collects', load_playlist))
+    else:
+        fields = loaders._present(
+            songs=_list(data, 'songs', load_song, False),
+            albums=_list(data, 'albums', load_album, False),
+            artists=_list(data, 'artists', load_artist, False),
+            playlists=_list(data, 'collects', load_playlist, False))
+    return XSearchModel(**fields)
+
+
+LAZY_LOADERS = {
+    SongSchema: load_song,
+    NestedSongSchema: load_song,
+    AlbumSchema: load_album,
+    PlaylistSchema: load_playlist,
+    SearchSchema: load_search,
+}
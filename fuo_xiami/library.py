@@ -0,0 +1,311 @@
+"""
+用户曲库的本地镜像
+~~~~~~~~~~~~~~~~~~
+
+每次启动时，虾米首页都要重新获取用户的歌单、收藏的歌单，收藏的歌曲、
+专辑和歌手也都要从第一页开始重新获取。
+
+LibrarySync 把登录用户的曲库保存在本地的 SQLite 中，界面启动时可以直接
+从本地读取，然后在后台和服务端同步。收藏列表是按收藏时间倒序排列的，
+同步时先只请求第一页：
+
+- pagingVO.count 和第一页都没有变化：不需要更新；
+- 第一页的开头多了 k 个条目，其它条目后移，并且 count 正好增加 k：
+  把这 k 个条目插入到本地列表的开头；
+- 其它情况（比如取消了收藏）：并发请求所有页面，整体替换。
+
+每个条目只保存加载 model 需要的字段，序列化之后用 zlib 压缩。
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from fuocore.models import GeneratorProxy
+
+from . import codec
+from .loaders import load_song_meta
+from .models import (
+    _deserialize,
+    AlbumSchema,
+    ArtistSchema,
+    NestedSongSchema,
+    PlaylistSchema,
+)
+from .scheduler import current_priority, run_with_priority, BULK
+
+logger = logging.getLogger(__name__)
+
+UNCHANGED = 'unchanged'
+INCREMENTAL = 'incremental'
+FULL = 'full'
+
+
+def _compact_artist(data):
+    return {key: data[key] for key in ('artistId', 'artistName', 'artistLogo')
+            if data.get(key) is not None}
+
+
+def _compact_song(data):
+    rv = {key: data[key] for key in ('songId', 'songName', 'mvId', 'length',
+                                     'albumId', 'albumName', 'albumLogo')
+          if key in data}
+    rv['singerVOs'] = [_compact_artist(artist) for artist in data['singerVOs']]
+    return rv
+
+
+def _compact_album(data):
+    rv = {key: data[key] for key in ('albumId', 'albumName', 'albumLogo')}
+    if data.get('artists'):
+        rv['artists'] = [_compact_artist(artist) for artist in data['artists']]
+    return rv
+
+
+def _compact_playlist(data):
+    return {key: data[key] for key in ('listId', 'userId', 'collectName',
+                                       'collectLogo')}
+
+
+class Collection(object):
+    """曲库中的一种列表
+
+    :param fetch: ``fetch(api, user_id, page, page_size)``，返回 ``data.data``
+    :param paged: 接口是否返回 pagingVO，不分页的接口每次都整体替换
+    :param load: 从本地读取时加载一个条目，默认使用 schema 反序列化
+    """
+
+    def __init__(self, kind, field, id_key, schema, compact, fetch, paged=True,
+                 page_size=50, load=None):
+        self.kind = kind
+        self.field = field
+        self.id_key = id_key
+        self.schema = schema
+        self.compact = compact
+        self.fetch = fetch
+        self.paged = paged
+        self.page_size = page_size
+        self.load = load or (lambda item: _deserialize(item, schema))
+
+    def ids(self, items):
+        return [str(item[self.id_key]) for item in items]
+
+
+COLLECTIONS = {c.kind: c for c in (
+    # 本地没有保存播放链接（它一个小时之后就会过期），不能通过 schema 加载，
+    # 否则 model 会认为自己有一个小时内有效的、空的 q_media_mapping
+    Collection('songs', 'songs', 'songId', NestedSongSchema, _compact_song,
+               lambda api, uid, page, size: api.user_favorite_songs(
+                   uid, page=page, page_size=size),
+               load=load_song_meta),
+    Collection('albums', 'albums', 'albumId', AlbumSchema, _compact_album,
+               lambda api, uid, page, size: api.user_favorite_albums(
+                   uid, page=page, page_size=size)),
+    Collection('artists', 'artists', 'artistId', ArtistSchema, _compact_artist,
+               lambda api, uid, page, size: api.user_favorite_artists(
+                   uid, page=page, page_size=size)),
+    Collection('playlists', 'collects', 'listId', PlaylistSchema, _compact_playlist,
+               lambda api, uid, page, size: {
+                   'collects': api.user_playlists(uid, page=page, limit=size)},
+               paged=False, page_size=30),
+    Collection('fav_playlists', 'collects', 'listId', PlaylistSchema,
+               _compact_playlist,
+               lambda api, uid, page, size: {
+                   'collects': api.user_favorite_playlists(uid, page=page,
+                                                           limit=size)},
+               paged=False, page_size=30),
+)}
+
+
+class LibraryStore(object):
+    """
+    :param path: 数据库文件路径，``:memory:`` 表示使用内存数据库
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS collections ('
+            'user_id INTEGER NOT NULL, '
+            'kind TEXT NOT NULL, '
+            'count INTEGER NOT NULL, '
+            'items BLOB NOT NULL, '
+            'synced_at REAL NOT NULL, '
+            'PRIMARY KEY (user_id, kind))')
+        self._conn.commit()
+
+    def get(self, user_id, kind):
+        """返回 ``(count, items, synced_at)``，没有保存时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT count, items, synced_at FROM collections '
+                'WHERE user_id=? AND kind=?', (int(user_id), kind)).fetchone()
+        if row is None:
+            return None
+        count, blob, synced_at = row
+        return count, codec.loads(zlib.decompress(blob)), synced_at
+
+    def set(self, user_id, kind, count, items):
+        blob = zlib.compress(codec.dumps(items).encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO collections '
+                '(user_id, kind, count, items, synced_at) VALUES (?, ?, ?, ?, ?)',
+                (int(user_id), kind, count, blob, time.time()))
+            self._conn.commit()
+
+    def touch(self, user_id, kind):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE collections SET synced_at=? WHERE user_id=? AND kind=?',
+                (time.time(), int(user_id), kind))
+            self._conn.commit()
+
+    def clear(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._conn.execute('DELETE FROM collections')
+            else:
+                self._conn.execute('DELETE FROM collections WHERE user_id=?',
+                                   (int(user_id),))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _prepended(old_ids, new_ids):
+    """new_ids 是不是在 old_ids 开头插入了 k 个条目，是的话返回 k，否则返回 None
+
+    >>> _prepended(['a', 'b', 'c'], ['x', 'a', 'b'])
+    1
+    >>> _prepended(['a', 'b', 'c'], ['a', 'c', 'd']) is None
+    True
+    """
+    for k in range(1, len(new_ids)):
+        rest = new_ids[k:]
+        if old_ids[:len(rest)] == rest:
+            return k
+    return None
+
+
+class LibrarySync(object):
+    """
+    :param api: fuo_xiami.api.API
+    :param store: LibraryStore
+    :param user_id: 登录用户的 id
+    :param workers: 整体替换时并发请求的页面数
+    """
+
+    def __init__(self, api, store, user_id, workers=4):
+        self.api = api
+        self.store = store
+        self.user_id = user_id
+        self.workers = workers
+        self._thread = None
+
+    def has(self, kind):
+        return self.store.get(self.user_id, kind) is not None
+
+    def load(self, kind):
+        """从本地读取 model 列表，没有保存时返回 None"""
+        state = self.store.get(self.user_id, kind)
+        if state is None:
+            return None
+        load = COLLECTIONS[kind].load
+        return [load(item) for item in state[1]]
+
+    def load_g(self, kind):
+        """和 XUserModel.fav_songs 等属性一样返回 GeneratorProxy"""
+        state = self.store.get(self.user_id, kind)
+        if state is None:
+            return None
+        load = COLLECTIONS[kind].load
+        count, items, _ = state
+        return GeneratorProxy((load(item) for item in items), len(items))
+
+    def sync(self, kind):
+        """和服务端同步一种列表，返回 UNCHANGED/INCREMENTAL/FULL"""
+        collection = COLLECTIONS[kind]
+        first = collection.fetch(self.api, self.user_id, 1, collection.page_size)
+        page_items = [collection.compact(item)
+                      for item in first.get(collection.field) or []]
+        if not collection.paged:
+            count = len(page_items)
+        else:
+            count = int(first['pagingVO']['count'])
+
+        state = self.store.get(self.user_id, kind)
+        if state is not None:
+            old_count, old_items, _ = state
+            old_ids = collection.ids(old_items)
+            new_ids = collection.ids(page_items)
+            if count == old_count and old_ids[:len(new_ids)] == new_ids:
+                if collection.paged or old_items == page_items:
+                    self.store.touch(self.user_id, kind)
+                    return UNCHANGED
+            elif collection.paged:
+                k = _prepended(old_ids, new_ids)
+                if k is not None and count == old_count + k:
+                    self.store.set(self.user_id, kind, count,
+                                   page_items[:k] + old_items)
+                    return INCREMENTAL
+
+        items = page_items
+        if collection.paged:
+            items = items + self._fetch_rest(collection, first)
+        self.store.set(self.user_id, kind, count, items)
+        return FULL
+
+    def _fetch_rest(self, collection, first):
+        pages = int(first['pagingVO']['pages'])
+        if pages <= 1:
+            return []
+
+        def fetch(page):
+            data = collection.fetch(self.api, self.user_id, page,
+                                    collection.page_size)
+            return [collection.compact(item)
+                    for item in data.get(collection.field) or []]
+
+        priority = current_priority()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pages_items = list(executor.map(
+                lambda page: run_with_priority(priority, fetch, page),
+                range(2, pages + 1)))
+        return [item for page_items in pages_items for item in page_items]
+
+    def sync_all(self, kinds=tuple(COLLECTIONS), on_synced=None):
+        """依次同步 kinds，``on_synced(kind, status)`` 在每种列表同步之后调用
+
+        某种列表同步失败时，记录日志并继续同步其它列表。
+        """
+        rv = {}
+        for kind in kinds:
+            try:
+                status = self.sync(kind)
+            except Exception:  # noqa
+                logger.exception('sync {} failed'.format(kind))
+                continue
+            rv[kind] = status
+            logger.info('library {}: {}'.format(kind, status))
+            if on_synced is not None:
+                on_synced(kind, status)
+        return rv
+
+    def start_sync(self, kinds=tuple(COLLECTIONS), on_synced=None):
+        """在后台线程中以 BULK 优先级调用 sync_all，返回该线程
+
+        上一次同步还没有结束时，直接返回上一次的线程。
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self._thread = threading.Thread(target=run_with_priority,
+                                        args=(BULK, self.sync_all, kinds, on_synced),
+                                        name='xiami-library-sync', daemon=True)
+        self._thread.start()
+        return self._thread
@@ -0,0 +1,312 @@
+"""
+手写的反序列化函数
+~~~~~~~~~~~~~~~~
+
+marshmallow 在加载一页（比如 200 首）歌曲时开销比较大：每个字段都要经过
+反射、嵌套 Schema、post_load 钩子等步骤。这里针对 schemas.py 中的
+Schema 手写了等价的加载函数，它们产生的 model 和对应的 Schema 一致。
+
+每个函数都有一个 trusted 参数。trusted 为 False 时，对字段的校验和
+marshmallow 保持一致（必填字段、类型、是否可以为 null），校验失败时
+抛出 marshmallow.ValidationError；trusted 为 True 时，跳过这些校验，
+只做必要的类型转换，适用于确定来自虾米服务端的数据。
+"""
+
+import logging
+import time
+from collections.abc import Mapping
+
+from marshmallow import ValidationError
+
+from fuocore.media import Media
+
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+#: 虾米的音质 -> feeluown 的音质
+Q_Q_MAPPING = {'m': 'shq',  # for example: flac
+               's': 'shq',
+               'h': 'hq',
+               'l': 'sq',
+               'f': 'lq',
+               'e': 'lq'}
+
+
+def _get(data, key, required=False, allow_none=False, default=_MISSING):
+    value = data.get(key, _MISSING)
+    if value is _MISSING:
+        if required:
+            raise ValidationError('Missing data for required field.', key)
+        return default
+    if value is None and not allow_none:
+        raise ValidationError('Field may not be null.', key)
+    return value
+
+
+def _int(data, key, **kwargs):
+    value = _get(data, key, **kwargs)
+    if value is None or value is _MISSING:
+        return value
+    if value is True or value is False:
+        raise ValidationError('Not a valid integer.', key)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError('Not a valid integer.', key) from None
+
+
+def _str(data, key, **kwargs):
+    value = _get(data, key, **kwargs)
+    if value is None or value is _MISSING or isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            raise ValidationError('Not a valid utf-8 string.', key) from None
+    raise ValidationError('Not a valid string.', key)
+
+
+def _list(data, key, loader, trusted, **kwargs):
+    value = _get(data, key, **kwargs)
+    if value is None or value is _MISSING:
+        return value
+    if not isinstance(value, (list, tuple)):
+        raise ValidationError('Not a valid list.', key)
+    for item in value:
+        if not isinstance(item, Mapping):
+            raise ValidationError('Invalid input type.', key)
+    return [loader(item, trusted) for item in value]
+
+
+def _trusted_list(data, key, loader, default=_MISSING):
+    value = data.get(key, default)
+    if value is None or value is _MISSING:
+        return value
+    return [loader(item, True) for item in value]
+
+
+def _present(**kwargs):
+    """去掉值为 _MISSING 的字段，和 marshmallow 的行为保持一致"""
+    return {k: v for k, v in kwargs.items() if v is not _MISSING}
+
+
+def load_artist(data, trusted=False):
+    if trusted:
+        fields = dict(identifier=int(data['artistId']),
+                      name=data['artistName'],
+                      cover=data.get('artistLogo'),
+                      desc=data.get('description'))
+    else:
+        fields = dict(identifier=_int(data, 'artistId', required=True),
+                      name=_str(data, 'artistName', required=True),
+                      cover=_str(data, 'artistLogo', allow_none=True, default=None),
+                      desc=_str(data, 'description', allow_none=True, default=None))
+    return identity_map.get_or_create(XArtistModel, **fields)
+
+
+def load_listen_file(data, trusted=False):
+    if trusted:
+        url = data.get('url')
+        url_bak = data.get('listenFile')
+        quality = data['quality']
+        format = data['format']
+    else:
+        quality = _str(data, 'quality', required=True)
+        url = _str(data, 'url', allow_none=True, default=None)
+        url_bak = _str(data, 'listenFile', allow_none=True, default=None)
+        format = _str(data, 'format', required=True)
+    return {'quality': quality,
+            'url': url or url_bak,
+            'url_bak': url_bak,
+            'format': format}
+
+
+def _parse_bitrate(url):
+    """从链接的域名中解析出码率
+
+    url example: http://m720.xiami.net/...，和
+    ``int(urlparse(url).netloc.split('.')[0][1:])`` 等价，但是快得多。
+    """
+    start = url.find('://')
+    if start == -1:
+        return None
+    netloc = url[start + 3:]
+    for sep in '/?#':
+        end = netloc.find(sep)
+        if end != -1:
+            netloc = netloc[:end]
+    try:
+        return int(netloc.split('.', 1)[0][1:])
+    except ValueError:
+        return None
+
+
+def to_q_media_mapping(lfiles):
+    """和 ListenFileSchema.to_q_media_mapping 等价"""
+    q_media_mapping = {}
+    for lfile in lfiles or ():
+        url = lfile['url']
+        if not url:
+            continue
+        quality = lfile['quality']
+        field = Q_Q_MAPPING.get(quality)
+        if field is None:
+            field = 'lq'
+            logger.warning('unknown quality {}, url {}'.format(quality, url))
+        q_media_mapping[field] = Media(url, format=lfile['format'],
+                                       bitrate=_parse_bitrate(url))
+    return q_media_mapping
+
+
+def load_song(data, trusted=False):
+    """SongSchema 和 NestedSongSchema 的加载结果是一样的"""
+    if trusted:
+        identifier = int(data['songId'])
+        mvid = data['mvId']
+        title = data['songName']
+        duration = data.get('length', '0')
+        files = _trusted_list(data, 'listenFiles', load_listen_file, default=[])
+        artists = [load_artist(artist, True) for artist in data['singerVOs']]
+        album_id = int(data['albumId'])
+        album_name = data['albumName']
+        album_cover = data['albumLogo']
+    else:
+        identifier = _int(data, 'songId', required=True)
+        mvid = _str(data, 'mvId', required=True)
+        title = _str(data, 'songName', required=True)
+        duration = _str(data, 'length', default='0')
+        _str(data, 'listenFile', default='')
+        files = _list(data, 'listenFiles', load_listen_file, False, default=[])
+        artists = _list(data, 'singerVOs', load_artist, False, required=True)
+        album_id = _int(data, 'albumId', required=True)
+        album_name = _str(data, 'albumName', required=True)
+        album_cover = _str(data, 'albumLogo', required=True)
+
+    album = identity_map.get_or_create(XAlbumModel,
+                                       identifier=album_id,
+                                       name=album_name,
+                                       cover=album_cover)
+    url = files[0]['url'] if files else ''
+    return identity_map.get_or_create(XSongModel,
+                                      identifier=identifier,
+                                      mvid=mvid,
+                                      title=title,
+                                      url=url,
+                                      duration=int(duration),
+                                      album=album,
+                                      artists=artists,
+                                      q_media_mapping=to_q_media_mapping(files),
+                                      expired_at=int(time.time()) + 60 * 60)
+
+
+def load_song_meta(data):
+    """加载插件自己保存的歌曲（LibraryStore、SongIndex），它们没有播放链接
+
+    和 SongTable.model 一样，q_media_mapping、url 和 expired_at 为空，
+    播放时 model 会自己获取（UrlRefresher 也会批量刷新）。
+    """
+    album = identity_map.get_or_create(XAlbumModel,
+                                       identifier=int(data['albumId']),
+                                       name=data['albumName'],
+                                       cover=data['albumLogo'])
+    artists = [load_artist(artist, True) for artist in data['singerVOs']]
+    return identity_map.get_or_create(XSongModel,
+                                      identifier=int(data['songId']),
+                                      mvid=data['mvId'],
+                                      title=data['songName'],
+                                      duration=int(data.get('length') or 0),
+                                      album=album,
+                                      artists=artists)
+
+
+def load_album(data, trusted=False):
+    if trusted:
+        fields = _present(identifier=int(data['albumId']),
+                          name=data['albumName'],
+                          cover=data['albumLogo'],
+                          songs=_trusted_list(data, 'songs', load_song),
+                          artists=_trusted_list(data, 'artists', load_artist),
+                          desc=data.get('description', _MISSING))
+    else:
+        fields = _present(identifier=_int(data, 'albumId', required=True),
+                          name=_str(data, 'albumName', required=True),
+                          cover=_str(data, 'albumLogo', required=True),
+                          songs=_list(data, 'songs', load_song, False),
+                          artists=_list(data, 'artists', load_artist, False),
+                          desc=_str(data, 'description'))
+    return identity_map.get_or_create(XAlbumModel, **fields)
+
+
+def load_mv(data, trusted=False):
+    if trusted:
+        fields = dict(identifier=data['mvId'],
+                      name=data['title'],
+                      cover=data['mvCover'],
+                      media=data['mp4Url'])
+    else:
+        fields = dict(identifier=_str(data, 'mvId', required=True),
+                      name=_str(data, 'title', required=True),
+                      cover=_str(data, 'mvCover', required=True),
+                      media=_str(data, 'mp4Url', required=True))
+    return identity_map.get_or_create(XMvModel, **fields)
+
+
+def load_playlist(data, trusted=False):
+    if trusted:
+        fields = dict(identifier=data['listId'],
+                      uid=int(data['userId']),
+                      name=data['collectName'],
+                      cover=data['collectLogo'],
+                      songs=_trusted_list(data, 'songs', load_song, default=None),
+                      desc=data.get('description'))
+    else:
+        fields = dict(identifier=_str(data, 'listId', required=True),
+                      uid=_int(data, 'userId', required=True),
+                      name=_str(data, 'collectName', required=True),
+                      cover=_str(data, 'collectLogo', required=True),
+                      songs=_list(data, 'songs', load_song, False,
+                                  allow_none=True, default=None),
+                      desc=_str(data, 'description', allow_none=True, default=None))
+    return identity_map.get_or_create(XPlaylistModel, **fields)
+
+
+def load_search(data, trusted=False):
+    if trusted:
+        fields = _present(songs=_trusted_list(data, 'songs', load_song),
+                          albums=_trusted_list(data, 'albums', load_album),
+                          artists=_trusted_list(data, 'artists', load_artist),
+                          playlists=_trusted_list(data, 'collects', load_playlist))
+    else:
+        fields = _present(songs=_list(data, 'songs', load_song, False),
+                          albums=_list(data, 'albums', load_album, False),
+                          artists=_list(data, 'artists', load_artist, False),
+                          playlists=_list(data, 'collects', load_playlist, False))
+    return XSearchModel(**fields)
+
+
+def load_user(data, trusted=False):
+    if trusted:
+        fields = _present(identifier=int(data['userId']) if 'userId' in data
+                          else _MISSING,
+                          name=data.get('nickName', _MISSING),
+                          access_token=data.get('accessToken', _MISSING))
+    else:
+        fields = _present(identifier=_int(data, 'userId'),
+                          name=_str(data, 'nickName'),
+                          access_token=_str(data, 'accessToken'))
+    return XUserModel(**fields)
+
+
+from .models import (  # noqa
+    identity_map,
+    XAlbumModel,
+    XArtistModel,
+    XMvModel,
+    XPlaylistModel,
+    XSongModel,
+    XSearchModel,
+    XUserModel,
+)
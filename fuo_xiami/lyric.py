@@ -0,0 +1,172 @@
+"""
+歌词
+~~~~
+
+- LyricStore：基于 SQLite 的歌词存储，内容用 zlib 压缩。歌词不会变化，
+  所以不会过期，超出容量时淘汰最久没有被访问的歌词；
+- LyricTimeline：解析一次 LRC 歌词，之后根据播放进度二分查找当前行；
+- LyricPrefetcher：切歌时在后台获取播放列表中接下来几首歌曲的歌词，
+  播放时就不需要再等待歌词请求了。
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+
+from .prefetch import QueuePrefetcher
+
+logger = logging.getLogger(__name__)
+
+
+class LyricStore(object):
+    """
+    :param path: 数据库文件路径，``:memory:`` 表示使用内存数据库
+    :param max_entries: 最多保存的歌词数量
+    """
+
+    def __init__(self, path, max_entries=20000):
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS lyrics ('
+            'song_id INTEGER PRIMARY KEY, '
+            'content BLOB NOT NULL, '
+            'accessed_at REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS lyrics_accessed_at '
+                           'ON lyrics (accessed_at)')
+        self._conn.commit()
+        # 和 ResponseCache 一样，条目数保存在内存中，set 时不用 COUNT(*)
+        self._count = self._conn.execute('SELECT COUNT(*) FROM lyrics').fetchone()[0]
+
+    def get(self, song_id):
+        """返回歌词，没有保存时返回 None（没有歌词的歌曲保存为空字符串）"""
+        with self._lock:
+            row = self._conn.execute('SELECT content FROM lyrics WHERE song_id=?',
+                                     (int(song_id),)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE lyrics SET accessed_at=? WHERE song_id=?',
+                               (time.time(), int(song_id)))
+            self._conn.commit()
+            self.hits += 1
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def set(self, song_id, content):
+        blob = zlib.compress((content or '').encode('utf-8'))
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM lyrics WHERE song_id=?',
+                                        (int(song_id),)).fetchone() is not None
+            self._conn.execute(
+                'INSERT OR REPLACE INTO lyrics (song_id, content, accessed_at) '
+                'VALUES (?, ?, ?)', (int(song_id), blob, time.time()))
+            if not exists:
+                self._count += 1
+            if self._count > self.max_entries:
+                cursor = self._conn.execute(
+                    'DELETE FROM lyrics WHERE song_id IN ('
+                    'SELECT song_id FROM lyrics ORDER BY accessed_at LIMIT ?)',
+                    (self._count - self.max_entries,))
+                self._count -= cursor.rowcount
+            self._conn.commit()
+
+    def __contains__(self, song_id):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM lyrics WHERE song_id=?',
+                                      (int(song_id),)).fetchone() is not None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_TIME_TAG = re.compile(r'\[(\d+):(\d+(?:\.\d+)?)\]')
+_OFFSET_TAG = re.compile(r'^\[offset:\s*([+-]?\d+)\]', re.IGNORECASE)
+# 逐字歌词的时间标记，比如 <1234>
+_WORD_TAG = re.compile(r'<\d+>')
+
+
+class LyricTimeline(object):
+    """按时间排序的歌词行
+
+    >>> timeline = LyricTimeline('[00:01.00]a\\n[00:03.50][00:10.00]b\\n')
+    >>> timeline.lines
+    ['a', 'b', 'b']
+    >>> timeline.line_at(3.6), timeline.index_at(0.5)
+    ('b', -1)
+    """
+
+    def __init__(self, content):
+        offset = 0
+        entries = []
+        for line in (content or '').splitlines():
+            line = line.strip()
+            m = _OFFSET_TAG.match(line)
+            if m is not None:
+                # offset 为正时歌词提前显示
+                offset = int(m.group(1))
+                continue
+            times = []
+            pos = 0
+            while True:
+                m = _TIME_TAG.match(line, pos)
+                if m is None:
+                    break
+                minutes, seconds = m.groups()
+                times.append(int(minutes) * 60000 + round(float(seconds) * 1000))
+                pos = m.end()
+            if not times:
+                continue
+            text = _WORD_TAG.sub('', line[pos:]).strip()
+            entries.extend((ms, text) for ms in times)
+        entries.sort(key=lambda entry: entry[0])  # 稳定排序，同一时间保持原顺序
+        #: 每一行的开始时间（毫秒）
+        self.times = array('q', (max(ms - offset, 0) for ms, _ in entries))
+        self.lines = [text for _, text in entries]
+
+    def __len__(self):
+        return len(self.lines)
+
+    def index_at(self, position):
+        """播放到 position 秒时应该显示的行，还没有到第一行时返回 -1"""
+        return bisect_right(self.times, int(position * 1000)) - 1
+
+    def line_at(self, position):
+        index = self.index_at(position)
+        return self.lines[index] if index >= 0 else ''
+
+
+class LyricPrefetcher(QueuePrefetcher):
+    """在后台获取播放列表中当前歌曲之后 count 首歌曲的歌词
+
+    :param source: 返回当前播放列表的函数，比如 ``app.playlist.list``
+    :param count: 预取的歌曲数
+    """
+
+    @staticmethod
+    def prefetch(songs):
+        """获取这些歌曲的歌词，已经获取过的会被跳过，返回获取的数量"""
+        count = 0
+        for song in songs:
+            load = getattr(song, 'load_lyric', None)
+            if load is None:
+                continue
+            try:
+                if load():
+                    count += 1
+            except Exception:  # noqa
+                logger.exception('prefetch lyric of {} failed'.format(song))
+        return count
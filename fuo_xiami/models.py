@@ -1,5 +1,10 @@
+import asyncio
 import logging
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock, Thread
+from weakref import WeakValueDictionary
 
 from fuocore.models import cached_field
 from fuocore.models import (
@@ -16,28 +21,156 @@ from fuocore.models import (
     SearchType,
 )
 
+from .lyric import LyricTimeline
 from .provider import provider
+from .scheduler import current_priority, run_with_priority, PREFETCH
 
 logger = logging.getLogger(__name__)
 
+#: 对于可能有很多页的列表（比如收藏的歌曲），create_g 预取的页数
+PREFETCH_PAGES = 4
+
+#: 歌手的歌曲和专辑、收藏的歌手和专辑是否流式读取每一页（参考 stream 模块）。
+#: 流式请求不经过响应缓存、请求合并和重试，所以默认关闭
+STREAM_PAGES = False
+
+#: 保护各个歌单的 hydrate 锁和线程的创建
+_HYDRATION_LOCK = RLock()
+
 
 class XBaseModel(BaseModel):
     _api = provider.api
+    _aapi = provider.aapi
 
     class Meta:
         allow_get = True
         provider = provider
 
+    def merge(self, **fields):
+        """把同一个资源再次出现时的字段合并到当前实例
+
+        值为 None 的字段视为“未知”，不会覆盖已有的值。
+        """
+        for field, value in fields.items():
+            if field not in self.meta.fields or field == 'identifier':
+                continue
+            if value is None:
+                continue
+            setattr(self, field, value)
+
+
+class IdentityMap(object):
+    """(model 类型, identifier) -> model 实例的弱引用映射
+
+    同一首歌曲/专辑/歌手可能出现在搜索结果、歌单、专辑歌曲列表等地方，
+    反序列化时通过 IdentityMap 复用已有的实例，新出现的字段会被合并进去。
+    当 model 实例不再被使用时，它会自动从映射中移除。
+    """
+
+    def __init__(self):
+        self._models = WeakValueDictionary()
+        self._lock = RLock()
+        #: model 类型 -> [listener]
+        self._listeners = {}
+
+    def get_or_create(self, model_cls, identifier, **fields):
+        identity_cls = self._identity_cls(model_cls)
+        key = (identity_cls, identifier)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = model_cls(identifier=identifier, **fields)
+                self._models[key] = model
+            else:
+                model.merge(**fields)
+        for listener in self._listeners.get(identity_cls, ()):
+            listener(model, fields)
+        return model
+
+    def add_listener(self, model_cls, listener):
+        """每次 get_or_create 得到 model_cls 类型的 model 之后调用
+        ``listener(model, fields)``，listener 在反序列化的热路径上，需要足够快
+        """
+        self._listeners.setdefault(model_cls, []).append(listener)
+
+    def get(self, model_cls, identifier):
+        return self._models.get((self._identity_cls(model_cls), identifier))
+
+    @staticmethod
+    def _identity_cls(model_cls):
+        # 延迟解析的 model（参考 lazy 模块）和对应的普通 model 共享实例
+        return getattr(model_cls, '_identity_cls', model_cls)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def __len__(self):
+        return len(self._models)
+
+
+identity_map = IdentityMap()
+
+
+#: 反序列化的实现，见 set_deserializer
+_deserializer = {'name': 'fast', 'trusted': False, 'loaders': {}}
+
+
+def set_deserializer(name, trusted=False):
+    """选择反序列化的实现
+
+    :param name: ``fast`` 使用 loaders 模块中手写的加载函数，
+        ``marshmallow`` 使用 schemas 模块中的 Schema，两者得到的 model 一致；
+        ``lazy`` 和 fast 类似，但歌曲、专辑、歌单的大部分字段在第一次访问时
+        才解析，参考 lazy 模块。
+    :param trusted: 对 fast 和 lazy 有效，为 True 时跳过字段校验
+    """
+    if name not in ('fast', 'lazy', 'marshmallow'):
+        raise ValueError('invalid deserializer: {}'.format(name))
+    loaders = {}
+    if name == 'lazy':
+        from .lazy import LAZY_LOADERS
+        loaders.update(LAZY_LOADERS)
+    _deserializer['name'] = name
+    _deserializer['trusted'] = trusted
+    _deserializer['loaders'] = loaders
+
 
 def _deserialize(data, schema_cls):
+    if _deserializer['name'] != 'marshmallow':
+        loader = _deserializer['loaders'].get(schema_cls) or \
+            FAST_LOADERS.get(schema_cls)
+        if loader is not None:
+            return loader(data, _deserializer['trusted'])
     schema = schema_cls()
     obj = schema.load(data)
     return obj
 
 
-def create_g(func, identifier, field='songs', schema=None):
-    if schema is None:
-        schema = NestedSongSchema
+def create_g(func, identifier, field='songs', schema=None, prefetch=0,
+             stream=False, table=None):
+    """创建一个分页读取数据的 GeneratorProxy
+
+    :param prefetch: 预取窗口大小。为 0 时，消费完一页之后才请求下一页；
+        大于 0 时，根据第一页返回的 pagingVO.pages 并发地请求后续页面，
+        同时最多有 prefetch 个页面在请求中。
+    :param stream: 是否流式读取每一页（func 需要支持 stream 参数，
+        参考 API.request_stream），一页还没下载完就可以返回前面的条目。
+        和 prefetch 不能同时使用。
+    :param table: 一个 SongTable（参考 table 模块）。指定时，歌曲被直接
+        添加到 table 中，generator 返回的是 SongRow 而不是 model。
+    """
+    if table is not None:
+        load = table.append
+    else:
+        if schema is None:
+            schema = NestedSongSchema
+
+        def load(obj_data):
+            return _deserialize(obj_data, schema)
+
+    if stream:
+        return _create_stream_g(func, identifier, field, load)
     data = func(identifier, page=1)
     # user_favorite_songs 接口返回的数据有 total 字段，
     # 但 playlist_detail_v2 接口返回的数据没有 total 字段，
@@ -57,13 +190,78 @@ def create_g(func, identifier, field='songs', schema=None):
             while page <= pages:
                 obj_data_list = data[field]
                 for obj_data in obj_data_list:
-                    yield _deserialize(obj_data, schema)
+                    yield load(obj_data)
                 page += 1
                 data = func(identifier, page, page_size)
+
+    def prefetch_g():
+        paging = data['pagingVO']
+        page_size = int(paging['pageSize'])
+        pages = int(paging['pages'])
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        # 预取的页面不应该比调用方本身的请求更紧急
+        prefetch_priority = max(current_priority(), PREFETCH)
+        futures = deque()
+        next_page = int(paging['page']) + 1
+        try:
+            page_data = data
+            while True:
+                # 消费当前页之前，先把预取窗口填满
+                while next_page <= pages and len(futures) < prefetch:
+                    futures.append(executor.submit(
+                        run_with_priority, prefetch_priority,
+                        func, identifier, next_page, page_size))
+                    next_page += 1
+                for obj_data in page_data[field] or []:
+                    yield load(obj_data)
+                if not futures:
+                    break
+                page_data = futures.popleft().result()
+        finally:
+            # 消费方不再读取时（generator 被关闭或回收），停止预取
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    if data is not None and prefetch > 0:
+        return GeneratorProxy(prefetch_g(), total)
     # FIXME: use SequentialRandomReader instead of GeneratorProxy
     return GeneratorProxy(g(), total)
 
 
+def _create_stream_g(func, identifier, field, load):
+    response = func(identifier, page=1, stream=True)
+    items = iter(response)
+    # 总数在 pagingVO 中，它可能出现在列表之后，在此之前读到的条目先缓存起来
+    buffered = deque()
+    for name, item in items:
+        if name == field:
+            buffered.append(item)
+        if 'pagingVO' in response.data:
+            break
+    paging = response.data.get('pagingVO')
+    total = int(paging['count']) if paging else len(buffered)
+
+    def g():
+        while buffered:
+            yield load(buffered.popleft())
+        for name, item in items:
+            if name == field:
+                yield load(item)
+        if not paging:
+            return
+        page = int(paging['page'])
+        page_size = int(paging['pageSize'])
+        pages = int(paging['pages'])
+        while page < pages:
+            page += 1
+            for name, item in func(identifier, page, page_size, stream=True):
+                if name == field:
+                    yield load(item)
+
+    return GeneratorProxy(g(), total)
+
+
 class XMvModel(MvModel, XBaseModel):
     @classmethod
     def get(cls, identifier):
@@ -71,6 +269,12 @@ class XMvModel(MvModel, XBaseModel):
         if data is not None:
             return _deserialize(data, MvSchema)
 
+    @classmethod
+    async def aget(cls, identifier):
+        data = await cls._aapi.mv_detail(identifier)
+        if data is not None:
+            return _deserialize(data, MvSchema)
+
 
 class XSongModel(SongModel, XBaseModel):
 
@@ -86,12 +290,30 @@ class XSongModel(SongModel, XBaseModel):
             return None
         return _deserialize(data, SongSchema)
 
+    @classmethod
+    async def aget(cls, identifier):
+        data = await cls._aapi.song_detail(identifier)
+        if data is None:
+            return None
+        return _deserialize(data, SongSchema)
+
     def refresh_url(self):
         song = self.get(self.identifier)
         self.url = song.url
         self.q_media_mapping = song.q_media_mapping
         self.expired_at = song.expired_at
 
+    def merge(self, **fields):
+        # 没有播放链接时，不应该更新链接的过期时间；
+        # 有的接口没有 length 字段，此时 duration 为 0
+        if not fields.get('q_media_mapping'):
+            fields.pop('q_media_mapping', None)
+            fields.pop('url', None)
+            fields.pop('expired_at', None)
+        if not fields.get('duration'):
+            fields.pop('duration', None)
+        super().merge(**fields)
+
     @property
     def is_expired(self):
         return self.expired_at is not None and time.time() >= self.expired_at
@@ -110,14 +332,20 @@ class XSongModel(SongModel, XBaseModel):
 
     @property
     def lyric(self):
+        if self._lyric is None:
+            self.load_lyric()
+        return self._lyric
+
+    def load_lyric(self):
+        """获取歌词，已经获取过时返回 False"""
         if self._lyric is not None:
-            return self._lyric
+            return False
         content = self._api.song_lyric(self.identifier)
-        self.lyric = LyricModel(
+        self.lyric = XLyricModel(
             identifier=self.identifier,
             content=content
         )
-        return self._lyric
+        return True
 
     @lyric.setter
     def lyric(self, value):
@@ -145,11 +373,36 @@ class XSongModel(SongModel, XBaseModel):
         return list((self.q_media_mapping or {}).keys())
 
     def get_media(self, quality):
+        media = self.get_remote_media(quality)
+        proxy = provider.media_proxy
+        if proxy is not None:
+            # 开头已经预取时，播放本地代理拼接的文件，参考 audio 模块
+            try:
+                return proxy.wrap(self, quality, media)
+            except Exception:  # noqa
+                logger.exception('wrap media of {} failed, use remote url'
+                                 .format(self))
+        return media
+
+    def get_remote_media(self, quality):
         if self.is_expired:
             self.refresh_url()
         return self.q_media_mapping.get(quality)
 
 
+class XLyricModel(LyricModel):
+
+    @property
+    def timeline(self):
+        """解析之后的歌词，参考 fuo_xiami.lyric.LyricTimeline"""
+        # 只解析一次，content 被修改之后重新解析
+        cached = self.__dict__.get('_timeline')
+        if cached is None or cached[0] is not self.content:
+            cached = self.__dict__['_timeline'] = (self.content,
+                                                   LyricTimeline(self.content))
+        return cached[1]
+
+
 class XAlbumModel(AlbumModel, XBaseModel):
 
     @classmethod
@@ -159,6 +412,13 @@ class XAlbumModel(AlbumModel, XBaseModel):
             return None
         return _deserialize(data, AlbumSchema)
 
+    @classmethod
+    async def aget(cls, identifier):
+        data = await cls._aapi.album_detail(identifier)
+        if data is None:
+            return None
+        return _deserialize(data, AlbumSchema)
+
 
 class XArtistModel(ArtistModel, XBaseModel):
     class Meta:
@@ -172,26 +432,33 @@ class XArtistModel(ArtistModel, XBaseModel):
             return None
         return _deserialize(data, ArtistSchema)
 
+    @classmethod
+    async def aget(cls, identifier):
+        data = await cls._aapi.artist_detail(identifier)
+        if data is None:
+            return None
+        return _deserialize(data, ArtistSchema)
+
     @property
     def songs(self):
         if self._songs is None:
-            self._songs = []
+            # 实例可能会被共享（见 IdentityMap），请求成功之后才给 _songs 赋值
             data_songs = self._api.artist_songs(self.identifier)['songs'] or []
-            if data_songs:
-                for data_song in data_songs:
-                    song = _deserialize(data_song, NestedSongSchema)
-                    self._songs.append(song)
+            self._songs = [_deserialize(data_song, NestedSongSchema)
+                           for data_song in data_songs]
         return self._songs
 
     def create_songs_g(self):
-        return create_g(self._api.artist_songs, self.identifier)
+        return create_g(self._api.artist_songs, self.identifier,
+                        stream=STREAM_PAGES)
 
     @songs.setter
     def songs(self, value):
         self._songs = value
 
     def create_albums_g(self):
-        return create_g(self._api.artist_albums, self.identifier, 'albums', AlbumSchema)
+        return create_g(self._api.artist_albums, self.identifier, 'albums', AlbumSchema,
+                        stream=STREAM_PAGES)
 
 
 class XPlaylistModel(PlaylistModel, XBaseModel):
@@ -200,13 +467,129 @@ class XPlaylistModel(PlaylistModel, XBaseModel):
         fields = ('uid', )
         allow_create_songs_g = True
 
+    #: playlist_detail 最多只返回前 100 首歌曲，剩下的歌曲如何获取：
+    #: 'background' 在后台线程中获取，'sync' 在 get/aget 返回之前获取，
+    #: None 不获取（只有前 100 首，默认）
+    hydration = None
+
     @classmethod
     def get(cls, identifier):
-        # FIXME: 获取所有歌曲，而不仅仅是前 100 首
         data = cls._api.playlist_detail(identifier)
         if data is None:
             return None
-        return _deserialize(data, PlaylistSchema)
+        playlist = _deserialize(data, PlaylistSchema)
+        song_ids = playlist._song_ids_to_hydrate(data)
+        if song_ids:
+            if cls.hydration == 'sync':
+                playlist.hydrate(song_ids)
+            else:
+                playlist.start_hydrate(song_ids)
+        return playlist
+
+    @classmethod
+    async def aget(cls, identifier):
+        data = await cls._aapi.playlist_detail(identifier)
+        if data is None:
+            return None
+        playlist = _deserialize(data, PlaylistSchema)
+        song_ids = playlist._song_ids_to_hydrate(data)
+        if song_ids:
+            if cls.hydration == 'sync':
+                await playlist.ahydrate(song_ids)
+            else:
+                playlist.start_hydrate(song_ids)
+        return playlist
+
+    def _song_ids_to_hydrate(self, data):
+        """开启了 hydration 并且 allSongs（歌单所有歌曲的 id）比 songs 多时
+        返回 allSongs，否则返回 None"""
+        if self.hydration is None:
+            return None
+        song_ids = [int(song_id) for song_id in data.get('allSongs') or []]
+        songs = object.__getattribute__(self, 'songs') or []
+        return song_ids if len(song_ids) > len(songs) else None
+
+    def _missing_ids(self, song_ids):
+        songs = object.__getattribute__(self, 'songs') or []
+        existing = {song.identifier for song in songs}
+        missing_ids = []
+        for song_id in song_ids:
+            if song_id not in existing:
+                existing.add(song_id)
+                missing_ids.append(song_id)
+        return missing_ids
+
+    def _hydration_lock(self):
+        with _HYDRATION_LOCK:
+            lock = self.__dict__.get('_hydrating')
+            if lock is None:
+                lock = self._hydrating = RLock()
+        return lock
+
+    def hydrate(self, song_ids, workers=None):
+        """通过 songs_detail 获取 song_ids 中还没有的歌曲，添加到 songs 中
+
+        各批次并发请求，每一批返回后立即按 song_ids 的顺序追加到 songs 中，
+        界面可以逐步展示。同一个歌单同时只有一个 hydrate 在进行，后来的会等待
+        前一个结束，然后只获取仍然缺少的歌曲。另一次 get 通过 IdentityMap
+        替换了 songs 时，已经获取和之后获取的歌曲都会添加到新的列表中。
+        返回获取的歌曲数。
+        """
+        with self._hydration_lock():
+            missing_ids = self._missing_ids(song_ids)
+            fetched = []
+            songs = None
+            existing = set()
+            for _, data_songs in self._api.iter_songs_detail(missing_ids, workers):
+                chunk_songs = [_deserialize(data, SongSchema) for data in data_songs]
+                fetched.extend(chunk_songs)
+                current = object.__getattribute__(self, 'songs')
+                if current is None:
+                    current = self.songs = []
+                if current is not songs:
+                    songs = current
+                    existing = {song.identifier for song in songs}
+                    chunk_songs = fetched
+                new_songs = [song for song in chunk_songs
+                             if song.identifier not in existing]
+                existing.update(song.identifier for song in new_songs)
+                songs.extend(new_songs)
+        logger.debug('playlist({}): hydrated {}/{} songs'
+                     .format(self.identifier, len(fetched), len(missing_ids)))
+        return len(fetched)
+
+    async def ahydrate(self, song_ids, workers=None):
+        """hydrate 的 asyncio 版本，所有批次返回之后一次性添加到 songs 中"""
+        missing_ids = self._missing_ids(song_ids)
+        data_songs = await self._aapi.songs_detail(missing_ids, workers)
+        fetched = [_deserialize(data, SongSchema) for data in data_songs]
+        songs = object.__getattribute__(self, 'songs')
+        if songs is None:
+            songs = self.songs = []
+        existing = {song.identifier for song in songs}
+        songs.extend(song for song in fetched if song.identifier not in existing)
+        return len(fetched)
+
+    def start_hydrate(self, song_ids, workers=None):
+        """在后台线程中调用 hydrate，返回该线程
+
+        这个歌单已经有 hydrate 线程在运行时，直接返回那个线程。
+        """
+        def hydrate():
+            try:
+                run_with_priority(PREFETCH, self.hydrate, song_ids, workers)
+            except Exception:  # noqa
+                logger.exception('playlist({}): hydrate failed'
+                                 .format(self.identifier))
+
+        with _HYDRATION_LOCK:
+            thread = self.__dict__.get('_hydrate_thread')
+            if thread is not None and thread.is_alive():
+                return thread
+            thread = self._hydrate_thread = Thread(
+                target=hydrate, name='xiami-playlist-hydrate', daemon=True)
+            thread.start()
+        return thread
 
     def add(self, song_id, **kwargs):
         rv = self._api.update_playlist_song(self.identifier, song_id, 'add')
@@ -224,7 +607,8 @@ class XPlaylistModel(PlaylistModel, XBaseModel):
         return rv
 
     def create_songs_g(self):
-        return create_g(self._api.playlist_detail_v2, self.identifier)
+        return create_g(self._api.playlist_detail_v2, self.identifier,
+                        prefetch=PREFETCH_PAGES)
 
 
 class XSearchModel(SearchModel, XBaseModel):
@@ -246,6 +630,13 @@ class XUserModel(UserModel, XBaseModel):
             return None
         return _deserialize(user_data, UserSchema)
 
+    @classmethod
+    async def aget(cls, identifier):
+        user_data = await cls._aapi.user_detail(identifier)
+        if user_data is None:
+            return None
+        return _deserialize(user_data, UserSchema)
+
     @cached_field()
     def playlists(self):
         """获取用户创建的歌单
@@ -279,11 +670,23 @@ class XUserModel(UserModel, XBaseModel):
 
     @property
     def fav_songs(self):
-        return create_g(self._api.user_favorite_songs, self.identifier)
+        return create_g(self._api.user_favorite_songs, self.identifier,
+                        prefetch=PREFETCH_PAGES)
 
     @fav_songs.setter
     def fav_songs(self, _): pass
 
+    def create_fav_songs_table(self):
+        """把收藏的歌曲全部读取到一个 SongTable 中
+
+        歌曲很多时，SongTable 比 fav_songs 中的 model 列表节省很多内存。
+        """
+        table = SongTable()
+        for _ in create_g(self._api.user_favorite_songs, self.identifier,
+                          prefetch=PREFETCH_PAGES, table=table):
+            pass
+        return table
+
     def add_to_fav_songs(self, song_id):
         return self._api.update_favorite_song(song_id, 'add')
 
@@ -293,7 +696,8 @@ class XUserModel(UserModel, XBaseModel):
     @property
     def fav_artists(self):
         return create_g(self._api.user_favorite_artists,
-                        self.identifier, 'artists', ArtistSchema)
+                        self.identifier, 'artists', ArtistSchema,
+                        stream=STREAM_PAGES)
 
     @fav_artists.setter
     def fav_artists(self, _): pass
@@ -301,7 +705,8 @@ class XUserModel(UserModel, XBaseModel):
     @property
     def fav_albums(self):
         return create_g(self._api.user_favorite_albums,
-                        self.identifier, 'albums', AlbumSchema)
+                        self.identifier, 'albums', AlbumSchema,
+                        stream=STREAM_PAGES)
 
     @fav_albums.setter
     def fav_albums(self, _): pass
@@ -321,15 +726,156 @@ class XUserModel(UserModel, XBaseModel):
                 for song_data in songs_data]
 
 
-def search(keyword, **kwargs):
-    type_ = SearchType.parse(kwargs['type_'])
-    type_type_map = {
-        SearchType.so: 1,
-        SearchType.al: 10,
-        SearchType.ar: 100,
-        SearchType.pl: 1000,
-    }
-    data = provider.api.search(keyword, type_=type_type_map[type_])
+SEARCH_TYPE_MAP = {
+    SearchType.so: 1,
+    SearchType.al: 10,
+    SearchType.ar: 100,
+    SearchType.pl: 1000,
+}
+
+
+def _parse_search_types(type_):
+    """type_ 可以是一个 SearchType，也可以是一个列表，为 None 时搜索所有类型"""
+    if type_ is None:
+        return list(SEARCH_TYPE_MAP.values())
+    if isinstance(type_, (list, tuple, set)):
+        return [SEARCH_TYPE_MAP[SearchType.parse(t)] for t in type_]
+    return [SEARCH_TYPE_MAP[SearchType.parse(type_)]]
+
+
+_search_engine = None
+_song_index = None
+_singletons_lock = RLock()
+
+
+def get_search_engine():
+    """供 search 使用的 SearchEngine，第一次调用时创建
+
+    可以通过它的 search_as_you_type 实现边输入边搜索。
+    """
+    global _search_engine
+    if _search_engine is None:
+        with _singletons_lock:
+            if _search_engine is None:
+                _search_engine = SearchEngine(provider.api)
+    return _search_engine
+
+
+def get_song_index():
+    """反序列化过的歌曲的本地索引，供 isearch 使用，第一次调用时创建"""
+    global _song_index
+    if _song_index is None:
+        with _singletons_lock:
+            if _song_index is None:
+                from .index import SongIndex
+
+                _song_index = SongIndex()
+    return _song_index
+
+
+def _index_song(model, fields):
+    (_song_index or get_song_index()).observe(model, fields)
+
+
+identity_map.add_listener(XSongModel, _index_song)
+
+
+def _local_songs(keyword):
+    """本地索引中匹配的歌曲，优先使用已有的实例
+
+    索引中没有播放链接，重新构造的歌曲和 LibraryStore 中的一样，
+    播放时再获取链接。
+    """
+    songs = []
+    index = get_song_index()
+    for song_id in index.search(keyword):
+        song = identity_map.get(XSongModel, song_id)
+        if song is None:
+            data = index.get(song_id)
+            if data is None:
+                # 其它线程 flush 时可能已经把它淘汰了
+                continue
+            song = load_song_meta(data)
+        songs.append(song)
+    return songs
+
+
+def _search_local(keyword, kwargs):
+    types = _parse_search_types(kwargs.get('type_'))
+    local = _local_songs(keyword) if SEARCH_TYPE_MAP[SearchType.so] in types else []
+    return types, local
+
+
+def _local_result(keyword, local):
+    return XSearchModel(q=keyword, songs=local, albums=[], artists=[], playlists=[])
+
+
+def _remote_result(keyword, types, local):
+    """服务端的结果，local 排在最前面
+
+    有 local 时，请求失败只记录日志，返回 None。
+    """
+    try:
+        data = get_search_engine().search(keyword, types)
+    except Exception:  # noqa
+        if not local:
+            raise
+        logger.exception('search {!r} failed, only local results'.format(keyword))
+        return None
+    result = _deserialize(data, SearchSchema)
+    result.q = keyword
+    if local:
+        ids = {song.identifier for song in local}
+        result.songs = local + [song for song in result.songs or []
+                                if song.identifier not in ids]
+    return result
+
+
+def isearch(keyword, **kwargs):
+    """和 search 一样，但是会先（立即）返回本地索引中匹配的歌曲
+
+    本地有匹配的歌曲时，首先 yield 只包含这些歌曲的结果，然后 yield
+    和服务端结果合并之后的结果，本地的歌曲排在前面。此时服务端的请求
+    失败的话，只记录日志。
+    """
+    types, local = _search_local(keyword, kwargs)
+    if local:
+        yield _local_result(keyword, local)
+    result = _remote_result(keyword, types, local)
+    if result is not None:
+        yield result
+
+
+def search(keyword, on_remote=None, **kwargs):
+    """并发搜索一种或者多种类型，结果会被缓存，参考 fuo_xiami.search
+
+    本地索引中匹配的歌曲排在最前面，参考 isearch。
+
+    :param on_remote: 指定时，本地有匹配的歌曲就立即返回只包含这些歌曲的结果，
+        和服务端结果合并之后的结果在后台线程中通过 ``on_remote(result)`` 交给
+        调用方（服务端请求失败时不会调用）；本地没有匹配时和不指定一样。
+    """
+    types, local = _search_local(keyword, kwargs)
+    if on_remote is None or not local:
+        result = _remote_result(keyword, types, local)
+        return _local_result(keyword, local) if result is None else result
+
+    def remote():
+        result = _remote_result(keyword, types, local)
+        if result is not None:
+            on_remote(result)
+
+    Thread(target=run_with_priority, args=(current_priority(), remote),
+           name='xiami-search', daemon=True).start()
+    return _local_result(keyword, local)
+
+
+async def asearch(keyword, **kwargs):
+    """search 的 asyncio 版本"""
+    types = _parse_search_types(kwargs.get('type_'))
+    datas = await asyncio.gather(*(provider.aapi.search(keyword, type_=t)
+                                   for t in types))
+    data = merge_results(zip(types, datas))
     result = _deserialize(data, SearchSchema)
     result.q = keyword
     return result
@@ -345,3 +891,27 @@ from .schemas import (  # noqa
     SearchSchema,
     UserSchema,
 )
+from .table import SongTable  # noqa
+from .search import merge_results, SearchEngine  # noqa
+from .loaders import (  # noqa
+    load_album,
+    load_artist,
+    load_mv,
+    load_playlist,
+    load_search,
+    load_song,
+    load_song_meta,
+    load_user,
+)
+
+#: Schema -> 等价的手写加载函数
+FAST_LOADERS = {
+    AlbumSchema: load_album,
+    ArtistSchema: load_artist,
+    MvSchema: load_mv,
+    PlaylistSchema: load_playlist,
+    NestedSongSchema: load_song,
+    SongSchema: load_song,
+    SearchSchema: load_search,
+    UserSchema: load_user,
+}
@@ -0,0 +1,50 @@
+"""
+预取播放列表中接下来的歌曲
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+QueuePrefetcher 是 LyricPrefetcher 和 AudioPrefetcher 共用的部分：
+切歌时找出当前歌曲之后的几首歌曲，在一个后台线程中以 PREFETCH 优先级处理，
+不会和用户的操作抢占请求。
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .scheduler import run_with_priority, PREFETCH
+
+
+class QueuePrefetcher(object):
+    """
+    :param source: 返回当前播放列表的函数，比如 ``app.playlist.list``
+    :param count: 预取的歌曲数
+    """
+
+    def __init__(self, source, count=3):
+        self.source = source
+        self.count = count
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def upcoming(self, song):
+        """播放列表中 song 之后的 count 首歌曲（循环）"""
+        songs = list(self.source())
+        try:
+            index = songs.index(song)
+        except ValueError:
+            return songs[:self.count]
+        rv = []
+        for i in range(1, min(self.count, len(songs) - 1) + 1):
+            rv.append(songs[(index + i) % len(songs)])
+        return rv
+
+    def on_song_changed(self, song, *args):
+        """可以直接连接到 playlist.song_changed 信号"""
+        if song is None:
+            return None
+        return self._executor.submit(run_with_priority, PREFETCH,
+                                     self.prefetch, self.upcoming(song))
+
+    def prefetch(self, songs):
+        """子类实现，在后台线程中调用"""
+        raise NotImplementedError
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
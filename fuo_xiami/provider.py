@@ -1,16 +1,56 @@
 import logging
+from functools import partial
 
 from fuocore.provider import AbstractProvider
 from .api import API
+from .aioapi import AsyncAPI
 
 
 logger = logging.getLogger(__name__)
 
 
+class _LazyModel(object):
+    """第一次访问 provider.Song 这类属性时才导入 models
+
+    models 会导入 marshmallow、schemas 等比较重的模块，feeluown 启动时只需要
+    注册 provider，不需要它们。models 中的 model 类定义时会通过
+    set_model_cls 把自己设置到 provider 上。
+
+    :param name: 属性名。Python 3.5 没有 __set_name__，需要显式传入
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        if self.name not in obj.__dict__:
+            from . import models  # noqa
+        return obj.__dict__[self.name]
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+
+
 class XiamiProvider(AbstractProvider):
+    Song = _LazyModel('Song')
+    Artist = _LazyModel('Artist')
+    Album = _LazyModel('Album')
+    Playlist = _LazyModel('Playlist')
+    Lyric = _LazyModel('Lyric')
+    User = _LazyModel('User')
+
     def __init__(self):
         super().__init__()
         self.api = API()
+        self.aapi = AsyncAPI()
+        #: audio.HeadProxy，设置之后 XSongModel.get_media 会优先使用预取的开头
+        self.media_proxy = None
+        #: 设置之后，本地索引中有匹配的歌曲时 search 立即返回这些歌曲，
+        #: 合并了服务端结果的 XSearchModel 在后台线程中通过
+        #: ``on_remote_search(keyword, result)`` 交给调用方，参考 models.search
+        self.on_remote_search = None
 
     @property
     def identifier(self):
@@ -24,12 +64,15 @@ class XiamiProvider(AbstractProvider):
         assert user.access_token is not None
         self._user = user
         self.api.set_access_token(user.access_token)
+        self.aapi.set_access_token(user.access_token)
 
+    def search(self, keyword, **kwargs):
+        from .models import search
 
-provider = XiamiProvider()
+        on_remote_search = self.on_remote_search
+        if on_remote_search is not None:
+            kwargs.setdefault('on_remote', partial(on_remote_search, keyword))
+        return search(keyword, **kwargs)
 
 
-# 让 provider 能够发现对应 Model
-from .models import search  # noqa
-
-provider.search = search
+provider = XiamiProvider()
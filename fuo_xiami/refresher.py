@@ -0,0 +1,161 @@
+"""
+后台批量刷新播放链接
+~~~~~~~~~~~~~~~~~~~~
+
+虾米的播放链接一个小时之后就会过期，XSongModel 的 url/get_media 发现链接
+过期时会调用 refresh_url，为这一首歌单独请求一次 song_detail。播放列表暂停
+一段时间之后，每次切歌都要先等待这个请求。
+
+UrlRefresher 在后台定期检查播放列表中的歌曲，把即将过期的歌曲通过
+songs_detail 批量刷新（每个请求 200 首），直接更新原来的 model 的
+url、q_media_mapping 和 expired_at，这样切歌时就不需要再等待刷新链接了。
+"""
+
+import logging
+import threading
+import time
+import weakref
+
+from .provider import provider
+from .scheduler import priority, PREFETCH
+
+logger = logging.getLogger(__name__)
+
+
+def expires_at(song):
+    """歌曲播放链接的过期时间，不知道时返回 None
+
+    XSongModel 中有两个过期时间：url setter 设置的 _expired_at 以及
+    加载时设置的 expired_at，取较早的一个。
+    """
+    d = song.__dict__
+    values = [v for v in (d.get('expired_at'), d.get('_expired_at'))
+              if v is not None]
+    return min(values) if values else None
+
+
+class UrlRefresher(object):
+    """
+    :param source: 返回当前播放列表的函数，比如 ``app.playlist.list``，
+        其中不是虾米的歌曲会被忽略
+    :param margin: 距离过期不到 margin 秒的歌曲会被刷新
+    :param interval: 检查的间隔（秒）
+    :param api: 默认为 provider.api
+    """
+
+    def __init__(self, source=None, margin=10 * 60, interval=60, api=None):
+        self.source = source
+        self.margin = margin
+        self.interval = interval
+        self._api = api
+        self._songs = weakref.WeakValueDictionary()
+        #: song id -> 上一次尝试刷新的时间。没有版权的歌曲刷新之后仍然没有
+        #: 链接，margin 秒内不会再次尝试
+        self._attempted_at = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        #: 统计信息：刷新成功的歌曲数和请求批次
+        self.refreshed = 0
+        self.batches = 0
+
+    @property
+    def api(self):
+        return self._api if self._api is not None else provider.api
+
+    def watch(self, songs):
+        """让 refresher 关注这些歌曲（只保存弱引用）"""
+        with self._lock:
+            for song in songs:
+                # 不导入 models，播放列表中有虾米的歌曲时它已经被导入了
+                if getattr(song, 'source', None) == provider.identifier:
+                    self._songs[song.identifier] = song
+
+    def due(self, now=None):
+        """返回需要刷新的歌曲"""
+        now = time.time() if now is None else now
+        if self.source is not None:
+            self.watch(self.source())
+        deadline = now + self.margin
+        with self._lock:
+            songs = list(self._songs.values())
+        rv = []
+        for song in songs:
+            expired_at = expires_at(song)
+            if expired_at is not None and expired_at > deadline:
+                continue
+            attempted_at = self._attempted_at.get(song.identifier)
+            if attempted_at is not None and now - attempted_at < self.margin:
+                continue
+            rv.append(song)
+        return rv
+
+    def refresh_once(self, now=None):
+        """刷新一次即将过期的歌曲，返回刷新成功的歌曲数"""
+        now = time.time() if now is None else now
+        songs = self.due(now)
+        for song_id in list(self._attempted_at):
+            if song_id not in self._songs:
+                del self._attempted_at[song_id]
+        if not songs:
+            return 0
+        # 启动时后台线程就会检查一次，这时播放列表是空的，不应该导入 models
+        from .models import _deserialize, SongSchema
+
+        for song in songs:
+            self._attempted_at[song.identifier] = now
+        # 和界面上的请求相比，这些请求没有那么紧急
+        with priority(PREFETCH):
+            data_songs = self.api.songs_detail([song.identifier for song in songs])
+        self.batches += (len(songs) + 199) // 200
+        id_song_map = {song.identifier: song for song in songs}
+        count = 0
+        for data in data_songs:
+            try:
+                new = _deserialize(data, SongSchema)
+            except Exception:  # noqa
+                logger.exception('refresher: invalid song data')
+                continue
+            song = id_song_map.get(new.identifier)
+            # 没有版权的歌曲没有播放链接，这里避免 model 自动调用 get
+            if song is None or not object.__getattribute__(new, 'q_media_mapping'):
+                continue
+            if new is not song:
+                # 不在 IdentityMap 中的 model，需要手动更新
+                song.q_media_mapping = new.q_media_mapping
+                song.url = new._url
+                song.expired_at = new.expired_at
+            self._attempted_at.pop(song.identifier, None)
+            count += 1
+        self.refreshed += count
+        logger.debug('refresher: refreshed {}/{} songs'.format(count, len(songs)))
+        return count
+
+    def refresh_soon(self, *args):
+        """尽快检查一次，可以连接到播放列表的信号上"""
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='xiami-url-refresher',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh_once()
+            except Exception:  # noqa
+                logger.exception('refresher: refresh failed')
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
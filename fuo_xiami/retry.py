@@ -0,0 +1,246 @@
+"""
+限流时的重试和熔断
+~~~~~~~~~~~~~~~~~~
+
+虾米服务端过载时会返回 ``FAIL_SYS_USER_VALIDATE``
+（``RGV587_ERROR::SM::哎哟喂,被挤爆啦,请稍后重试``）。这时立即重试只会
+让情况更糟，所以：
+
+- 每类 action（按 service 划分，比如 songservice、searchservice）有自己的
+  RetryPolicy：指数退避 + 随机抖动，并且有一个总的截止时间；
+- 每类 action 有一个 CircuitBreaker：连续被限流若干次之后进入 open 状态，
+  在此期间的请求直接失败；冷却时间过后放行一个探测请求，探测成功则恢复。
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+from .excs import XiamiThrottledError
+
+logger = logging.getLogger(__name__)
+
+#: 表示被限流的 code
+THROTTLED_CODES = ('FAIL_SYS_USER_VALIDATE', 'FAIL_SYS_TRAFFIC_LIMIT')
+
+
+def is_throttled(code):
+    return code in THROTTLED_CODES or code.startswith('RGV587_ERROR')
+
+
+def action_class(action):
+    """action 所属的类别，即 service 名字
+
+    >>> action_class('mtop.alimusic.music.songservice.getsongdetail')
+    'songservice'
+    """
+    return action.rsplit('.', 2)[-2]
+
+
+class RetryPolicy(object):
+    """
+    :param max_attempts: 最多尝试的次数（包括第一次）
+    :param base_delay: 第一次重试前等待时间的上限（秒），之后每次翻倍
+    :param max_delay: 等待时间的上限（秒）
+    :param deadline: 从第一次请求开始，超过这个时间（秒）就不再重试
+    """
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=8, deadline=20):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, retries):
+        """第 retries 次重试之前需要等待的时间
+
+        使用 full jitter：在 [0, base_delay * 2^(retries-1)] 中随机取值，
+        避免大量客户端在同一时刻重试。
+        """
+        cap = min(self.max_delay, self.base_delay * 2 ** (retries - 1))
+        return random.uniform(0, cap)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+#: action 类别 -> RetryPolicy，不在其中的使用 DEFAULT_RETRY_POLICY
+RETRY_POLICIES = {
+    # 搜索是用户在等待的操作，不值得等太久
+    'searchservice': RetryPolicy(max_attempts=3, deadline=5),
+    'lyricservice': RetryPolicy(max_attempts=2, deadline=5),
+}
+
+
+class CircuitBreaker(object):
+    """
+    :param name: 名字，一般是 action 类别
+    :param failure_threshold: 连续被限流多少次之后进入 open 状态
+    :param reset_timeout: open 状态持续多久（秒）之后放行一个探测请求
+    :param on_state_change: 状态变化时的回调，参数为 (breaker, old, new)
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30,
+                 on_state_change=None, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        #: 还没有通知的状态变化 [(old, new)]，回调在释放锁之后调用
+        self._changes = []
+        #: 新状态 -> 进入该状态的次数
+        self.state_changes = Counter()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            state = self._state
+        self._notify()
+        return state
+
+    def retry_after(self):
+        """open 状态下，距离放行探测请求还有多久（秒）"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0
+            return max(self._opened_at + self.reset_timeout - self._clock(), 0)
+
+    def allow(self):
+        """是否允许发送请求"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                allowed = True
+            elif self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                allowed = True
+            else:
+                allowed = False
+        self._notify()
+        return allowed
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != self.CLOSED:
+                self._transition(self.CLOSED)
+        self._notify()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or \
+               (self._state == self.CLOSED and
+                    self._failures >= self.failure_threshold):
+                self._opened_at = self._clock()
+                self._transition(self.OPEN)
+        self._notify()
+
+    def release(self):
+        """请求因为其它原因（比如网络错误）失败，不影响熔断状态"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            self._maybe_half_open()
+            stats = {
+                'state': self._state,
+                'failures': self._failures,
+                'state_changes': dict(self.state_changes),
+            }
+        self._notify()
+        return stats
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and \
+           self._clock() - self._opened_at >= self.reset_timeout:
+            self._transition(self.HALF_OPEN)
+
+    def _transition(self, state):
+        # 调用方持有 self._lock
+        old, self._state = self._state, state
+        self.state_changes[state] += 1
+        self._changes.append((old, state))
+
+    def _notify(self):
+        """在锁之外调用 on_state_change，回调中可以访问 state、stats 等"""
+        if not self._changes:
+            return
+        with self._lock:
+            changes, self._changes = self._changes, []
+        for old, new in changes:
+            logger.warning('circuit breaker {}: {} -> {}'.format(self.name, old, new))
+            if self.on_state_change is not None:
+                self.on_state_change(self, old, new)
+
+
+class Retry(object):
+    """一次调用（可能包括多次请求）的重试状态
+
+    使用方式::
+
+        retry = Retry(action, policy, breaker)
+        while True:
+            retry.before_attempt()
+            try:
+                result = send()
+            except BaseException:
+                retry.on_error()
+                raise
+            delay = retry.on_result(result)
+            if delay is None:
+                return result
+            sleep(delay)
+    """
+
+    def __init__(self, action, policy, breaker, clock=time.monotonic):
+        self.action = action
+        self.policy = policy
+        self.breaker = breaker
+        self._clock = clock
+        self._deadline = clock() + policy.deadline
+        self.attempts = 0
+
+    def before_attempt(self):
+        """熔断器处于 open 状态时抛出 XiamiThrottledError"""
+        if not self.breaker.allow():
+            raise XiamiThrottledError(
+                '{}: too many throttled requests, circuit is open'.format(self.action),
+                retry_after=self.breaker.retry_after())
+        self.attempts += 1
+
+    def on_error(self):
+        self.breaker.release()
+
+    def on_result(self, result):
+        """返回重试前需要等待的时间，不需要重试时返回 None
+
+        :param result: API._request 的返回值
+        """
+        if result is None or not is_throttled(result[0]):
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        delay = self.policy.backoff(self.attempts)
+        if self.attempts >= self.policy.max_attempts or \
+           self._clock() + delay > self._deadline:
+            raise XiamiThrottledError(
+                '{}: throttled after {} attempts'.format(self.action, self.attempts),
+                retry_after=delay)
+        logger.info('{} is throttled, retry in {:.2f}s'.format(self.action, delay))
+        return delay
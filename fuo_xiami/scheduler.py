@@ -0,0 +1,351 @@
+"""
+请求调度
+~~~~~~~~
+
+用户点击歌单、搜索这类交互式请求，和后台分页读取收藏、批量获取播放链接
+这类请求，最终都经过 API.request 发出。后台任务运行时，交互式请求会排在它们
+后面，而且请求太多还会触发服务端限流。
+
+Scheduler 位于 API 和 HTTP 之间：
+
+- 请求有三个优先级：INTERACTIVE、PREFETCH、BULK，优先级高的请求先发出，
+  并且总会给 INTERACTIVE 请求留一个并发名额；
+- 令牌桶限速：一个全局的，每类 action（参考 retry.action_class）各一个；
+- 并发上限按照 AIMD 调整：请求成功时缓慢增加，被限流时减半。
+
+优先级通过 contextvars 传递（Python 3.7 之前退化为线程局部变量）::
+
+    with priority(BULK):
+        api.songs_detail(song_ids)
+
+API 默认不使用 Scheduler，需要时通过 API.set_scheduler 设置，
+参考 fuo_xiami.REQUEST_SCHEDULER_ENABLED。
+"""
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+
+try:
+    import contextvars
+except ImportError:  # Python < 3.7
+    contextvars = None
+
+INTERACTIVE = 0
+PREFETCH = 1
+BULK = 2
+
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', PREFETCH: 'prefetch', BULK: 'bulk'}
+
+
+class _LocalPriority(threading.local):
+    """和 ContextVar 接口一致的线程局部变量
+
+    没有 contextvars 时使用，同一个线程中的 asyncio task 共享优先级。
+    """
+
+    value = INTERACTIVE
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        token, self.value = self.value, value
+        return token
+
+    def reset(self, token):
+        self.value = token
+
+
+if contextvars is not None:
+    _priority = contextvars.ContextVar('xiami_request_priority', default=INTERACTIVE)
+else:
+    _priority = _LocalPriority()
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextlib.contextmanager
+def priority(value):
+    """在这个上下文中发出的请求使用 value 优先级"""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def run_with_priority(value, func, *args, **kwargs):
+    """在其它线程中以 value 优先级调用 func
+
+    ThreadPoolExecutor 中的线程不会继承调用方的 contextvars，
+    需要显式地传递优先级。
+    """
+    with priority(value):
+        return func(*args, **kwargs)
+
+
+class TokenBucket(object):
+    """
+    :param rate: 每秒产生的令牌数
+    :param capacity: 桶的容量，即允许的突发请求数
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def wait_time(self):
+        """还需要等待多久（秒）才有一个令牌"""
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self._tokens -= 1
+
+
+class _Waiter(object):
+    __slots__ = ('priority', 'seq', 'family')
+
+    def __init__(self, priority, seq, family):
+        self.priority = priority
+        self.seq = seq
+        self.family = family
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _SchedulerState(object):
+    """Scheduler 和 AsyncScheduler 共用的状态，调用方负责加锁
+
+    :param max_concurrency: 并发上限的最大值
+    :param min_concurrency: 并发上限的最小值
+    :param rate: 全局的令牌桶速率（每秒请求数），为 None 时不限速
+    :param burst: 全局令牌桶的容量
+    :param family_rate: 每类 action 的令牌桶速率，为 None 时不限速
+    :param family_burst: 每类 action 令牌桶的容量
+    :param family_rates: action 类别 -> (rate, burst)，覆盖 family_rate
+    """
+
+    def __init__(self, max_concurrency=8, min_concurrency=1,
+                 rate=20, burst=40, family_rate=10, family_burst=20,
+                 family_rates=None, clock=time.monotonic):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        #: 当前的并发上限，是一个浮点数，使用时向下取整
+        self.limit = float(max(min_concurrency, max_concurrency // 2))
+        self.inflight = 0
+        self._clock = clock
+        self._bucket = TokenBucket(rate, burst, clock) if rate else None
+        self._family_rate = family_rate
+        self._family_burst = family_burst
+        self._family_rates = family_rates or {}
+        self._family_buckets = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self.granted = Counter()
+        self.throttled = 0
+
+    def _family_bucket(self, family):
+        bucket = self._family_buckets.get(family)
+        if bucket is None:
+            rate, burst = self._family_rates.get(
+                family, (self._family_rate, self._family_burst))
+            if not rate:
+                return None
+            bucket = self._family_buckets[family] = TokenBucket(rate, burst,
+                                                                self._clock)
+        return bucket
+
+    def _enqueue(self, priority, family):
+        waiter = _Waiter(priority, next(self._seq), family)
+        heapq.heappush(self._waiters, waiter)
+        return waiter
+
+    def _dequeue(self, waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+
+    def _capacity(self, priority):
+        limit = int(self.limit)
+        # 给交互式请求保留一个名额
+        if priority != INTERACTIVE and limit > 1:
+            limit -= 1
+        return limit
+
+    def _try_grant(self, waiter):
+        """尝试让 waiter 发出请求
+
+        返回 0 表示成功；返回正数表示令牌不足，需要等待的时间；
+        返回 None 表示需要等待其它请求结束。
+        """
+        if self._waiters[0] is not waiter:
+            return None
+        if self.inflight >= self._capacity(waiter.priority):
+            return None
+        buckets = [b for b in (self._bucket, self._family_bucket(waiter.family))
+                   if b is not None]
+        wait = max([b.wait_time() for b in buckets], default=0)
+        if wait > 0:
+            return wait
+        for bucket in buckets:
+            bucket.take()
+        heapq.heappop(self._waiters)
+        self.inflight += 1
+        self.granted[PRIORITY_NAMES[waiter.priority]] += 1
+        return 0
+
+    def _release(self, throttled):
+        self.inflight -= 1
+        if throttled:
+            self.throttled += 1
+            self.limit = max(self.min_concurrency, self.limit / 2)
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def stats(self):
+        waiting = Counter(PRIORITY_NAMES[w.priority] for w in self._waiters)
+        return {
+            'limit': int(self.limit),
+            'inflight': self.inflight,
+            'waiting': dict(waiting),
+            'granted': dict(self.granted),
+            'throttled': self.throttled,
+        }
+
+
+class Slot(object):
+    """一个并发名额，请求结束之后需要标记它是否被限流"""
+
+    def __init__(self):
+        self.throttled = False
+
+
+class Scheduler(_SchedulerState):
+    """线程版本
+
+    >>> scheduler = Scheduler()
+    >>> with scheduler.slot('songservice') as slot:
+    ...     pass  # 发送请求，被限流时设置 slot.throttled = True
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+
+    def acquire(self, family, priority=None):
+        if priority is None:
+            priority = current_priority()
+        with self._cond:
+            waiter = self._enqueue(priority, family)
+            try:
+                while True:
+                    wait = self._try_grant(waiter)
+                    if wait == 0:
+                        # 排在后面的请求可能也可以发出了
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(wait)
+            except BaseException:
+                self._dequeue(waiter)
+                self._cond.notify_all()
+                raise
+
+    def release(self, throttled=False):
+        with self._cond:
+            self._release(throttled)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, family, priority=None):
+        self.acquire(family, priority)
+        slot = Slot()
+        try:
+            yield slot
+        finally:
+            self.release(slot.throttled)
+
+    def stats(self):
+        with self._cond:
+            return super().stats()
+
+
+class AsyncScheduler(_SchedulerState):
+    """asyncio 版本"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = None
+
+    @property
+    def cond(self):
+        # 和 AsyncAPI.token_lock 一样，需要在事件循环中创建
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, family, priority=None):
+        if priority is None:
+            priority = current_priority()
+        async with self.cond:
+            waiter = self._enqueue(priority, family)
+            try:
+                while True:
+                    wait = self._try_grant(waiter)
+                    if wait == 0:
+                        self.cond.notify_all()
+                        return
+                    try:
+                        await asyncio.wait_for(self.cond.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._dequeue(waiter)
+                self.cond.notify_all()
+                raise
+
+    async def release(self, throttled=False):
+        async with self.cond:
+            self._release(throttled)
+            self.cond.notify_all()
+
+    def slot(self, family, priority=None):
+        """``async with scheduler.slot(family) as slot``"""
+        return _AsyncSlot(self, family, priority)
+
+
+class _AsyncSlot(Slot):
+    # contextlib.asynccontextmanager 需要 Python 3.7
+
+    def __init__(self, scheduler, family, priority):
+        super().__init__()
+        self._scheduler = scheduler
+        self._family = family
+        self._priority = priority
+
+    async def __aenter__(self):
+        await self._scheduler.acquire(self._family, self._priority)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._scheduler.release(self.throttled)
@@ -24,7 +24,7 @@ class ArtistSchema(Schema):
 
     @post_load
     def create_model(self, data, **kwargs):
-        return XArtistModel(**data)
+        return identity_map.get_or_create(XArtistModel, **data)
 
 
 class ListenFileSchema(Schema):
@@ -100,7 +100,7 @@ class AlbumSchema(Schema):
 
     @post_load
     def create_model(self, data, **kwargs):
-        return XAlbumModel(**data)
+        return identity_map.get_or_create(XAlbumModel, **data)
 
 
 class MvSchema(Schema):
@@ -114,7 +114,7 @@ class MvSchema(Schema):
 
     @post_load
     def create_model(self, data, **kwargs):
-        return XMvModel(**data)
+        return identity_map.get_or_create(XMvModel, **data)
 
 
 class SongSchema(Schema):
@@ -152,9 +152,10 @@ class SongSchema(Schema):
 
     @post_load
     def create_model(self, data, **kwargs):
-        album = XAlbumModel(identifier=data['album_id'],
-                            name=data['album_name'],
-                            cover=data['album_cover'])
+        album = identity_map.get_or_create(XAlbumModel,
+                                           identifier=data['album_id'],
+                                           name=data['album_name'],
+                                           cover=data['album_cover'])
         files = data['files']
         if files:
             url = files[0]['url']
@@ -162,15 +163,16 @@ class SongSchema(Schema):
             url = ''
         q_media_mapping = ListenFileSchema.to_q_media_mapping(files)
         expire = int(time.time()) + 60 * 60
-        song = XSongModel(identifier=data['identifier'],
-                          mvid=data['mvid'],
-                          title=data['title'],
-                          url=url,
-                          duration=int(data['duration']),
-                          album=album,
-                          artists=data['artists'],
-                          q_media_mapping=q_media_mapping,
-                          expired_at=expire,)
+        song = identity_map.get_or_create(XSongModel,
+                                          identifier=data['identifier'],
+                                          mvid=data['mvid'],
+                                          title=data['title'],
+                                          url=url,
+                                          duration=int(data['duration']),
+                                          album=album,
+                                          artists=data['artists'],
+                                          q_media_mapping=q_media_mapping,
+                                          expired_at=expire,)
         return song
 
 
@@ -217,7 +219,7 @@ class PlaylistSchema(Schema):
 
     @post_load
     def create_model(self, data, **kwargs):
-        return XPlaylistModel(**data)
+        return identity_map.get_or_create(XPlaylistModel, **data)
 
 
 class SearchSchema(Schema):
@@ -249,6 +251,7 @@ class UserSchema(Schema):
 
 
 from .models import (  # noqa
+    identity_map,
     XAlbumModel,
     XArtistModel,
     XMvModel,
@@ -0,0 +1,196 @@
+"""
+搜索
+~~~~
+
+虾米的搜索接口每次只能搜索一种类型（歌曲、专辑、歌手、歌单），界面
+依次搜索这几种类型，并且用户每输入一个字符都要重新搜索一遍。
+
+SearchEngine 并发搜索多种类型，把结果合并成一个 ``data.data``；
+结果按规范化之后的关键词缓存一段时间，边输入边搜索时，可以先展示
+最长的已缓存前缀的结果（``peek``）；关键词变化之后，旧关键词还在
+排队的请求会被取消，正在等待它们的调用会抛出 SearchCancelled。
+"""
+
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .excs import SearchCancelled
+from .scheduler import current_priority, run_with_priority
+
+logger = logging.getLogger(__name__)
+
+#: API.search 的 type_ -> 结果中的列表字段
+SEARCH_FIELDS = {
+    1: 'songs',
+    10: 'albums',
+    100: 'artists',
+    1000: 'collects',
+}
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(keyword):
+    """规范化关键词：全角转半角、合并空白、忽略大小写
+
+    >>> normalize('  Jay　Chou ')
+    'jay chou'
+    """
+    keyword = unicodedata.normalize('NFKC', keyword)
+    return _WHITESPACE.sub(' ', keyword).strip().casefold()
+
+
+def merge_results(results):
+    """把各个类型的搜索结果合并成一个 ``data.data``
+
+    :param results: ``[(type_, data)]``，data 为 API.search 的返回值
+    """
+    merged = {}
+    for type_, data in results:
+        field = SEARCH_FIELDS[type_]
+        merged[field] = (data or {}).get(field) or []
+    return merged
+
+
+class SearchEngine(object):
+    """
+    :param api: fuo_xiami.api.API
+    :param ttl: 搜索结果缓存的时间（秒）
+    :param max_entries: 最多缓存的 (关键词, 类型) 数量
+    :param workers: 并发请求数
+    """
+
+    def __init__(self, api, ttl=5 * 60, max_entries=256, workers=4, limit=30):
+        self.api = api
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.limit = limit
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='xiami-search')
+        self._lock = threading.Lock()
+        #: (关键词, type_) -> (过期时间, data)
+        self._cache = OrderedDict()
+        #: (关键词, type_) -> [Future, 是否可以取消]，相同的请求只发送一次
+        self._inflight = {}
+        #: search_as_you_type 最近一次的关键词
+        self._latest = None
+
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+
+    def search(self, keyword, types=tuple(SEARCH_FIELDS)):
+        """并发搜索 types 中的所有类型，返回合并之后的 ``data.data``
+
+        某个类型搜索失败时，结果中没有这个类型；所有类型都失败时抛出异常。
+        """
+        return self._search(keyword, types, cancellable=False)
+
+    def search_as_you_type(self, keyword, types=tuple(SEARCH_FIELDS)):
+        """和 search 一样，但是关键词变化之后（再次调用本方法），
+        旧关键词的调用会抛出 SearchCancelled
+        """
+        return self._search(keyword, types, cancellable=True)
+
+    def peek(self, keyword, types=tuple(SEARCH_FIELDS)):
+        """不发送请求，返回 keyword 或者它最长的前缀的缓存结果
+
+        返回 ``(matched_keyword, data)``，都没有缓存时返回 ``(None, None)``。
+        """
+        key = normalize(keyword)
+        now = time.time()
+        with self._lock:
+            for end in range(len(key), 0, -1):
+                prefix = key[:end]
+                entries = [self._cache.get((prefix, type_)) for type_ in types]
+                if all(entry is not None and entry[0] > now for entry in entries):
+                    return prefix, merge_results(
+                        [(type_, entry[1]) for type_, entry in zip(types, entries)])
+        return None, None
+
+    def _search(self, keyword, types, cancellable):
+        key = normalize(keyword)
+        if cancellable:
+            with self._lock:
+                self._latest = key
+        keyword = _WHITESPACE.sub(' ', keyword).strip()
+        results = {}
+        futures = {}
+        now = time.time()
+        priority = current_priority()
+        with self._lock:
+            for type_ in types:
+                entry = self._cache.get((key, type_))
+                if entry is not None and entry[0] > now:
+                    self._cache.move_to_end((key, type_))
+                    self.hits += 1
+                    results[type_] = entry[1]
+                    continue
+                self.misses += 1
+                inflight = self._inflight.get((key, type_))
+                if inflight is None:
+                    future = self._executor.submit(
+                        run_with_priority, priority,
+                        self._fetch, key, keyword, type_)
+                    inflight = self._inflight[(key, type_)] = [future, cancellable]
+                # 普通的 search 也在等待这个请求时，不能取消它
+                inflight[1] = inflight[1] and cancellable
+                futures[inflight[0]] = type_
+
+        pending = set(futures)
+        errors = []
+        while pending:
+            done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+            if cancellable and self._latest != key:
+                self._cancel_stale()
+                raise SearchCancelled('search for {!r} is outdated'.format(keyword))
+            for future in done:
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:  # noqa
+                    logger.warning('search {!r} type {} failed: {}'.format(
+                        keyword, futures[future], e))
+                    errors.append(e)
+        if errors and not results:
+            raise errors[0]
+        return merge_results([(type_, results[type_])
+                              for type_ in types if type_ in results])
+
+    def _fetch(self, key, keyword, type_):
+        try:
+            data = self.api.search(keyword, type_=type_, limit=self.limit)
+            with self._lock:
+                self._cache[(key, type_)] = (time.time() + self.ttl, data)
+                self._cache.move_to_end((key, type_))
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            return data
+        finally:
+            with self._lock:
+                self._inflight.pop((key, type_), None)
+
+    def _cancel_stale(self):
+        """取消还在排队的、不是最新关键词的请求"""
+        with self._lock:
+            stale = [(k, future) for k, (future, cancellable) in self._inflight.items()
+                     if cancellable and k[0] != self._latest]
+            for k, future in stale:
+                if future.cancel():
+                    self._inflight.pop(k, None)
+                    self.cancelled += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'cancelled': self.cancelled, 'entries': len(self._cache)}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
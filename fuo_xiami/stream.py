@@ -0,0 +1,188 @@
+"""
+流式解析列表接口的响应
+~~~~~~~~~~~~~~~~~~~~~~
+
+歌单、收藏、搜索等接口一次返回上百个完整的歌曲对象，``response.json()``
+需要等整个响应下载完才能开始解析，并且要把整个响应都放在内存中。
+
+ListResponseStream 边下载边解析，``data.data`` 中的列表字段（songs、albums、
+artists、collects）的元素每解析完一个就交给调用方，其它字段保存在
+``stream.data`` 中。这里只需要处理 mtop 响应的外层结构，列表中的每个元素
+仍然交给标准库的 json 解析，所以不需要额外的依赖。
+
+mtop 响应中 ``ret`` 字段一般在 ``data`` 之后，所以只有解析完整个响应才知道
+请求是否成功。请求失败时（比如 token 过期、被限流），列表字段一般为空，
+这时会调用 fallback 走普通的请求流程（重试、刷新 token 等）。
+"""
+
+import codecs
+import json
+import re
+
+#: 需要流式解析的列表字段
+LIST_FIELDS = ('songs', 'albums', 'artists', 'collects')
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = re.compile(r'[-+0-9.eE]*')
+_decoder = json.JSONDecoder()
+
+
+class _Reader(object):
+    """从 chunk 迭代器中按需读取 JSON 值"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            raise ValueError('unexpected end of JSON document')
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self._text_decoder.decode(b'', final=True)
+        elif isinstance(chunk, bytes):
+            text = self._text_decoder.decode(chunk)
+        else:
+            text = chunk
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+
+    def peek(self):
+        """跳过空白字符，返回下一个字符"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self._fill()
+
+    def next_char(self):
+        c = self.peek()
+        self.pos += 1
+        return c
+
+    def expect(self, expected):
+        c = self.next_char()
+        if c != expected:
+            raise ValueError('expect {!r}, got {!r} at {}'.format(
+                expected, c, self.pos))
+
+    def value(self):
+        """读取一个完整的 JSON 值"""
+        if self.peek() in '-0123456789':
+            # 数字可能被 chunk 截断（比如 "3." | "14"），截断处之前的部分
+            # 也能被解析，所以要读到数字之后的字符才能确定数字是完整的
+            while not self.eof and \
+                    _NUMBER.match(self.buf, self.pos).end() == len(self.buf):
+                self._fill()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            self.pos = end
+            return obj
+
+    def keys(self):
+        """遍历对象的 key（'{' 已经被读取），调用方负责读取对应的值"""
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            c = self.next_char()
+            if c == '}':
+                return
+            if c != ',':
+                raise ValueError('expect , or }}, got {!r}'.format(c))
+
+
+class ListResponseStream(object):
+    """遍历时返回 ``(field, item)``
+
+    >>> stream = ListResponseStream([b'{"data": {"data": {"songs": [1, 2]}}, ',
+    ...                              b'"ret": ["SUCCESS::ok"]}'])
+    >>> list(stream)
+    [('songs', 1), ('songs', 2)]
+    >>> stream.code
+    'SUCCESS'
+
+    :param chunks: 响应内容的迭代器（bytes 或 str），也可以是一个返回
+        迭代器的函数，这样只有开始遍历时才会发送请求
+    :param fallback: 请求失败并且没有返回任何条目时调用，
+        返回完整的 ``data.data``（或者 None）
+    """
+
+    def __init__(self, chunks, fallback=None, list_fields=LIST_FIELDS):
+        self._chunks = chunks
+        self._fallback = fallback
+        self.list_fields = list_fields
+        #: ``data.data`` 中除列表字段之外的字段，随着解析逐渐填充
+        self.data = {}
+        self.ret = None
+        self.count = 0
+
+    @property
+    def code(self):
+        if not self.ret:
+            return None
+        return self.ret[0].partition('::')[0]
+
+    def __iter__(self):
+        chunks = self._chunks() if callable(self._chunks) else self._chunks
+        for field, item in self._parse(_Reader(chunks)):
+            self.count += 1
+            yield field, item
+        if self.code != 'SUCCESS' and self.count == 0 and \
+           self._fallback is not None:
+            yield from self._iter_fallback()
+
+    def _iter_fallback(self):
+        data = self._fallback() or {}
+        lists = {field: data.get(field) or [] for field in self.list_fields}
+        self.data.update({k: v for k, v in data.items() if k not in lists})
+        for field, items in lists.items():
+            for item in items:
+                self.count += 1
+                yield field, item
+
+    def _parse(self, reader):
+        reader.expect('{')
+        for key in reader.keys():
+            if key == 'data' and reader.peek() == '{':
+                reader.pos += 1
+                for data_key in reader.keys():
+                    if data_key == 'data' and reader.peek() == '{':
+                        reader.pos += 1
+                        yield from self._parse_data(reader)
+                    else:
+                        reader.value()
+            elif key == 'ret':
+                self.ret = reader.value()
+            else:
+                reader.value()
+
+    def _parse_data(self, reader):
+        for key in reader.keys():
+            if key not in self.list_fields or reader.peek() != '[':
+                self.data[key] = reader.value()
+                continue
+            reader.pos += 1
+            if reader.peek() == ']':
+                reader.pos += 1
+                continue
+            while True:
+                yield key, reader.value()
+                c = reader.next_char()
+                if c == ']':
+                    break
+                if c != ',':
+                    raise ValueError('expect , or ], got {!r}'.format(c))
@@ -0,0 +1,205 @@
+"""
+紧凑的歌曲表
+~~~~~~~~~~~~
+
+用户收藏的歌曲可能有上万首，每首歌曲都是一个完整的 XSongModel，还带着
+专辑、歌手列表以及多个 Media 组成的 q_media_mapping，非常占内存。
+
+SongTable 按列存储歌曲：id、时长保存在 array 中，标题等字符串经过 intern，
+专辑和歌手各自只保存一份，歌曲通过下标引用它们。通过下标或者遍历得到的是
+轻量的 SongRow，只有调用 ``row.model()`` 时才会构造完整的 XSongModel。
+播放链接不会被保存（它一个小时之后就会过期），model 需要时会自己获取。
+"""
+
+import sys
+from array import array
+
+from .loaders import _int, _str, _get
+
+
+class SongRow(object):
+    """SongTable 中的一行，属性和 XSongModel 的展示字段一致"""
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    @property
+    def identifier(self):
+        return self._table._ids[self._index]
+
+    @property
+    def title(self):
+        return self._table._titles[self._index]
+
+    @property
+    def duration(self):
+        return self._table._durations[self._index]
+
+    @property
+    def mvid(self):
+        return self._table._mvids[self._index]
+
+    @property
+    def album_id(self):
+        return self._table._album(self._index)[0]
+
+    @property
+    def album_name(self):
+        return self._table._album(self._index)[1]
+
+    @property
+    def artists(self):
+        """[(artist_id, artist_name), ...]"""
+        return self._table._artists_of(self._index)
+
+    @property
+    def artists_name(self):
+        # 和 SongModel.artists_name 一致：[a, b, c] -> 'a, b & c'
+        artists_name = ', '.join(name for _, name in self.artists)
+        return ' & '.join(artists_name.rsplit(', ', 1))
+
+    @property
+    def duration_ms(self):
+        seconds = self.duration / 1000
+        return '{:02}:{:02}'.format(int(seconds / 60), int(seconds % 60))
+
+    def model(self):
+        """构造（或者从 IdentityMap 中取出）完整的 XSongModel"""
+        return self._table.model(self._index)
+
+    def __eq__(self, other):
+        return isinstance(other, SongRow) and other.identifier == self.identifier
+
+    def __hash__(self):
+        return hash(self.identifier)
+
+    def __repr__(self):
+        return '<SongRow {} {}>'.format(self.identifier, self.title)
+
+
+class SongTable(object):
+    """按列存储的歌曲表
+
+    >>> table = SongTable()
+    >>> row = table.append({'songId': '1', 'songName': 'a', 'mvId': '',
+    ...                     'albumId': '2', 'albumName': 'b', 'albumLogo': '',
+    ...                     'singerVOs': [{'artistId': '3', 'artistName': 'c'}]})
+    >>> row.title, row.album_name, row.artists_name
+    ('a', 'b', 'c')
+    """
+
+    def __init__(self):
+        self._ids = array('q')
+        self._durations = array('q')
+        self._titles = []
+        self._mvids = []
+        #: 歌曲 -> 专辑在 _albums 中的下标
+        self._album_indexes = array('l')
+        self._albums = []  # [(id, name, cover)]
+        self._album_index_map = {}
+        #: 第 i 首歌曲的歌手为 _artist_indexes[_artist_offsets[i]:_artist_offsets[i+1]]
+        self._artist_offsets = array('l', [0])
+        self._artist_indexes = array('l')
+        self._artists = []  # [(id, name)]
+        self._artist_index_map = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [SongRow(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('song table index out of range')
+        return SongRow(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield SongRow(self, i)
+
+    def index_of(self, identifier):
+        """返回歌曲所在的行，不存在时抛出 ValueError"""
+        return self._ids.index(identifier)
+
+    def append(self, data):
+        """添加一首歌曲，data 的格式和 NestedSongSchema 一致，返回 SongRow
+
+        和 loaders 一样，字段不合法时抛出 marshmallow.ValidationError。
+        """
+        identifier = _int(data, 'songId', required=True)
+        title = _str(data, 'songName', required=True)
+        mvid = _str(data, 'mvId', required=True)
+        duration = int(_str(data, 'length', default='0'))
+        album_index = self._add_album(_int(data, 'albumId', required=True),
+                                      _str(data, 'albumName', required=True),
+                                      _str(data, 'albumLogo', required=True))
+        artist_indexes = [
+            self._add_artist(_int(artist, 'artistId', required=True),
+                             _str(artist, 'artistName', required=True))
+            for artist in _get(data, 'singerVOs', required=True)]
+
+        self._ids.append(identifier)
+        self._titles.append(sys.intern(title))
+        self._mvids.append(sys.intern(mvid))
+        self._durations.append(duration)
+        self._album_indexes.append(album_index)
+        self._artist_indexes.extend(artist_indexes)
+        self._artist_offsets.append(len(self._artist_indexes))
+        return SongRow(self, len(self._ids) - 1)
+
+    def extend(self, items):
+        for data in items:
+            self.append(data)
+
+    def _add_album(self, identifier, name, cover):
+        index = self._album_index_map.get(identifier)
+        if index is None:
+            index = self._album_index_map[identifier] = len(self._albums)
+            self._albums.append((identifier, sys.intern(name), cover))
+        return index
+
+    def _add_artist(self, identifier, name):
+        index = self._artist_index_map.get(identifier)
+        if index is None:
+            index = self._artist_index_map[identifier] = len(self._artists)
+            self._artists.append((identifier, sys.intern(name)))
+        return index
+
+    def _album(self, index):
+        return self._albums[self._album_indexes[index]]
+
+    def _artists_of(self, index):
+        start, end = self._artist_offsets[index], self._artist_offsets[index + 1]
+        return [self._artists[i] for i in self._artist_indexes[start:end]]
+
+    def model(self, index):
+        """构造第 index 首歌曲的 XSongModel
+
+        q_media_mapping 和 url 为空，需要时 model 会自己获取。
+        """
+        album_id, album_name, album_cover = self._album(index)
+        album = identity_map.get_or_create(XAlbumModel, identifier=album_id,
+                                           name=album_name, cover=album_cover)
+        artists = [identity_map.get_or_create(XArtistModel, identifier=artist_id,
+                                              name=name)
+                   for artist_id, name in self._artists_of(index)]
+        return identity_map.get_or_create(XSongModel,
+                                          identifier=self._ids[index],
+                                          title=self._titles[index],
+                                          mvid=self._mvids[index],
+                                          duration=self._durations[index],
+                                          album=album,
+                                          artists=artists)
+
+
+from .models import (  # noqa
+    identity_map,
+    XAlbumModel,
+    XArtistModel,
+    XSongModel,
+)
@@ -0,0 +1,103 @@
+"""
+界面任务
+~~~~~~~~
+
+GUI 的回调运行在 Qt 主线程中，在回调里直接请求网络会让整个窗口卡住。
+
+TaskRunner 在线程池中执行耗时的函数，再通过 deliver 把结果交回主线程
+（GUI 中 deliver 是一个 Qt 信号的 emit，参考 ui.Dispatcher）。每个任务都有
+一个 key，比如歌曲表格、左侧歌单列表；同一个 key 提交新任务时，上一个任务
+如果还在排队就直接取消，已经在执行的话，它的结果会被丢弃。
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .scheduler import run_with_priority, INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+
+def _call(callback, *args):
+    callback(*args)
+
+
+class TaskRunner(object):
+    """
+    :param deliver: ``deliver(callback, *args)``，在主线程中调用 callback。
+        默认在工作线程中直接调用，只适合测试和非 GUI 的场景。
+    :param workers: 工作线程数
+    """
+
+    def __init__(self, deliver=None, workers=4):
+        self._deliver = deliver or _call
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='xiami-ui')
+        self._lock = threading.Lock()
+        #: key -> (任务编号, Future)
+        self._tasks = {}
+        self._seq = 0
+
+    def submit(self, key, func, callback, *args, on_error=None,
+               priority=INTERACTIVE):
+        """在工作线程中调用 ``func(*args)``，然后在主线程中调用 ``callback(result)``
+
+        func 抛出异常时，在主线程中调用 ``on_error(exc)``，没有 on_error 时只记录日志。
+        """
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            previous = self._tasks.get(key)
+            if previous is not None:
+                previous[1].cancel()
+            future = self._executor.submit(run_with_priority, priority,
+                                           self._run, key, seq, func, args,
+                                           callback, on_error)
+            self._tasks[key] = (seq, future)
+        return future
+
+    def deliver(self, callback, *args):
+        """在主线程中调用 ``callback(*args)``，可以在任何线程中使用"""
+        self._deliver(callback, *args)
+
+    def cancel(self, key):
+        with self._lock:
+            task = self._tasks.pop(key, None)
+        if task is not None:
+            task[1].cancel()
+
+    def is_current(self, key, seq):
+        with self._lock:
+            task = self._tasks.get(key)
+            return task is not None and task[0] == seq
+
+    def _run(self, key, seq, func, args, callback, on_error):
+        if not self.is_current(key, seq):
+            return
+        try:
+            result = func(*args)
+        except Exception as e:  # noqa
+            logger.exception('task {} failed'.format(key))
+            if on_error is not None:
+                self._deliver(self._finish, key, seq, on_error, e)
+            return
+        self._deliver(self._finish, key, seq, callback, result)
+        return result
+
+    def _finish(self, key, seq, callback, result):
+        # 结果在信号队列中等待时，可能又提交了新的任务
+        if not self.is_current(key, seq):
+            logger.debug('drop outdated result of task {}'.format(key))
+            return
+        with self._lock:
+            if self._tasks.get(key, (None,))[0] == seq:
+                del self._tasks[key]
+        callback(result)
+
+    def shutdown(self):
+        with self._lock:
+            for _, future in self._tasks.values():
+                future.cancel()
+            self._tasks.clear()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,218 @@
+"""
+HTTP 传输层
+~~~~~~~~~~~
+
+API 的请求分布在两个 host 上：BASE_URL_H5（http）和 BASE_URL_ACS（https，
+搜索接口）。requests.Session 默认的连接池每个 host 只保留 10 个连接，
+并发请求多时，多出来的连接用完就被丢弃，下次又要重新建立连接（和 TLS 握手）。
+
+这里提供两种可以通过 API.set_http 使用的 session：
+
+- PooledSession：HTTP/1.1，连接池大小和并发数匹配，可以预先建立连接；
+- HTTP2Session：基于 httpx 的 HTTP/2，多个请求复用同一个连接。
+  httpx 是可选依赖：``pip install fuo_xiami[http2]``。
+
+两者都提供 ``stats()``，返回每个 host 的请求数、新建连接数和连接复用率。
+"""
+
+import logging
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+#: 默认的连接池大小，需要不小于 Scheduler 的最大并发数
+DEFAULT_POOL_MAXSIZE = 16
+
+
+def _host_stats(requests_count, connections, **extra):
+    reuse_rate = 1 - connections / requests_count if requests_count else 0
+    return dict(requests=requests_count,
+                connections=connections,
+                reuse_rate=max(reuse_rate, 0),
+                **extra)
+
+
+class PooledSession(requests.Session):
+    """连接池大小可以配置的 requests.Session
+
+    :param pool_maxsize: 每个 host 保留的最大连接数
+    :param pool_connections: 保留连接池的 host 数量
+    """
+
+    def __init__(self, pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_connections=4):
+        super().__init__()
+        self.pool_maxsize = pool_maxsize
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self._adapter = adapter
+
+    def warm_up(self, urls, connections=1):
+        """预先和 urls 所在的 host 建立 connections 个连接（包括 TLS 握手）
+
+        返回可以直接使用的连接数（包括连接池中原有的连接）。
+        连接失败的连接会被关闭，不会放回连接池。
+        """
+        count = 0
+        for url in urls:
+            pool = self._pool_for(url)
+            # urllib3 没有公开预先建立连接的接口，这两个方法不存在时跳过
+            get_conn = getattr(pool, '_get_conn', None)
+            put_conn = getattr(pool, '_put_conn', None)
+            if get_conn is None or put_conn is None:
+                logger.info('warm up is not supported by this urllib3 version')
+                return count
+            conns = []
+            try:
+                for _ in range(connections):
+                    conn = get_conn()
+                    if conn.sock is None:
+                        try:
+                            conn.connect()
+                        except Exception:
+                            conn.close()
+                            # 归还连接池的名额（队列中的 None）
+                            put_conn(None)
+                            raise
+                    conns.append(conn)
+                    count += 1
+            except Exception as e:  # noqa
+                logger.warning('warm up {} failed: {}'.format(url, e))
+            finally:
+                for conn in conns:
+                    put_conn(conn)
+        return count
+
+    def _pool_for(self, url):
+        # 连接池的 key 包含 TLS 相关的参数，需要和 requests 发送请求时
+        # 使用同一个连接池，否则预先建立的连接不会被用到
+        request = requests.Request('GET', url).prepare()
+        settings = self.merge_environment_settings(url, {}, None, None, None)
+        get_pool = getattr(self._adapter, 'get_connection_with_tls_context', None)
+        if get_pool is None:  # requests < 2.32
+            return self._adapter.get_connection(url, settings['proxies'])
+        return get_pool(request, settings['verify'], settings['proxies'],
+                        settings['cert'])
+
+    def stats(self):
+        """host -> 请求数、新建连接数、复用率、空闲连接数"""
+        totals = defaultdict(lambda: [0, 0, 0])
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # 同一个 host 可能有多个连接池（比如 TLS 参数不同），合并统计
+            total = totals[pool.host]
+            total[0] += pool.num_requests
+            total[1] += pool.num_connections
+            # 连接池的队列中预先填充了 None，只有非 None 的才是空闲连接
+            if pool.pool:
+                total[2] += sum(1 for conn in list(pool.pool.queue)
+                                if conn is not None)
+        return {host: _host_stats(requests_count, connections,
+                                  idle=idle, maxsize=self.pool_maxsize)
+                for host, (requests_count, connections, idle) in totals.items()}
+
+
+class _ResponseCookies(dict):
+    def get_dict(self):
+        return dict(self)
+
+
+class HTTP2Response(object):
+    """让 httpx.Response 兼容 API 用到的 requests.Response 接口"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.http_version = response.http_version
+        self.cookies = _ResponseCookies(response.cookies.items())
+
+    @property
+    def content(self):
+        return self._response.content
+
+    def json(self):
+        return self._response.json()
+
+    def iter_content(self, chunk_size=1):
+        return self._response.iter_bytes(chunk_size)
+
+    def close(self):
+        self._response.close()
+
+
+class HTTP2Session(object):
+    """基于 httpx 的 HTTP/2 session，接口兼容 API 用到的 requests.Session 部分
+
+    HTTP/2 需要通过 TLS 协商，所以 upgrade_scheme 为 True 时，
+    http:// 开头的链接会被换成 https://（虾米的 h5api 同样支持 https）。
+
+    :param max_connections: 最大连接数。使用 HTTP/2 时一个 host 一般
+        只需要一个连接。
+    """
+
+    def __init__(self, max_connections=4, upgrade_scheme=True):
+        import httpx
+
+        self._httpx = httpx
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections))
+        self.headers = self._client.headers
+        self.cookies = self._client.cookies
+        self.upgrade_scheme = upgrade_scheme
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)
+        self._connections = defaultdict(int)
+        self._http_versions = defaultdict(int)
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        """stream 参数只是为了兼容，响应内容总是会被完整读取"""
+        if self.upgrade_scheme and url.startswith('http://'):
+            url = 'https://' + url[len('http://'):]
+        host = urlsplit(url).hostname
+
+        def trace(event_name, info):
+            # 新建连接时 httpcore 会发出 connect_tcp 事件
+            if event_name == 'connection.connect_tcp.complete':
+                with self._lock:
+                    self._connections[host] += 1
+
+        try:
+            response = self._client.get(url, params=params, timeout=timeout,
+                                        extensions={'trace': trace})
+        except self._httpx.TimeoutException as e:
+            # 调用方只处理 requests 的异常
+            raise requests.Timeout(e) from e
+        except self._httpx.TransportError as e:
+            raise requests.ConnectionError(e) from e
+        with self._lock:
+            self._requests[host] += 1
+            self._http_versions[response.http_version] += 1
+        return HTTP2Response(response)
+
+    def stats(self):
+        with self._lock:
+            rv = {host: _host_stats(count, self._connections[host])
+                  for host, count in self._requests.items()}
+            rv['http_versions'] = dict(self._http_versions)
+        return rv
+
+    def close(self):
+        self._client.close()
+
+
+def create_session(http2=False, **kwargs):
+    """创建一个 session，参数会传给 PooledSession 或 HTTP2Session"""
+    if http2:
+        return HTTP2Session(**kwargs)
+    return PooledSession(**kwargs)
@@ -1,7 +1,7 @@
 import hashlib
 import logging
 
-from PyQt5.QtCore import pyqtSignal, Qt
+from PyQt5.QtCore import pyqtSignal, QObject, Qt
 from PyQt5.QtWidgets import (
     QFormLayout,
     QLineEdit,
@@ -77,3 +77,19 @@ class LoginDialog(QDialog):
                 user = _deserialize(data, UserSchema)
                 self.login_success.emit(user)
                 self.close()
+
+
+class Dispatcher(QObject):
+    """把工作线程中的回调转发到 Qt 主线程执行，参考 tasks.TaskRunner"""
+
+    called = pyqtSignal([object, object])
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.called.connect(self._on_called, Qt.QueuedConnection)
+
+    def dispatch(self, callback, *args):
+        self.called.emit(callback, args)
+
+    def _on_called(self, callback, args):
+        callback(*args)
@@ -29,6 +29,12 @@ setup(
         'marshmallow>=3.0',
         'requests',
     ],
+    extras_require={
+        'aio': ['aiohttp'],
+        'http2': ['httpx[http2]'],
+        'speedups': ['orjson'],
+        'pinyin': ['pypinyin'],
+    },
     entry_points={
         'fuo.plugins_v1': [
             'xiami = fuo_xiami',
@@ -0,0 +1,133 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+from fuo_xiami import aioapi
+from fuo_xiami.aioapi import AsyncAPI
+from fuo_xiami.api import API, BASE_URL_ACS
+from fuo_xiami.models import XSongModel
+
+
+with open('data/fixtures/song.json') as f:
+    data_song = json.load(f)
+
+
+class FakeMorsel:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeResponse:
+    def __init__(self, rv, cookies=None):
+        self._rv = rv
+        self.cookies = {k: FakeMorsel(v) for k, v in (cookies or {}).items()}
+
+    async def json(self, content_type=None, loads=json.loads):
+        return self._rv
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession:
+    """按顺序返回预设的响应，并记录请求"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append((url, params))
+        self.timeout = timeout
+        return self.responses.pop(0)
+
+
+def _wrap(data, ret='SUCCESS::调用成功'):
+    return {'ret': [ret], 'data': {'data': data}}
+
+
+def test_request_fetch_token_first():
+    api = AsyncAPI()
+    http = FakeSession([
+        FakeResponse({}, cookies={'_m_h5_tk': 'abc_1580000000000'}),
+        FakeResponse(_wrap({'songDetail': data_song})),
+    ])
+    api.set_http(http)
+    song_data = asyncio.run(api.song_detail(1))
+    assert song_data['songId'] == data_song['songId']
+    assert api._req_token == 'abc'
+    assert len(http.calls) == 2
+
+
+def test_request_retry_on_token_expired():
+    api = AsyncAPI()
+    api._req_token = 'old'
+    http = FakeSession([
+        FakeResponse(_wrap({}, ret='FAIL_SYS_TOKEN_EXOIRED::令牌过期')),
+        FakeResponse({}, cookies={'_m_h5_tk': 'new_1580000000000'}),
+        FakeResponse(_wrap({'songDetail': data_song})),
+    ])
+    api.set_http(http)
+    song_data = asyncio.run(api.song_detail(1))
+    assert song_data is not None
+    assert api._req_token == 'new'
+
+
+def test_song_model_aget():
+    async def song_detail(self, song_id):
+        return data_song
+
+    with patch.object(AsyncAPI, 'song_detail', song_detail):
+        song = asyncio.run(XSongModel.aget(11))
+    assert song.identifier == 1801370698
+
+
+def test_client_timeout():
+    class ClientTimeout:
+        def __init__(self, total):
+            self.total = total
+
+    api = AsyncAPI()
+    api._req_token = 'token'
+    http = FakeSession([FakeResponse(_wrap({'songDetail': data_song}))])
+    api.set_http(http)
+    with patch.object(aioapi, '_ClientTimeout', ClientTimeout):
+        asyncio.run(api.song_detail(1))
+    assert isinstance(http.timeout, ClientTimeout)
+    assert http.timeout.total == 3
+
+
+def test_same_requests_as_api():
+    calls = []
+
+    def request(self, action, payload, base_url=None):
+        calls.append((action, payload, base_url))
+        return 'SUCCESS', '', _wrap({'songs': []})
+
+    async def arequest(self, action, payload, base_url=None):
+        return request(self, action, payload, base_url)
+
+    with patch.object(API, 'request', request), \
+            patch.object(AsyncAPI, 'request', arequest):
+        assert API().search('x', page=2) == {'songs': []}
+        assert asyncio.run(AsyncAPI().search('x', page=2)) == {'songs': []}
+        API().artist_songs(1, page=3)
+        asyncio.run(AsyncAPI().artist_songs(1, page=3))
+    assert calls[0] == calls[1]
+    assert calls[0][2] == BASE_URL_ACS
+    assert calls[2] == calls[3]
+
+
+def test_no_sync_only_methods():
+    api = AsyncAPI()
+    assert not isinstance(api, API)
+    for name in ('iter_songs_detail', 'request_stream', 'warm_up', 'set_token_file',
+                 '_refresh_token', 'transport_stats'):
+        assert not hasattr(api, name), name
+    # 共用的部分
+    api.set_access_token('token')
+    assert api._request_key('a', {}, None) == API()._request_key('a', {}, None)[:3] \
+        + ('token', )
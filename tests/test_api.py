@@ -0,0 +1,147 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fuo_xiami.api import API
+
+
+class FakeResponse:
+    def __init__(self, rv):
+        self._rv = rv
+
+    def json(self):
+        return self._rv
+
+
+class FakeSession:
+    """根据请求的 songIds 返回歌曲，可以指定哪些歌曲、哪些批次会丢失"""
+
+    def __init__(self, dropped_ids=(), failed_chunk_first_id=None):
+        self.headers = {}
+        self.dropped_ids = set(dropped_ids)
+        self.failed_chunk_first_id = failed_chunk_first_id
+
+    def get(self, url, params=None, timeout=None):
+        request_str = json.loads(json.loads(params['data'])['requestStr'])
+        song_ids = request_str['model']['songIds']
+        if song_ids[0] == self.failed_chunk_first_id:
+            return FakeResponse({'ret': ['FAIL_BIZ_SONG_NOT_EXIST::歌曲不存在'],
+                                 'data': {}})
+        # 服务端返回的顺序和请求的顺序不一定一致
+        songs = [{'songId': str(song_id)} for song_id in reversed(song_ids)
+                 if song_id not in self.dropped_ids]
+        return FakeResponse({'ret': ['SUCCESS::调用成功'],
+                             'data': {'data': {'songs': songs}}})
+
+
+def _create_api(http):
+    api = API()
+    api._req_token = 'token'
+    api.set_http(http)
+    return api
+
+
+def test_songs_detail_keeps_order():
+    api = _create_api(FakeSession())
+    song_ids = list(range(1, 1001))
+    songs = api.songs_detail(song_ids, workers=3)
+    assert [int(song['songId']) for song in songs] == song_ids
+
+
+def test_songs_detail_reports_missing_per_chunk():
+    api = _create_api(FakeSession(dropped_ids={5, 250}, failed_chunk_first_id=401))
+    missing = {}
+
+    def on_missing(i, ids):
+        missing[i] = ids
+
+    song_ids = list(range(1, 501))
+    songs = api.songs_detail(song_ids, on_missing=on_missing)
+    assert missing == {0: [5], 1: [250], 2: list(range(401, 501))}
+    assert len(songs) == 500 - 2 - 100
+
+
+class TokenSession:
+    """模拟获取 token 的请求以及 token 过期的情况"""
+
+    def __init__(self, valid_token='new'):
+        self.headers = {}
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.valid_token = valid_token
+        self.token_requests = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        request_str = json.loads(json.loads(params['data'])['requestStr'])
+        if request_str['model'] == {'songId': '1'}:
+            with self.lock:
+                self.token_requests += 1
+            time.sleep(0.05)
+            return TokenResponse({'_m_h5_tk': self.valid_token + '_1580000000000',
+                                  '_m_h5_tk_enc': 'enc'})
+        if not self._signed_with_valid_token(params):
+            return FakeResponse({'ret': ['FAIL_SYS_TOKEN_EXOIRED::令牌过期'],
+                                 'data': {}})
+        return FakeResponse({'ret': ['SUCCESS::调用成功'],
+                             'data': {'data': {'albumDetail': {'albumId': '1'}}}})
+
+    def _signed_with_valid_token(self, params):
+        data_str = '{}&{}&{}&{}'.format(self.valid_token, params['t'],
+                                        params['appKey'], params['data'])
+        return hashlib.md5(data_str.encode('utf-8')).hexdigest() == params['sign']
+
+
+class TokenResponse(FakeResponse):
+    def __init__(self, cookies):
+        super().__init__(None)
+        self.cookies = requests.cookies.cookiejar_from_dict(cookies)
+
+
+def test_concurrent_token_expiration_fetches_once():
+    http = TokenSession()
+    api = _create_api(http)
+    api._req_token = 'old'
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(api.album_detail, range(8)))
+    assert all(result == {'albumId': '1'} for result in results)
+    assert http.token_requests == 1
+    assert api._req_token == 'new'
+
+
+def test_token_is_persisted(tmp_path):
+    token_file = str(tmp_path / 'token.json')
+    api = API()
+    api.set_http(TokenSession())
+    api.set_token_file(token_file, auto_refresh=False)
+    api.album_detail(1)
+    assert api.http.token_requests == 1
+
+    api2 = API()
+    http2 = TokenSession()
+    api2.set_http(http2)
+    api2.set_token_file(token_file, auto_refresh=False)
+    assert api2._req_token == 'new'
+    assert http2.cookies.get('_m_h5_tk_enc') == 'enc'
+    api2.album_detail(1)
+    assert http2.token_requests == 0
+
+
+def test_identical_requests_are_coalesced():
+    class SlowSession(FakeSession):
+        count = 0
+
+        def get(self, url, params=None, timeout=None):
+            SlowSession.count += 1
+            time.sleep(0.05)
+            return FakeResponse({'ret': ['SUCCESS::调用成功'],
+                                 'data': {'data': {'albumDetail': {}}}})
+
+    api = _create_api(SlowSession())
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: api.album_detail(1), range(4)))
+    assert SlowSession.count == 1
+    assert api.coalesced_requests == 3
@@ -0,0 +1,179 @@
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import patch
+
+import pytest
+import requests
+from fuocore.media import Media
+
+from fuo_xiami.audio import (
+    fetch_head,
+    parse_range,
+    AudioPrefetcher,
+    Head,
+    HeadCache,
+    HeadProxy,
+)
+from fuo_xiami.models import XSongModel
+from fuo_xiami.provider import provider
+
+
+AUDIO = bytes(range(256)) * 1000
+
+
+class _CDNHandler(BaseHTTPRequestHandler):
+    """模拟虾米的 CDN，/norange 不支持 Range 请求"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get('Range'))
+        if self.path == '/error':
+            self.send_error(500)
+            return
+        # /changed 模拟链接刷新之后文件被重新编码
+        audio = AUDIO[:-100] if self.path == '/changed' else AUDIO
+        range_ = parse_range(self.headers.get('Range'), len(audio))
+        if range_ is None or self.path == '/norange':
+            start, end = 0, len(audio) - 1
+            self.send_response(200)
+        else:
+            start, end = range_
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes {}-{}/{}'.format(start, end, len(audio)))
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        try:
+            self.wfile.write(audio[start:end + 1])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def cdn():
+    server = _Server(('127.0.0.1', 0), _CDNHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _url(server, path='/song.m4a'):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+
+
+def _song(identifier, url):
+    media = Media(url, format='m4a', bitrate=320)
+    return XSongModel(identifier=identifier, title=str(identifier), url=url,
+                      q_media_mapping={'hq': media}, expired_at=None)
+
+
+def test_cache_evict(tmp_path):
+    path = str(tmp_path / 'heads.sqlite')
+    cache = HeadCache(path, max_bytes=250)
+    cache.set(1, 'hq', Head(b'a' * 100, 1000, 'audio/mpeg'))
+    cache.set(2, 'hq', Head(b'b' * 100, 1000, 'audio/mpeg'))
+    assert cache.get(1, 'hq') == Head(b'a' * 100, 1000, 'audio/mpeg')
+    assert cache.get(1, 'sq') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+    # 超出容量时淘汰最久没有被访问的
+    cache.set(3, 'hq', Head(b'c' * 100, 1000, 'audio/mpeg'))
+    assert (2, 'hq') not in cache
+    assert (1, 'hq') in cache
+    assert cache.size() == 200
+    cache.close()
+    assert HeadCache(path).get(3, 'hq').data == b'c' * 100
+
+
+@pytest.mark.parametrize('path', ['/song.m4a', '/norange'])
+def test_fetch_head(cdn, path):
+    head = fetch_head(requests.Session(), _url(cdn, path), 1000)
+    assert head == Head(AUDIO[:1000], len(AUDIO), 'audio/mp4')
+    assert cdn.requests == ['bytes=0-999']
+
+
+def test_prefetch(cdn):
+    cache = HeadCache(':memory:')
+    songs = [_song(i, _url(cdn)) for i in range(3)]
+    prefetcher = AudioPrefetcher(source=lambda: songs, cache=cache, count=2,
+                                 head_size=1000)
+    assert prefetcher.on_song_changed(songs[0]).result(timeout=5) == 2
+    assert cache.get(1, 'hq').data == AUDIO[:1000]
+    # 已经缓存的会被跳过
+    assert prefetcher.on_song_changed(songs[1]).result(timeout=5) == 1
+    assert len(cdn.requests) == 3
+    prefetcher.shutdown()
+
+
+def test_proxy(cdn):
+    cache = HeadCache(':memory:')
+    proxy = HeadProxy(cache)
+    song = _song(1, _url(cdn))
+    with patch.object(provider, 'media_proxy', proxy):
+        # 没有缓存开头时使用原来的链接
+        assert song.get_media('hq').url == _url(cdn)
+        cache.set(1, 'hq', fetch_head(requests.Session(), _url(cdn), 1000))
+        media = song.get_media('hq')
+    assert media.url.startswith('http://127.0.0.1:')
+    assert media.metadata.bitrate == 320
+    del cdn.requests[:]
+    try:
+        response = requests.get(media.url)
+        assert response.status_code == 200
+        assert response.content == AUDIO
+        assert cdn.requests == ['bytes=1000-{}'.format(len(AUDIO) - 1)]
+
+        response = requests.get(media.url, headers={'Range': 'bytes=500-1499'})
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == \
+            'bytes 500-1499/{}'.format(len(AUDIO))
+        assert response.content == AUDIO[500:1500]
+        # seek 到开头之后时直接请求远程
+        response = requests.get(media.url, headers={'Range': 'bytes=2000-'})
+        assert response.content == AUDIO[2000:]
+        assert cdn.requests[-1] == 'bytes=2000-{}'.format(len(AUDIO) - 1)
+        response = requests.get(media.url, headers={'Range': 'bytes=10-20'})
+        assert response.content == AUDIO[10:21]
+        assert len(cdn.requests) == 3
+    finally:
+        proxy.stop()
+
+
+def test_proxy_failure():
+    song = _song(1, 'http://127.0.0.1:1/song.m4a')
+    proxy = HeadProxy(HeadCache(':memory:'))
+    # 代理出错时使用原来的链接
+    with patch.object(provider, 'media_proxy', proxy), \
+            patch.object(proxy, 'wrap', side_effect=OSError):
+        assert song.get_media('hq').url == 'http://127.0.0.1:1/song.m4a'
+
+
+@pytest.mark.parametrize('path, status', [('/changed', 302), ('/error', 502)])
+def test_proxy_remote_mismatch(cdn, path, status):
+    cache = HeadCache(':memory:')
+    cache.set(1, 'hq', fetch_head(requests.Session(), _url(cdn), 1000))
+    proxy = HeadProxy(cache)
+    song = _song(1, _url(cdn, path))
+    try:
+        url = proxy.wrap(song, 'hq', song.get_remote_media('hq')).url
+        response = requests.get(url, allow_redirects=False)
+        assert response.status_code == status
+        if status == 302:
+            # 远程文件变了，不再使用缓存的开头
+            assert response.headers['Location'] == _url(cdn, path)
+            assert (1, 'hq') not in cache
+        # 只请求开头之内的部分时不需要请求远程
+        response = requests.get(url, headers={'Range': 'bytes=0-99'},
+                                allow_redirects=False)
+        assert response.status_code == (206 if status == 502 else 302)
+    finally:
+        proxy.stop()
@@ -0,0 +1,114 @@
+import time
+
+from fuo_xiami.api import API
+from fuo_xiami.cache import ResponseCache
+
+
+ACTION_ARTIST = 'mtop.alimusic.music.artistservice.getartistdetail'
+ACTION_ALBUM = 'mtop.alimusic.music.albumservice.getalbumdetail'
+ACTION_SONG = 'mtop.alimusic.music.songservice.getsongdetail'
+ACTION_LYRIC = 'mtop.alimusic.music.lyricservice.getsonglyrics'
+
+
+def _success(data):
+    rv = {'ret': ['SUCCESS::调用成功'], 'data': {'data': data}}
+    return 'SUCCESS', '调用成功', rv
+
+
+def test_cache_key_is_canonical():
+    key1 = ResponseCache.make_key('a', {'x': 1, 'y': {'p': 1, 'q': 2}})
+    key2 = ResponseCache.make_key('a', {'y': {'q': 2, 'p': 1}, 'x': 1})
+    assert key1 == key2
+    assert key1 != ResponseCache.make_key('a', {'x': 1}, salt='token')
+
+
+def test_cache_hit_and_miss():
+    cache = ResponseCache(':memory:')
+    payload = {'artistId': 1}
+    assert cache.get(ACTION_ARTIST, payload) is None
+    value = _success({'artistDetailVO': {'artistId': '1'}})
+    cache.set(ACTION_ARTIST, payload, value)
+    assert cache.get(ACTION_ARTIST, payload) == value
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_cache_ttl_and_uncacheable():
+    cache = ResponseCache(':memory:', ttls={ACTION_ALBUM: -1})
+    cache.set(ACTION_ALBUM, {}, _success({'x': 1}))
+    assert cache.get(ACTION_ALBUM, {}) is None
+    # 不在 ttls 中的 action 不缓存
+    cache.set(ACTION_SONG, {}, _success({'x': 1}))
+    assert cache.get(ACTION_SONG, {}) is None
+
+
+def test_cache_skips_listen_urls_and_lyrics():
+    # 带有播放链接的响应和歌词默认不缓存
+    cache = ResponseCache(':memory:')
+    for action in (ACTION_ALBUM, ACTION_SONG, ACTION_LYRIC):
+        assert not cache.is_cacheable(action)
+
+
+def test_cache_negative_and_system_error():
+    cache = ResponseCache(':memory:', ttls={ACTION_SONG: 60})
+    not_found = ('FAIL_BIZ_SONG_NOT_EXIST', '歌曲不存在', {'data': {}})
+    cache.set(ACTION_SONG, {'songId': 1}, not_found)
+    assert cache.get(ACTION_SONG, {'songId': 1}) == not_found
+    assert cache.negative_hits == 1
+
+    throttled = ('FAIL_SYS_USER_VALIDATE', '', {'data': {}})
+    cache.set(ACTION_SONG, {'songId': 2}, throttled)
+    assert cache.get(ACTION_SONG, {'songId': 2}) is None
+
+
+def test_cache_lru_eviction():
+    cache = ResponseCache(':memory:', max_entries=2)
+    for i in range(2):
+        cache.set(ACTION_ARTIST, {'artistId': i}, _success({'i': i}))
+        time.sleep(0.01)
+    cache.get(ACTION_ARTIST, {'artistId': 0})
+    cache.set(ACTION_ARTIST, {'artistId': 2}, _success({'i': 2}))
+    assert cache.get(ACTION_ARTIST, {'artistId': 1}) is None
+    assert cache.get(ACTION_ARTIST, {'artistId': 0}) is not None
+    assert cache.evictions == 1
+
+
+def test_cache_eviction_without_count(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = ResponseCache(path, max_entries=3)
+    for i in range(2):
+        cache.set(ACTION_ARTIST, {'artistId': i}, _success({'i': i}))
+    cache.close()
+    # 重新打开时条目数从数据库中读出
+    cache = ResponseCache(path, max_entries=3)
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    # 覆盖已有的条目不会增加条目数
+    cache.set(ACTION_ARTIST, {'artistId': 0}, _success({'i': 0}))
+    cache.set(ACTION_ARTIST, {'artistId': 2}, _success({'i': 2}))
+    assert cache.evictions == 0
+    cache.set(ACTION_ARTIST, {'artistId': 3}, _success({'i': 3}))
+    assert cache.evictions == 1
+    assert not [sql for sql in statements if 'COUNT' in sql]
+
+
+def test_api_request_uses_cache():
+    class Session:
+        headers = {}
+        count = 0
+
+        def get(self, url, params=None, timeout=None):
+            Session.count += 1
+
+            class Response:
+                def json(self):
+                    return {'ret': ['SUCCESS::调用成功'],
+                            'data': {'data': {'artistDetailVO': {'artistId': '1'}}}}
+            return Response()
+
+    api = API()
+    api._req_token = 'token'
+    api.set_http(Session())
+    api.set_cache(ResponseCache(':memory:'))
+    assert api.artist_detail(1) == api.artist_detail(1)
+    assert Session.count == 1
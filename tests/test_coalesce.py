@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from fuo_xiami.coalesce import Coalescer, AsyncCoalescer
+
+
+def test_coalescer_runs_once_for_concurrent_calls():
+    coalescer = Coalescer()
+    calls = []
+    lock = threading.Lock()
+
+    def func():
+        with lock:
+            calls.append(1)
+        time.sleep(0.05)
+        return {'x': 1}
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(coalescer.do, 'key', func) for _ in range(5)]
+        results = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert coalescer.coalesced == 4
+
+    # 之前的请求结束之后，新的调用会重新执行
+    coalescer.do('key', func)
+    assert len(calls) == 2
+
+
+def test_coalescer_propagates_exception():
+    coalescer = Coalescer()
+    started = threading.Event()
+
+    def func():
+        started.set()
+        time.sleep(0.05)
+        raise ValueError('boom')
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(coalescer.do, 'key', func)
+        started.wait()
+        follower = executor.submit(coalescer.do, 'key', func)
+        with pytest.raises(ValueError):
+            leader.result()
+        with pytest.raises(ValueError):
+            follower.result()
+
+
+def test_async_coalescer():
+    coalescer = AsyncCoalescer()
+    calls = []
+
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def main():
+        return await asyncio.gather(*[coalescer.do('key', func) for _ in range(3)])
+
+    assert asyncio.run(main()) == [1, 1, 1]
+    assert len(calls) == 1
+    assert coalescer.coalesced == 2
@@ -0,0 +1,66 @@
+import hashlib
+import json
+from unittest.mock import patch
+
+import pytest
+
+from fuo_xiami import codec
+from fuo_xiami.api import API
+from fuo_xiami.codec import RequestStrEncoder, loads, response_json
+
+
+def _legacy_data(header, model):
+    return json.dumps({'requestStr': json.dumps({'header': header, 'model': model})})
+
+
+@pytest.mark.parametrize('model', [
+    {},
+    {'songId': 1769099772},
+    {'key': '周杰伦 "晴天"\\n', 'pagingVO': {'page': 1, 'pageSize': 20}},
+    {'emoji': '\U0001f3b5', 'ids': [1, 2.5, None, True], 'tab': '\t'},
+])
+def test_request_str_matches_stdlib(model):
+    encoder = RequestStrEncoder()
+    header = {'appId': 200, 'platformId': 'h5'}
+    assert encoder.encode(header, model) == _legacy_data(header, model)
+    # header 变化之后重新生成前缀
+    header['accessToken'] = 'token"é'
+    assert encoder.encode(header, model) == _legacy_data(header, model)
+
+
+def test_sign_payload_is_unchanged():
+    api = API()
+    api._req_token = 'token'
+    api._req_header['accessToken'] = 'access'
+    payload = {'keyword': '虾米', 'pagingVO': {'page': 1, 'pageSize': 30}}
+    with patch('fuo_xiami.api.time.time', return_value=1571000000.0):
+        params = api._sign_payload(payload)
+    data = _legacy_data(api._req_header, payload)
+    data_str = 'token&1571000000000&{}&{}'.format(api._app_key, data)
+    assert params['data'] == data
+    assert params['sign'] == hashlib.md5(data_str.encode('utf-8')).hexdigest()
+
+
+def test_loads_falls_back_to_stdlib():
+    assert loads(b'{"a": [1, "\\u864e"]}') == {'a': [1, '虎']}
+    # orjson 不支持超出 64 位的整数
+    assert loads('[%d]' % 2 ** 70) == [2 ** 70]
+    with pytest.raises(json.JSONDecodeError):
+        loads(b'{"a": ')
+
+
+def test_response_json():
+    class Response:
+        content = '{"ret": ["SUCCESS::ok"]}'.encode('utf-8')
+
+    class LegacyResponse:
+        def json(self):
+            return {'ret': []}
+
+    assert response_json(Response()) == {'ret': ['SUCCESS::ok']}
+    assert response_json(LegacyResponse()) == {'ret': []}
+
+
+def test_dumps_roundtrip():
+    value = ['SUCCESS', '调用成功', {'data': {'data': {'songs': []}}}]
+    assert loads(codec.dumps(value)) == value
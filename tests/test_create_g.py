@@ -0,0 +1,53 @@
+import json
+import threading
+import time
+
+from fuo_xiami.models import create_g
+
+
+with open('data/fixtures/artist_songs.json') as f:
+    data_artist_songs = json.load(f)
+
+
+def make_paged_func(pages, page_size=3, delay=0):
+    """构造一个分页接口，每页的歌曲 id 为 page * 100 + i"""
+    requested = []
+    lock = threading.Lock()
+
+    def func(identifier, page=1, page_size=page_size):
+        with lock:
+            requested.append(page)
+        time.sleep(delay)
+        songs = []
+        for i in range(page_size):
+            song = dict(data_artist_songs[0])
+            song['songId'] = str(page * 100 + i)
+            songs.append(song)
+        return {
+            'songs': songs,
+            'pagingVO': {
+                'count': str(pages * page_size),
+                'page': str(page),
+                'pageSize': str(page_size),
+                'pages': str(pages),
+            }
+        }
+    return func, requested
+
+
+def test_create_g_prefetch_keeps_order():
+    func, requested = make_paged_func(pages=5, delay=0.01)
+    g = create_g(func, 1, prefetch=3)
+    ids = [song.identifier for song in g]
+    assert ids == [page * 100 + i for page in range(1, 6) for i in range(3)]
+    assert sorted(requested) == [1, 2, 3, 4, 5]
+
+
+def test_create_g_prefetch_stops_when_consumer_stops():
+    func, requested = make_paged_func(pages=20)
+    g = create_g(func, 1, prefetch=2)
+    next(g)
+    g._g.close()
+    time.sleep(0.05)
+    # 第一页 + 预取窗口中的两页
+    assert sorted(requested) == [1, 2, 3]
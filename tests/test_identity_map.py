@@ -0,0 +1,53 @@
+import gc
+import json
+
+from fuo_xiami.models import (
+    _deserialize,
+    identity_map,
+    AlbumSchema,
+    NestedSongSchema,
+    PlaylistSchema,
+    XSongModel,
+)
+
+
+with open('data/fixtures/playlist.json') as f:
+    data_playlist = json.load(f)
+
+with open('data/fixtures/album.json') as f:
+    data_album = json.load(f)
+
+
+def test_repeated_deserialization_returns_same_instance():
+    playlist1 = _deserialize(data_playlist, PlaylistSchema)
+    playlist2 = _deserialize(data_playlist, PlaylistSchema)
+    assert playlist1 is playlist2
+    assert all(s1 is s2 for s1, s2 in zip(playlist1.songs, playlist2.songs))
+
+
+def test_songs_share_album_instance():
+    album = _deserialize(data_album, AlbumSchema)
+    assert album.songs[0].album is album.songs[1].album
+    assert album.songs[0].album is album
+
+
+def test_merge_keeps_known_fields():
+    data_song = data_playlist['songs'][0]
+    song = _deserialize(data_song, NestedSongSchema)
+    mapping = song.q_media_mapping
+    assert mapping
+
+    partial = dict(data_song)
+    partial.pop('listenFiles')
+    partial['songName'] = 'new title'
+    assert _deserialize(partial, NestedSongSchema) is song
+    assert song.title == 'new title'
+    assert song.q_media_mapping is mapping
+
+
+def test_identity_map_does_not_keep_models_alive():
+    song = identity_map.get_or_create(XSongModel, identifier=-1, title='x')
+    assert identity_map.get(XSongModel, -1) is song
+    del song
+    gc.collect()
+    assert identity_map.get(XSongModel, -1) is None
@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+
+# 在新的进程中检查，避免受到其它测试已经导入的模块的影响
+SCRIPT = '''
+import sys
+from unittest import mock
+
+import fuo_xiami
+fuo_xiami.enable(mock.MagicMock(mode=0, GuiMode=1))
+heavy = ['marshmallow', 'fuo_xiami.models', 'fuo_xiami.schemas',
+         'fuo_xiami.loaders', 'fuo_xiami.library', 'fuo_xiami.ui',
+         # 音频开头预取默认关闭
+         'fuo_xiami.audio']
+print(','.join(name for name in heavy if name in sys.modules))
+
+from fuo_xiami.provider import provider
+print(provider.Song.__name__, provider.User.__name__)
+
+# 搜索引擎和本地索引在第一次使用时才创建
+from fuo_xiami import models
+print('fuo_xiami.index' in sys.modules, models._search_engine)
+'''
+
+
+def test_enable_does_not_import_models(tmp_path):
+    os.makedirs(str(tmp_path / '.FeelUOwn' / 'data'))
+    env = dict(os.environ, HOME=str(tmp_path))
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT], env=env,
+                                  universal_newlines=True)
+    # 第一次访问 provider.Song 时才导入 models
+    assert out.splitlines() == ['', 'XSongModel XUserModel', 'False None']
+
+
+#: 导入 fuo_xiami 并调用 enable 的耗时上限（秒）和新导入的模块数上限，
+#: 目前大约是 60ms、33 个模块，上限留了足够的余量，避免机器较慢时误报
+IMPORT_TIME_BUDGET = 0.5
+IMPORT_MODULES_BUDGET = 50
+
+# 和 benchmarks/bench_import.py 一样，feeluown 加载插件之前已经导入了这些模块
+BUDGET_SCRIPT = '''
+import sys
+import time
+from unittest import mock
+
+import feeluown.consts  # noqa
+import fuocore.models  # noqa
+import fuocore.provider  # noqa
+
+before = set(sys.modules)
+start = time.perf_counter()
+import fuo_xiami
+fuo_xiami.enable(mock.MagicMock(mode=0, GuiMode=1))
+print(time.perf_counter() - start, len(set(sys.modules) - before))
+'''
+
+
+def test_enable_import_budget(tmp_path):
+    os.makedirs(str(tmp_path / '.FeelUOwn' / 'data'))
+    env = dict(os.environ, HOME=str(tmp_path))
+    runs = []
+    for _ in range(3):
+        out = subprocess.check_output([sys.executable, '-c', BUDGET_SCRIPT], env=env,
+                                      universal_newlines=True)
+        elapsed, modules = out.split()
+        runs.append((float(elapsed), int(modules)))
+    # 取最快的一次，减少机器负载的影响
+    elapsed = min(elapsed for elapsed, _ in runs)
+    modules = runs[0][1]
+    assert elapsed < IMPORT_TIME_BUDGET, runs
+    assert modules <= IMPORT_MODULES_BUDGET, runs
+
+
+def test_lazy_model_names():
+    # Python 3.5 没有 __set_name__，属性名是显式传入的
+    from fuo_xiami.provider import _LazyModel, XiamiProvider
+
+    lazy = {name: attr for name, attr in vars(XiamiProvider).items()
+            if isinstance(attr, _LazyModel)}
+    assert set(lazy) == {'Song', 'Artist', 'Album', 'Playlist', 'Lyric', 'User'}
+    assert all(attr.name == name for name, attr in lazy.items())
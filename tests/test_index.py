@@ -0,0 +1,252 @@
+import gc
+import json
+import threading
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+
+from fuo_xiami.api import API
+from fuo_xiami.index import lazy_pinyin, SongIndex
+from fuo_xiami.provider import provider
+from fuo_xiami.models import (
+    _deserialize,
+    get_search_engine,
+    get_song_index,
+    isearch,
+    search,
+    set_deserializer,
+    identity_map,
+    NestedSongSchema,
+)
+
+
+with open('data/fixtures/artist_songs.json') as f:
+    data_artist_songs = json.load(f)
+
+with open('data/fixtures/search.json') as f:
+    data_search = json.load(f)
+
+
+def _song(song_id, title, artists, album):
+    return {'songId': song_id, 'songName': title, 'mvId': '', 'length': '0',
+            'albumId': 1, 'albumName': album, 'albumLogo': '',
+            'singerVOs': [{'artistId': i, 'artistName': name}
+                          for i, name in enumerate(artists)]}
+
+
+@pytest.fixture(autouse=True)
+def clear_identity_map():
+    yield
+    gc.collect()
+    identity_map.clear()
+    get_song_index().clear()
+
+
+@pytest.fixture
+def index():
+    index = SongIndex()
+    index.add(_song(1, '晴天', ['周杰伦'], '叶惠美'))
+    index.add(_song(2, 'Hey Jude', ['The Beatles'], 'Hey Jude'))
+    index.add(_song(3, '七里香', ['周杰伦'], '七里香'))
+    index.add(_song(4, '天天', ['陶喆'], '黑色柳丁'))
+    return index
+
+
+def test_search_cjk(index):
+    assert index.search('晴天') == [1]
+    # 七里香 的标题和专辑都匹配，得分更高
+    assert index.search('周杰伦 七里') == [3]
+    assert sorted(index.search('周杰伦')) == [1, 3]
+    assert index.search('周伦') == []
+    assert index.search('天') == [4, 1]
+
+
+def test_search_words(index):
+    assert index.search('jude') == [2]
+    assert index.search('Beat') == [2]
+    assert index.search('heyju') == [2]
+    assert index.search('eatles') == []
+
+
+@pytest.mark.skipif(lazy_pinyin is None, reason='pypinyin is not installed')
+def test_search_pinyin(index):
+    assert sorted(index.search('zjl')) == [1, 3]
+    assert sorted(index.search('zhoujie')) == [1, 3]
+    assert index.search('jie lun qing') == [1]
+    assert index.search('qlx') == [3]
+
+
+@pytest.mark.skipif(lazy_pinyin is None, reason='pypinyin is not installed')
+def test_search_initials_anchored():
+    index = SongIndex()
+    index.add(_song(1, '谢谢侬', [], ''))
+    index.add(_song(2, '我是一只小小鸟', [], ''))
+    index.add(_song(3, '山丘', [], ''))
+    # 首字母需要从一段汉字的开头开始
+    assert index.search('xxn') == [1]
+    assert index.search('wsyz') == [2]
+    assert index.search('zxxn') == []
+    # 少于三个字母时需要正好是一整段汉字
+    assert index.search('xx') == []
+    assert index.search('sq') == [3]
+
+
+def test_observe_from_threads():
+    index = SongIndex(max_pending=100)
+    album = SimpleNamespace(identifier=1, name='album', cover='')
+    fields = {'title': 'song', 'album': album, 'artists': []}
+    songs = [SimpleNamespace(identifier=i) for i in range(2000)]
+
+    def observe(start):
+        for song in songs[start::4]:
+            index.observe(song, fields)
+
+    threads = [threading.Thread(target=observe, args=(i, )) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 在后台 flush 的同时放进队列的歌曲不会丢失
+    assert len(index) == 2000
+
+
+def test_update_and_evict():
+    index = SongIndex(max_songs=2)
+    index.add(_song(1, 'old', [], ''))
+    index.add(_song(2, 'b', [], ''))
+    assert index.search('old') == [1]
+    index.add(_song(1, 'new', [], ''))
+    assert index.search('old') == []
+    assert index.search('new') == [1]
+    index.add(_song(3, 'c', [], ''))
+    assert len(index) == 2
+    assert index.search('b') == []
+
+
+@pytest.mark.parametrize('deserializer', ['fast', 'lazy', 'marshmallow'])
+def test_observe_deserialized_songs(deserializer):
+    get_song_index().clear()
+    set_deserializer(deserializer)
+    try:
+        songs = [_deserialize(data, NestedSongSchema) for data in data_artist_songs]
+    finally:
+        set_deserializer('fast')
+    song = songs[0]
+    assert len(get_song_index()) == len({song.identifier for song in songs})
+    assert song.identifier in get_song_index().search(song.title)
+    # 索引中保存的数据可以重新加载
+    assert _deserialize(get_song_index().get(song.identifier),
+                        NestedSongSchema) is song
+
+
+def test_isearch_local_first():
+    get_song_index().clear()
+    songs = [_deserialize(data, NestedSongSchema) for data in data_artist_songs]
+    keyword = songs[0].title
+    with patch.object(API, 'search', return_value=data_search):
+        results = list(isearch(keyword, type_='song'))
+    assert len(results) == 2
+    local, merged = results
+    assert local.songs[0] is songs[0]
+    assert merged.songs[:len(local.songs)] == local.songs
+    ids = [song.identifier for song in merged.songs]
+    assert len(ids) == len(set(ids))
+
+
+def test_local_hits_fetch_media():
+    get_song_index().clear()
+    data = data_artist_songs[0]
+    song_id = int(data['songId'])
+    get_song_index().add(data)
+    gc.collect()
+    identity_map.clear()
+    with patch.object(API, 'search', return_value=data_search):
+        local = next(isearch(data['songName'], type_='song'))
+    song = local.songs[0]
+    assert song.identifier == song_id
+    # 索引中没有播放链接，不能认为歌曲没有可以播放的音质
+    assert object.__getattribute__(song, 'q_media_mapping') is None
+    assert object.__getattribute__(song, 'expired_at') is None
+
+
+def test_search_offline():
+    get_song_index().clear()
+    get_search_engine().clear()
+    songs = [_deserialize(data, NestedSongSchema) for data in data_artist_songs]
+    with patch.object(API, 'search', side_effect=OSError('offline')):
+        # 本地没有匹配的歌曲时，和原来一样抛出异常
+        with pytest.raises(OSError):
+            search('no such song', type_='song')
+        result = search(songs[0].title, type_='song')
+    assert result.songs[0] is songs[0]
+
+
+def test_local_hits_evicted():
+    get_song_index().clear()
+    data = data_artist_songs[0]
+    get_song_index().add(data)
+    gc.collect()
+    identity_map.clear()
+    # 模拟 search 之后、get 之前被其它线程淘汰
+    with patch.object(SongIndex, 'get', return_value=None), \
+            patch.object(API, 'search', return_value=data_search):
+        results = list(isearch(data['songName'], type_='song'))
+    assert len(results) == 1
+
+
+def test_search_on_remote():
+    get_song_index().clear()
+    get_search_engine().clear()
+    songs = [_deserialize(data, NestedSongSchema) for data in data_artist_songs]
+    keyword = songs[0].title
+    release = threading.Event()
+    merged = []
+    done = threading.Event()
+
+    def slow_search(*args, **kwargs):
+        release.wait(5)
+        return data_search
+
+    def on_remote(result):
+        merged.append(result)
+        done.set()
+
+    with patch.object(API, 'search', side_effect=slow_search):
+        # 服务端还没有返回，本地命中的歌曲就已经返回了
+        local = search(keyword, on_remote=on_remote, type_='song')
+        assert local.songs[0] is songs[0]
+        assert merged == []
+        release.set()
+        assert done.wait(5)
+    assert merged[0].songs[:len(local.songs)] == local.songs
+    assert len(merged[0].songs) > len(local.songs)
+
+
+def test_search_on_remote_without_local():
+    get_song_index().clear()
+    get_search_engine().clear()
+    on_remote = Mock()
+    with patch.object(API, 'search', return_value=data_search):
+        result = search('no such song', on_remote=on_remote, type_='song')
+    # 本地没有匹配时直接返回服务端的结果，不会再调用 on_remote
+    assert result.songs
+    on_remote.assert_not_called()
+
+
+def test_provider_on_remote_search():
+    get_song_index().clear()
+    get_search_engine().clear()
+    songs = [_deserialize(data, NestedSongSchema) for data in data_artist_songs]
+    keyword = songs[0].title
+    done = threading.Event()
+    calls = []
+    provider.on_remote_search = lambda *args: calls.append(args) or done.set()
+    try:
+        with patch.object(API, 'search', return_value=data_search):
+            provider.search(keyword=keyword, type_='song')
+            assert done.wait(5)
+    finally:
+        provider.on_remote_search = None
+    assert calls[0][0] == keyword
+    assert calls[0][1].songs[0] is songs[0]
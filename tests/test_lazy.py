@@ -0,0 +1,72 @@
+import gc
+import json
+
+import pytest
+from marshmallow import ValidationError
+
+from fuo_xiami.lazy import LazyPlaylistModel, LazySongModel, load_playlist, load_song
+from fuo_xiami.loaders import load_song as fast_load_song
+from fuo_xiami.models import identity_map, XSongModel
+
+
+def _load_fixture(name):
+    with open('data/fixtures/{}.json'.format(name)) as f:
+        return json.load(f)
+
+
+@pytest.fixture(autouse=True)
+def clear_identity_map():
+    yield
+    gc.collect()
+    identity_map.clear()
+
+
+def test_fields_are_parsed_on_access():
+    data = _load_fixture('artist_songs')[0]
+    song = load_song(data)
+    assert isinstance(song, LazySongModel)
+    assert song.title == data['songName']
+    assert 'q_media_mapping' not in song.__dict__
+    assert 'artists' not in song.__dict__
+
+    assert [artist.name for artist in song.artists] == \
+        [artist['artistName'] for artist in data['singerVOs']]
+    assert song.album.identifier == int(data['albumId'])
+    assert 'q_media_mapping' not in song.__dict__
+    assert song.list_quality()
+    assert song.url
+    # 所有延迟字段都解析之后，释放原始数据
+    assert song.__dict__['_raw'] is None
+
+
+def test_shares_identity_with_eager_model():
+    data = _load_fixture('artist_songs')[0]
+    song = load_song(data)
+    assert identity_map.get(XSongModel, song.identifier) is song
+    assert fast_load_song(data) is song
+    assert hash(song) == hash(XSongModel(identifier=song.identifier))
+    assert song == XSongModel(identifier=song.identifier)
+
+
+def test_assignment_overrides_lazy_value():
+    song = load_song(_load_fixture('artist_songs')[0])
+    song.artists = []
+    assert song.artists == []
+
+
+def test_playlist_songs():
+    data = _load_fixture('playlist')
+    playlist = load_playlist(data)
+    assert isinstance(playlist, LazyPlaylistModel)
+    assert 'songs' not in playlist.__dict__
+    songs = object.__getattribute__(playlist, 'songs')
+    assert [song.identifier for song in songs] == \
+        [int(song['songId']) for song in data['songs']]
+
+
+def test_validation_is_deferred():
+    data = dict(_load_fixture('artist_songs')[0])
+    data['singerVOs'] = 'invalid'
+    song = load_song(data)
+    with pytest.raises(ValidationError):
+        song.artists
@@ -0,0 +1,143 @@
+import gc
+import json
+import time
+from unittest.mock import patch
+
+import pytest
+
+from fuo_xiami.api import API
+from fuo_xiami.library import (
+    FULL,
+    INCREMENTAL,
+    UNCHANGED,
+    LibraryStore,
+    LibrarySync,
+)
+from fuo_xiami.models import identity_map, XPlaylistModel, XSongModel
+
+
+with open('data/fixtures/user_favorite_songs.json') as f:
+    data_songs = json.load(f)
+
+with open('data/fixtures/user_playlists.json') as f:
+    data_playlists = json.load(f)
+
+
+def _song(song_id):
+    return dict(data_songs[song_id % len(data_songs)], songId=str(song_id))
+
+
+class FakeAPI:
+    """收藏的歌曲按收藏时间倒序排列"""
+
+    def __init__(self, count):
+        self.songs = [_song(i) for i in range(count, 0, -1)]
+        self.playlists = list(data_playlists)
+        self.pages = []
+
+    def user_favorite_songs(self, user_id, page=1, page_size=50):
+        self.pages.append(page)
+        start = (page - 1) * page_size
+        pages = (len(self.songs) + page_size - 1) // page_size
+        return {'songs': self.songs[start:start + page_size],
+                'pagingVO': {'count': str(len(self.songs)), 'page': str(page),
+                             'pageSize': str(page_size), 'pages': str(pages)}}
+
+    def user_playlists(self, user_id, page=1, limit=30):
+        return self.playlists[:limit]
+
+
+@pytest.fixture(autouse=True)
+def clear_identity_map():
+    yield
+    gc.collect()
+    identity_map.clear()
+
+
+@pytest.fixture
+def sync():
+    return LibrarySync(FakeAPI(420), LibraryStore(':memory:'), user_id=1)
+
+
+def _ids(sync):
+    return [song.identifier for song in sync.load('songs')]
+
+
+def test_full_then_unchanged(sync):
+    assert sync.load('songs') is None
+    assert sync.sync('songs') == FULL
+    assert sorted(sync.api.pages) == list(range(1, 10))
+    assert _ids(sync) == [int(song['songId']) for song in sync.api.songs]
+    assert isinstance(sync.load('songs')[0], XSongModel)
+
+    sync.api.pages.clear()
+    assert sync.sync('songs') == UNCHANGED
+    assert sync.api.pages == [1]
+
+
+def test_new_favorites_are_prepended(sync):
+    sync.sync('songs')
+    sync.api.songs[:0] = [_song(1000), _song(1001)]
+    sync.api.pages.clear()
+    assert sync.sync('songs') == INCREMENTAL
+    assert sync.api.pages == [1]
+    assert _ids(sync)[:3] == [1000, 1001, 420]
+    assert len(_ids(sync)) == 422
+
+
+def test_removed_favorite_triggers_full_sync(sync):
+    sync.sync('songs')
+    del sync.api.songs[200]
+    sync.api.pages.clear()
+    assert sync.sync('songs') == FULL
+    assert _ids(sync) == [int(song['songId']) for song in sync.api.songs]
+
+    # 新增和删除同时发生时，count 对不上，也需要整体替换
+    del sync.api.songs[300]
+    sync.api.songs.insert(0, _song(2000))
+    assert sync.sync('songs') == FULL
+    assert _ids(sync) == [int(song['songId']) for song in sync.api.songs]
+
+
+def test_unpaged_playlists(sync):
+    assert sync.sync('playlists') == FULL
+    assert sync.sync('playlists') == UNCHANGED
+    sync.api.playlists[0] = dict(sync.api.playlists[0], collectName='renamed')
+    assert sync.sync('playlists') == FULL
+    playlists = sync.load('playlists')
+    assert isinstance(playlists[0], XPlaylistModel)
+    assert playlists[0].name == 'renamed'
+
+
+def test_items_are_compact(sync):
+    sync.sync('songs')
+    count, items, _ = sync.store.get(1, 'songs')
+    assert count == 420
+    assert 'listenFiles' not in items[0]
+    assert set(items[0]['singerVOs'][0]) <= {'artistId', 'artistName', 'artistLogo'}
+
+
+def test_sync_all_in_background(sync):
+    synced = []
+    sync.start_sync(kinds=('songs', 'playlists'),
+                    on_synced=lambda kind, status: synced.append((kind, status))) \
+        .join(timeout=5)
+    assert synced == [('songs', FULL), ('playlists', FULL)]
+    assert len(list(sync.load_g('songs'))) == 420
+
+
+def test_loaded_songs_fetch_media(sync):
+    sync.sync('songs')
+    song = sync.load('songs')[0]
+    # 本地没有保存播放链接，第一次播放时才获取
+    assert object.__getattribute__(song, 'q_media_mapping') is None
+    with open('data/fixtures/song.json') as f:
+        data_song = dict(json.load(f), songId=str(song.identifier), listenFiles=[
+            {'quality': 'h', 'format': 'mp3', 'url': 'http://m320.xiami.net/1.mp3'}])
+    with patch.object(API, 'song_detail', return_value=data_song) as song_detail, \
+            patch.object(API, 'song_lyric', return_value=''):
+        media, quality = song.select_media()
+    song_detail.assert_called_once_with(song.identifier)
+    assert quality == 'hq'
+    assert media.url == 'http://m320.xiami.net/1.mp3'
+    assert song.expired_at > time.time()
@@ -0,0 +1,160 @@
+"""手写的加载函数和 marshmallow Schema 的结果必须一致"""
+
+import gc
+import json
+
+import pytest
+from marshmallow import ValidationError
+
+from fuocore.media import Media
+from fuocore.models import BaseModel
+
+from fuo_xiami.lazy import (
+    LazyField,
+    LazyAlbumModel,
+    LazyPlaylistModel,
+    LazySongModel,
+)
+from fuo_xiami.models import (
+    _deserialize,
+    identity_map,
+    set_deserializer,
+    AlbumSchema,
+    ArtistSchema,
+    MvSchema,
+    NestedSongSchema,
+    PlaylistSchema,
+    SearchSchema,
+    SongSchema,
+    UserSchema,
+)
+
+
+def _load_fixture(name):
+    with open('data/fixtures/{}.json'.format(name)) as f:
+        return json.load(f)
+
+
+data_mv = {'mvId': '1', 'title': 'mv', 'mvCover': 'cover', 'mp4Url': 'url'}
+
+CASES = [
+    ('song', SongSchema, False),
+    ('album', AlbumSchema, False),
+    ('artist', ArtistSchema, False),
+    ('artist_songs', NestedSongSchema, True),
+    ('playlist', PlaylistSchema, False),
+    ('search', SearchSchema, False),
+    ('user', UserSchema, False),
+    ('user_favorite_songs', NestedSongSchema, True),
+    ('user_playlists', PlaylistSchema, True),
+]
+
+
+def dump(obj, seen=None):
+    """把 model 转换成普通的数据结构，方便比较"""
+    seen = set() if seen is None else seen
+    if isinstance(obj, BaseModel):
+        # 延迟解析的 model 和对应的普通 model 应该是一样的
+        cls = getattr(type(obj), '_identity_cls', type(obj))
+        key = (cls, obj.identifier)
+        if key in seen:
+            return key
+        seen.add(key)
+        fields = {}
+        for field in sorted(obj.meta.fields):
+            if field in obj.meta.fields_no_get or field == 'expired_at':
+                continue
+            # 直接读取 __dict__，避免触发 model 的 get 以及 property
+            value = obj.__dict__.get(field, obj.__dict__.get('_' + field))
+            for name in (field, '_' + field):
+                if isinstance(getattr(type(obj), name, None), LazyField):
+                    value = object.__getattribute__(obj, name)
+            fields[field] = dump(value, seen)
+        return (cls.__name__, fields)
+    if isinstance(obj, Media):
+        return (obj.url, obj.metadata.format, obj.metadata.bitrate)
+    if isinstance(obj, dict):
+        return {k: dump(v, seen) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [dump(v, seen) for v in obj]
+    return obj
+
+
+def load_all(obj, seen=None):
+    """解析所有延迟字段
+
+    嵌套的 model 来自 IdentityMap，延迟字段解析时才会合并到已有的实例中，
+    所以比较之前需要先全部解析，否则结果和遍历字段的顺序有关。
+    """
+    seen = set() if seen is None else seen
+    if isinstance(obj, BaseModel):
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        for name in dir(type(obj)):
+            if isinstance(getattr(type(obj), name, None), LazyField):
+                load_all(object.__getattribute__(obj, name), seen)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            load_all(value, seen)
+
+
+def _load_and_dump(data, schema_cls, many, deserializer, trusted=False):
+    set_deserializer(deserializer, trusted=trusted)
+    try:
+        objs = [_deserialize(item, schema_cls) for item in data] if many \
+            else _deserialize(data, schema_cls)
+        load_all(objs)
+        if many:
+            return [dump(obj) for obj in objs]
+        return dump(objs)
+    finally:
+        set_deserializer('fast')
+        # 避免 IdentityMap 让两次加载返回同一批实例
+        gc.collect()
+        identity_map.clear()
+
+
+@pytest.mark.parametrize('name, schema_cls, many', CASES)
+@pytest.mark.parametrize('trusted', [False, True])
+@pytest.mark.parametrize('deserializer', ['fast', 'lazy'])
+def test_fast_loader_equivalent(name, schema_cls, many, trusted, deserializer):
+    data = _load_fixture(name)
+    expected = _load_and_dump(data, schema_cls, many, 'marshmallow')
+    assert _load_and_dump(data, schema_cls, many, deserializer, trusted) == expected
+
+
+def test_fast_loader_equivalent_login_and_mv():
+    data = _load_fixture('login')['data']['data']
+    assert _load_and_dump(data, UserSchema, False, 'fast') == \
+        _load_and_dump(data, UserSchema, False, 'marshmallow')
+    assert _load_and_dump(data_mv, MvSchema, False, 'fast') == \
+        _load_and_dump(data_mv, MvSchema, False, 'marshmallow')
+
+
+@pytest.mark.parametrize('invalid', [
+    {'songId': None},
+    {'songId': 'abc'},
+    {'songName': 1},
+    {'singerVOs': None},
+    {'listenFiles': None},
+])
+def test_fast_loader_validates_like_marshmallow(invalid):
+    data = dict(_load_fixture('song'), **invalid)
+    for deserializer in ('marshmallow', 'fast'):
+        set_deserializer(deserializer)
+        try:
+            with pytest.raises(ValidationError):
+                _deserialize(data, SongSchema)
+        finally:
+            set_deserializer('fast')
+
+
+@pytest.mark.parametrize('model_cls', [LazySongModel, LazyAlbumModel,
+                                       LazyPlaylistModel])
+def test_lazy_field_names(model_cls):
+    # Python 3.5 没有 __set_name__，字段名是显式传入的
+    fields = {name: attr for name, attr in vars(model_cls).items()
+              if isinstance(attr, LazyField)}
+    assert set(fields) == set(model_cls._lazy_fields)
+    assert all(attr.name == name for name, attr in fields.items())
@@ -0,0 +1,98 @@
+import zlib
+from unittest.mock import patch
+
+from fuo_xiami.api import API
+from fuo_xiami.lyric import LyricPrefetcher, LyricStore, LyricTimeline
+from fuo_xiami.models import XLyricModel, XSongModel
+
+
+LRC = '''[ti:晴天]
+[offset:500]
+[00:10.00][01:10.00]故事的小黄花
+[00:05.20]从出生那年就飘着
+[00:20.<100>00]无效的行
+[00:30.00]<100>刮<200>风
+'''
+
+
+def test_store(tmp_path):
+    path = str(tmp_path / 'lyrics.sqlite')
+    store = LyricStore(path, max_entries=2)
+    store.set(1, LRC)
+    store.set(2, '')
+    assert store.get(1) == LRC
+    assert store.get(2) == ''
+    assert store.get(3) is None
+    assert store.stats() == {'hits': 2, 'misses': 1}
+    blob = store._conn.execute('SELECT content FROM lyrics WHERE song_id=1') \
+        .fetchone()[0]
+    assert zlib.decompress(blob).decode('utf-8') == LRC
+    # 超出容量时淘汰最久没有被访问的歌词
+    store.set(3, 'c')
+    assert 1 not in store
+    store.close()
+    assert LyricStore(path).get(3) == 'c'
+
+
+def test_store_eviction_without_count(tmp_path):
+    path = str(tmp_path / 'lyrics.sqlite')
+    store = LyricStore(path, max_entries=3)
+    store.set(1, 'a')
+    store.set(2, 'b')
+    store.close()
+    store = LyricStore(path, max_entries=3)
+    statements = []
+    store._conn.set_trace_callback(statements.append)
+    # 覆盖已有的歌词不会增加条目数
+    store.set(1, 'a')
+    store.set(3, 'c')
+    assert 1 in store and 2 in store
+    store.set(4, 'd')
+    assert 2 not in store
+    assert not [sql for sql in statements if 'COUNT' in sql]
+
+
+def test_timeline():
+    timeline = LyricTimeline(LRC)
+    assert timeline.lines == ['从出生那年就飘着', '故事的小黄花', '刮风', '故事的小黄花']
+    assert list(timeline.times) == [4700, 9500, 29500, 69500]
+    assert timeline.index_at(0) == -1
+    assert timeline.line_at(0) == ''
+    assert timeline.line_at(4.7) == '从出生那年就飘着'
+    assert timeline.line_at(29.49) == '故事的小黄花'
+    assert timeline.line_at(600) == '故事的小黄花'
+    assert len(LyricTimeline(None)) == 0
+
+
+def test_lyric_model_timeline():
+    lyric = XLyricModel(identifier=1, content=LRC)
+    assert lyric.timeline is lyric.timeline
+    lyric.content = '[00:01.00]a'
+    assert lyric.timeline.lines == ['a']
+
+
+def test_api_uses_store():
+    api = API()
+    api.set_lyric_store(LyricStore(':memory:'))
+    rv = ('SUCCESS', '', {'data': {'data': {'lyrics': [
+        {'type': '1', 'content': 'plain'}, {'type': '2', 'content': LRC}]}}})
+    with patch.object(API, 'request', return_value=rv) as request:
+        assert api.song_lyric(1) == LRC
+        assert api.song_lyric(1) == LRC
+    assert request.call_count == 1
+
+
+def test_prefetcher():
+    songs = [XSongModel(identifier=i, title=str(i)) for i in range(5)]
+    prefetcher = LyricPrefetcher(source=lambda: songs, count=3)
+    assert prefetcher.upcoming(songs[3]) == [songs[4], songs[0], songs[1]]
+    assert prefetcher.upcoming(songs[0]) == songs[1:4]
+
+    with patch.object(XSongModel._api, 'song_lyric', return_value=LRC) as song_lyric:
+        assert prefetcher.on_song_changed(songs[3]).result(timeout=5) == 3
+        # 已经获取过的歌曲会被跳过
+        assert prefetcher.on_song_changed(songs[4]).result(timeout=5) == 1
+    assert song_lyric.call_count == 4
+    assert songs[0].lyric.timeline.line_at(10) == '故事的小黄花'
+    assert prefetcher.on_song_changed(None) is None
+    prefetcher.shutdown()
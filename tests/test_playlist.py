@@ -0,0 +1,165 @@
+import asyncio
+import gc
+import json
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from fuo_xiami.api import API
+from fuo_xiami.models import identity_map, XPlaylistModel
+
+
+with open('data/fixtures/playlist.json') as f:
+    data_playlist = json.load(f)
+
+with open('data/fixtures/artist_songs.json') as f:
+    data_song = json.load(f)[0]
+
+
+class FakeAPI(API):
+    """playlist_detail 返回 fixture，songs_detail 返回构造的歌曲"""
+
+    def __init__(self, playlist):
+        super().__init__()
+        self.playlist = playlist
+        self.chunks = []
+        self.lock = threading.Lock()
+
+    def playlist_detail(self, playlist_id):
+        return self.playlist
+
+    def _songs_detail_chunk(self, song_ids):
+        with self.lock:
+            self.chunks.append(list(song_ids))
+        return [dict(data_song, songId=str(song_id)) for song_id in song_ids]
+
+
+@pytest.fixture(autouse=True)
+def clear_identity_map():
+    yield
+    gc.collect()
+    identity_map.clear()
+
+
+def _large_playlist(count):
+    all_songs = list(data_playlist['allSongs'])
+    all_songs += [str(9000000 + i) for i in range(count - len(all_songs))]
+    # 重复的 id 只会出现一次
+    return dict(data_playlist, allSongs=all_songs + all_songs[:10])
+
+
+def test_hydrate_sync():
+    data = _large_playlist(2000)
+    api = FakeAPI(data)
+    with patch.object(XPlaylistModel, '_api', api), \
+            patch.object(XPlaylistModel, 'hydration', 'sync'):
+        playlist = XPlaylistModel.get(data['listId'])
+    assert [song.identifier for song in playlist.songs] == \
+        [int(song_id) for song_id in data['allSongs'][:2000]]
+    # 前 100 首已经在 playlist_detail 的结果中了
+    assert sum(len(chunk) for chunk in api.chunks) == 1900
+    assert len(api.chunks) == 10
+
+
+def test_hydrate_background():
+    data = _large_playlist(500)
+    api = FakeAPI(data)
+    with patch.object(XPlaylistModel, '_api', api), \
+            patch.object(XPlaylistModel, 'hydration', 'background'), \
+            patch.object(XPlaylistModel, 'start_hydrate') as start_hydrate:
+        playlist = XPlaylistModel.get(data['listId'])
+    assert len(playlist.songs) == 100
+    song_ids = start_hydrate.call_args[0][0]
+    with patch.object(XPlaylistModel, '_api', api):
+        playlist.start_hydrate(song_ids).join(timeout=5)
+    assert len(playlist.songs) == 500
+
+
+def test_no_hydration_for_small_playlist():
+    data = dict(data_playlist, allSongs=data_playlist['allSongs'][:100])
+    api = FakeAPI(data)
+    with patch.object(XPlaylistModel, '_api', api), \
+            patch.object(XPlaylistModel, 'hydration', 'sync'):
+        playlist = XPlaylistModel.get(data['listId'])
+    assert len(playlist.songs) == 100
+    assert api.chunks == []
+
+
+def test_no_hydration_by_default():
+    data = _large_playlist(500)
+    api = FakeAPI(data)
+    with patch.object(XPlaylistModel, '_api', api), \
+            patch.object(XPlaylistModel, 'start_hydrate') as start_hydrate:
+        playlist = XPlaylistModel.get(data['listId'])
+    assert len(playlist.songs) == 100
+    assert not start_hydrate.called
+    assert api.chunks == []
+
+
+def test_single_background_hydration():
+    data = _large_playlist(500)
+    api = FakeAPI(data)
+    release = threading.Event()
+    chunk = api._songs_detail_chunk
+
+    def slow_chunk(song_ids):
+        release.wait(timeout=5)
+        return chunk(song_ids)
+
+    with patch.object(XPlaylistModel, '_api', api), \
+            patch.object(api, '_songs_detail_chunk', slow_chunk):
+        playlist = XPlaylistModel.get(data['listId'])
+        song_ids = [int(song_id) for song_id in data['allSongs']]
+        thread = playlist.start_hydrate(song_ids)
+        assert playlist.start_hydrate(song_ids) is thread
+        release.set()
+        thread.join(timeout=5)
+        # 已经获取过的歌曲不会重复请求
+        assert playlist.hydrate(song_ids) == 0
+    assert sum(len(chunk) for chunk in api.chunks) == 400
+    assert len(playlist.songs) == 500
+
+
+def test_hydrate_into_replaced_songs():
+    data = _large_playlist(1000)
+    api = FakeAPI(data)
+    with patch.object(XPlaylistModel, '_api', api):
+        playlist = XPlaylistModel.get(data['listId'])
+        first_songs = playlist.songs
+        song_ids = [int(song_id) for song_id in data['allSongs']]
+        chunks = api.iter_songs_detail
+
+        def iter_songs_detail(*args):
+            for i, item in enumerate(chunks(*args)):
+                if i == 1:
+                    # 模拟另一次 get 合并时替换了 songs
+                    playlist.songs = list(first_songs[:100])
+                yield item
+
+        with patch.object(api, 'iter_songs_detail', iter_songs_detail):
+            assert playlist.hydrate(song_ids) == 900
+    assert playlist.songs is not first_songs
+    assert [song.identifier for song in playlist.songs] == song_ids[:1000]
+
+
+class FakeAsyncAPI(object):
+
+    def __init__(self, api):
+        self.api = api
+
+    async def playlist_detail(self, playlist_id):
+        return self.api.playlist_detail(playlist_id)
+
+    async def songs_detail(self, song_ids, workers=None):
+        return self.api.songs_detail(song_ids, workers)
+
+
+def test_aget_hydrate_sync():
+    data = _large_playlist(500)
+    api = FakeAPI(data)
+    with patch.object(XPlaylistModel, '_aapi', FakeAsyncAPI(api)), \
+            patch.object(XPlaylistModel, 'hydration', 'sync'):
+        playlist = asyncio.run(XPlaylistModel.aget(data['listId']))
+    assert [song.identifier for song in playlist.songs] == \
+        [int(song_id) for song_id in data['allSongs'][:500]]
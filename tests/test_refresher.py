@@ -0,0 +1,94 @@
+import gc
+import json
+import time
+
+import pytest
+
+from fuo_xiami.loaders import load_song
+from fuo_xiami.models import identity_map, XSongModel
+from fuo_xiami.refresher import expires_at, UrlRefresher
+
+
+with open('data/fixtures/artist_songs.json') as f:
+    data_artist_songs = json.load(f)
+
+
+class FakeAPI:
+    def __init__(self, songs):
+        self.songs = {int(song['songId']): song for song in songs}
+        self.calls = []
+
+    def songs_detail(self, song_ids):
+        self.calls.append(list(song_ids))
+        return [self.songs[song_id] for song_id in song_ids
+                if song_id in self.songs]
+
+
+@pytest.fixture(autouse=True)
+def clear_identity_map():
+    yield
+    gc.collect()
+    identity_map.clear()
+
+
+def _expire_soon(song, seconds):
+    song.expired_at = song._expired_at = time.time() + seconds
+
+
+def test_refresh_songs_about_to_expire():
+    songs = [load_song(data) for data in data_artist_songs[:3]]
+    _expire_soon(songs[0], 60)
+    _expire_soon(songs[1], -60)
+    api = FakeAPI(data_artist_songs)
+    refresher = UrlRefresher(source=lambda: songs, margin=300, api=api)
+
+    assert refresher.refresh_once() == 2
+    assert api.calls == [[songs[0].identifier, songs[1].identifier]]
+    for song in songs:
+        assert expires_at(song) > time.time() + 3000
+    # 都已经刷新过了，不会再次请求
+    assert refresher.refresh_once() == 0
+    assert len(api.calls) == 1
+
+
+def test_refresh_model_not_in_identity_map():
+    data = data_artist_songs[0]
+    song = XSongModel(identifier=int(data['songId']), url='', q_media_mapping={},
+                      expired_at=time.time() - 1)
+    refresher = UrlRefresher(api=FakeAPI([data]))
+    refresher.watch([song])
+    assert refresher.refresh_once() == 1
+    assert song.q_media_mapping
+    assert song.url == load_song(data)._url
+    assert not song.is_expired
+
+
+def test_song_without_url_is_not_retried_immediately():
+    data = dict(data_artist_songs[0], listenFiles=[])
+    song = load_song(data)
+    _expire_soon(song, -1)
+    api = FakeAPI([data])
+    refresher = UrlRefresher(margin=300, api=api)
+    refresher.watch([song])
+    now = time.time()
+    assert refresher.refresh_once(now) == 0
+    assert refresher.refresh_once(now + 10) == 0
+    assert len(api.calls) == 1
+    refresher.refresh_once(now + 301)
+    assert len(api.calls) == 2
+
+
+def test_background_thread():
+    song = load_song(data_artist_songs[0])
+    _expire_soon(song, -1)
+    api = FakeAPI(data_artist_songs)
+    refresher = UrlRefresher(source=lambda: [song], interval=30, api=api)
+    refresher.start()
+    try:
+        deadline = time.time() + 3
+        while refresher.refreshed == 0 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        refresher.stop()
+    assert refresher.refreshed == 1
+    assert not song.is_expired
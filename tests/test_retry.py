@@ -0,0 +1,145 @@
+from unittest import mock
+
+import pytest
+
+from fuo_xiami.api import API
+from fuo_xiami.excs import XiamiThrottledError
+from fuo_xiami.retry import CircuitBreaker, RetryPolicy
+
+
+THROTTLED = {'ret': ['FAIL_SYS_USER_VALIDATE',
+                     'RGV587_ERROR::SM::哎哟喂,被挤爆啦,请稍后重试'],
+             'data': {}}
+SUCCESS = {'ret': ['SUCCESS::调用成功'],
+           'data': {'data': {'albumDetail': {'albumId': '1'}}}}
+
+
+class FakeResponse:
+    def __init__(self, rv):
+        self._rv = rv
+
+    def json(self):
+        return self._rv
+
+
+class ThrottlingSession:
+    """前 throttled 个请求被限流"""
+
+    def __init__(self, throttled):
+        self.headers = {}
+        self.throttled = throttled
+        self.requests = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.requests += 1
+        if self.requests <= self.throttled:
+            return FakeResponse(THROTTLED)
+        return FakeResponse(SUCCESS)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def _create_api(http):
+    api = API()
+    api._req_token = 'token'
+    api.set_http(http)
+    return api
+
+
+def test_parse_response_without_separator():
+    api = API()
+    code, msg = api._parse_response('action', {}, THROTTLED)
+    assert code == 'FAIL_SYS_USER_VALIDATE'
+    assert msg.startswith('RGV587_ERROR')
+
+
+def test_backoff_is_bounded():
+    policy = RetryPolicy(base_delay=1, max_delay=3)
+    for retries in range(1, 10):
+        delay = policy.backoff(retries)
+        assert 0 <= delay <= min(3, 2 ** (retries - 1))
+
+
+@mock.patch('fuo_xiami.api.time.sleep')
+def test_retry_until_success(sleep):
+    http = ThrottlingSession(throttled=2)
+    api = _create_api(http)
+    assert api.album_detail(1) == {'albumId': '1'}
+    assert http.requests == 3
+    assert sleep.call_count == 2
+
+
+@mock.patch('fuo_xiami.api.time.sleep')
+def test_retry_gives_up(sleep):
+    http = ThrottlingSession(throttled=100)
+    api = _create_api(http)
+    with pytest.raises(XiamiThrottledError):
+        api.album_detail(1)
+    assert http.requests == 4
+
+
+@mock.patch('fuo_xiami.api.time.sleep')
+def test_circuit_opens_and_fails_fast(sleep):
+    http = ThrottlingSession(throttled=100)
+    api = _create_api(http)
+    changes = []
+    api.on_breaker_state_change = lambda breaker, old, new: changes.append(new)
+    for _ in range(2):
+        with pytest.raises(XiamiThrottledError):
+            api.album_detail(1)
+    # 连续 5 次被限流之后进入 open 状态，之后的请求不会发出去
+    assert http.requests == 5
+    assert changes == ['open']
+    stats = api.breaker_stats()['albumservice']
+    assert stats['state'] == 'open'
+    assert stats['state_changes'] == {'open': 1}
+    # 其它类别的 action 不受影响
+    assert api._breaker('mtop.alimusic.music.songservice.getsongs').allow()
+
+
+def test_breaker_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=10,
+                             clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.allow()
+    assert breaker.retry_after() == 10
+
+    clock.now = 10
+    # 只放行一个探测请求
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.state_changes == {'open': 2, 'half_open': 2, 'closed': 1}
+
+
+def test_breaker_callback_reads_breaker():
+    clock = FakeClock()
+    seen = []
+
+    def on_state_change(breaker, old, new):
+        # 回调在锁之外调用，可以访问 breaker 的状态
+        seen.append((old, new, breaker.stats()['state'], breaker.retry_after()))
+
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=10,
+                             on_state_change=on_state_change, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.state == 'half_open'
+    breaker.record_success()
+    assert seen == [('closed', 'open', 'open', 10),
+                    ('open', 'half_open', 'half_open', 0),
+                    ('half_open', 'closed', 'closed', 0)]
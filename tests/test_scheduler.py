@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+
+from fuo_xiami.scheduler import (
+    _LocalPriority,
+    priority,
+    current_priority,
+    AsyncScheduler,
+    Scheduler,
+    TokenBucket,
+    BULK,
+    INTERACTIVE,
+    PREFETCH,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    bucket.take()
+    bucket.take()
+    assert bucket.wait_time() == 0.5
+    clock.now = 0.5
+    assert bucket.wait_time() == 0
+
+
+def test_aimd():
+    scheduler = Scheduler(max_concurrency=8, rate=None, family_rate=None)
+    assert scheduler.limit == 4
+    scheduler.acquire('songservice')
+    scheduler.release(throttled=True)
+    assert scheduler.limit == 2
+    for _ in range(100):
+        scheduler.acquire('songservice')
+        scheduler.release()
+    assert scheduler.limit == 8
+    assert scheduler.stats()['throttled'] == 1
+
+
+def test_interactive_slot_is_reserved():
+    scheduler = Scheduler(max_concurrency=4, rate=None, family_rate=None)
+    assert scheduler.limit == 2
+    scheduler.acquire('songservice', BULK)
+    blocked = threading.Event()
+
+    def bulk():
+        blocked.set()
+        scheduler.acquire('songservice', BULK)
+
+    thread = threading.Thread(target=bulk, daemon=True)
+    thread.start()
+    blocked.wait()
+    time.sleep(0.05)
+    assert scheduler.inflight == 1
+    # 交互式请求不需要等待后台请求
+    scheduler.acquire('albumservice', INTERACTIVE)
+    assert scheduler.inflight == 2
+    scheduler.release()
+    scheduler.release()
+    thread.join(1)
+    assert scheduler.stats()['granted'] == {'bulk': 2, 'interactive': 1}
+
+
+def test_priority_order():
+    scheduler = Scheduler(max_concurrency=2, min_concurrency=1,
+                          rate=None, family_rate=None)
+    scheduler.acquire('songservice', INTERACTIVE)
+    order = []
+
+    def run(p):
+        with scheduler.slot('songservice', p):
+            order.append(p)
+
+    threads = []
+    for p in (BULK, PREFETCH, INTERACTIVE):
+        thread = threading.Thread(target=run, args=(p,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.05)
+    assert scheduler.stats()['waiting'] == {'bulk': 1, 'prefetch': 1,
+                                            'interactive': 1}
+    scheduler.release()
+    for thread in threads:
+        thread.join(1)
+    assert order == [INTERACTIVE, PREFETCH, BULK]
+
+
+def test_family_rate_limit():
+    clock = FakeClock()
+    scheduler = Scheduler(rate=None, family_rate=1, family_burst=1, clock=clock)
+    scheduler.acquire('songservice')
+    scheduler.release()
+    # 其它类别的 action 有自己的令牌桶
+    scheduler.acquire('albumservice')
+    scheduler.release()
+    waiter = scheduler._enqueue(INTERACTIVE, 'songservice')
+    assert scheduler._try_grant(waiter) == 1
+    clock.now = 1
+    assert scheduler._try_grant(waiter) == 0
+
+
+def test_priority_context():
+    assert current_priority() == INTERACTIVE
+    with priority(BULK):
+        assert current_priority() == BULK
+    assert current_priority() == INTERACTIVE
+
+
+def test_local_priority_fallback():
+    # Python 3.7 之前没有 contextvars 时使用
+    local = _LocalPriority()
+    token = local.set(BULK)
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(local.get()))
+    thread.start()
+    thread.join()
+    assert seen == [INTERACTIVE]
+    assert local.get() == BULK
+    local.reset(token)
+    assert local.get() == INTERACTIVE
+
+
+def test_async_scheduler():
+    scheduler = AsyncScheduler(max_concurrency=2, min_concurrency=1,
+                               rate=None, family_rate=None)
+    order = []
+
+    async def run(p):
+        async with scheduler.slot('songservice', p):
+            order.append(p)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(run(BULK), run(BULK), run(INTERACTIVE))
+
+    asyncio.run(main())
+    assert sorted(order) == [INTERACTIVE, BULK, BULK]
+    assert scheduler.inflight == 0
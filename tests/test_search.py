@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from fuo_xiami.excs import SearchCancelled
+from fuo_xiami.search import normalize, SearchEngine, SEARCH_FIELDS
+
+
+class FakeAPI:
+    def __init__(self, delay=0, fail_types=()):
+        self.delay = delay
+        self.fail_types = fail_types
+        self.calls = []
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.release.set()
+
+    def search(self, keyword, type_=1, page=1, limit=30):
+        with self.lock:
+            self.calls.append((keyword, type_))
+        self.release.wait(timeout=5)
+        time.sleep(self.delay)
+        if type_ in self.fail_types:
+            raise OSError('network error')
+        field = SEARCH_FIELDS[type_]
+        return {field: ['{}:{}'.format(keyword, field)], 'pagingVO': {}}
+
+
+def test_normalize():
+    assert normalize(' 周杰伦 ') == normalize('周杰伦')
+    assert normalize('ＪＡＹ  chou') == 'jay chou'
+
+
+def test_search_types_concurrently():
+    api = FakeAPI(delay=0.2)
+    engine = SearchEngine(api)
+    start = time.time()
+    data = engine.search('jay')
+    assert time.time() - start < 0.6
+    assert data == {field: ['jay:' + field] for field in SEARCH_FIELDS.values()}
+    assert len(api.calls) == 4
+
+
+def test_cache_by_normalized_keyword():
+    api = FakeAPI()
+    engine = SearchEngine(api, ttl=60)
+    engine.search('Jay', types=[1])
+    engine.search(' jay ', types=[1, 10])
+    assert api.calls == [('Jay', 1), ('jay', 10)]
+    assert engine.stats()['hits'] == 1
+
+
+def test_cache_expires():
+    api = FakeAPI()
+    engine = SearchEngine(api, ttl=0)
+    engine.search('jay', types=[1])
+    engine.search('jay', types=[1])
+    assert len(api.calls) == 2
+
+
+def test_inflight_requests_are_shared():
+    api = FakeAPI()
+    api.release.clear()
+    engine = SearchEngine(api)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(engine.search, 'jay', [1]) for _ in range(2)]
+        time.sleep(0.1)
+        api.release.set()
+        results = [future.result() for future in futures]
+    assert results[0] == results[1]
+    assert api.calls == [('jay', 1)]
+
+
+def test_partial_failure():
+    engine = SearchEngine(FakeAPI(fail_types=(10, )))
+    data = engine.search('jay', types=[1, 10])
+    assert data == {'songs': ['jay:songs']}
+    with pytest.raises(OSError):
+        engine.search('jay', types=[10])
+
+
+def test_outdated_query_is_cancelled():
+    api = FakeAPI()
+    api.release.clear()
+    # 只有一个工作线程，后面的请求都在排队
+    engine = SearchEngine(api, workers=1)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        outdated = executor.submit(engine.search_as_you_type, 'ja')
+        time.sleep(0.1)
+        latest = threading.Thread(target=engine.search_as_you_type, args=('jay', ))
+        latest.start()
+        with pytest.raises(SearchCancelled):
+            outdated.result(timeout=5)
+        api.release.set()
+        latest.join(timeout=5)
+    # 'ja' 只有第一个请求发送出去了，其它三个被取消
+    assert [call for call in api.calls if call[0] == 'ja'] == [('ja', 1)]
+    assert engine.stats()['cancelled'] == 3
+
+
+def test_peek_prefix():
+    engine = SearchEngine(FakeAPI())
+    assert engine.peek('jay') == (None, None)
+    engine.search('ja', types=[1])
+    assert engine.peek('Jay ch', types=[1]) == ('ja', {'songs': ['ja:songs']})
+    assert engine.peek('jay', types=[1, 10]) == (None, None)
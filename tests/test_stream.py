@@ -0,0 +1,149 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from fuo_xiami.api import API
+from fuo_xiami import models
+from fuo_xiami.models import create_g, XArtistModel
+from fuo_xiami.stream import ListResponseStream, _Reader
+
+
+with open('data/fixtures/artist_songs.json') as f:
+    data_artist_songs = json.load(f)
+
+
+def make_body(songs, page=1, pages=1, ret='SUCCESS::调用成功'):
+    # mtop 响应中 ret 在 data 之后，pagingVO 在 songs 之后
+    rv = {
+        'api': 'mtop.alimusic.music.songservice.getartistsongs',
+        'data': {'data': {'songs': songs,
+                          'pagingVO': {'count': str(len(songs) * pages),
+                                       'page': str(page),
+                                       'pageSize': str(len(songs)),
+                                       'pages': str(pages)}}},
+        'ret': [ret],
+        'v': '1.0',
+    }
+    return json.dumps(rv, ensure_ascii=False).encode('utf-8')
+
+
+def split(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize('size', [1, 7, 4096])
+def test_stream_matches_json(size):
+    body = make_body(data_artist_songs)
+    stream = ListResponseStream(split(body, size))
+    items = list(stream)
+    assert items == [('songs', song) for song in data_artist_songs]
+    assert stream.code == 'SUCCESS'
+    assert stream.data['pagingVO'] == json.loads(body)['data']['data']['pagingVO']
+
+
+def test_stream_numbers_and_empty_lists():
+    body = b'{"data": {"data": {"albums": [], "total": 12345, "songs": [1, 23]}}, ' \
+           b'"ret": ["SUCCESS::ok"]}'
+    stream = ListResponseStream(split(body, 3))
+    assert list(stream) == [('songs', 1), ('songs', 23)]
+    assert stream.data == {'total': 12345}
+
+
+@pytest.mark.parametrize('head, tail, total', [
+    (b'3.', b'14', 3.14),
+    (b'3', b'.14', 3.14),
+    (b'1e', b'3', 1000.0),
+    (b'-', b'12', -12),
+    (b'12', b'3', 123),
+])
+def test_stream_number_across_chunks(head, tail, total):
+    chunks = [b'{"data": {"data": {"total": ' + head,
+              tail + b', "songs": [1]}}, "ret": ["SUCCESS::ok"]}']
+    stream = ListResponseStream(chunks)
+    assert list(stream) == [('songs', 1)]
+    assert stream.data == {'total': total}
+
+
+def test_reader_number_at_eof():
+    assert _Reader([b'1', b'2.', b'5']).value() == 12.5
+    assert _Reader([b' 42']).value() == 42
+
+
+def test_stream_invalid_json():
+    with pytest.raises(ValueError):
+        list(ListResponseStream([b'{"data": {"data": {"songs": [{"a": 1}']))
+
+
+def test_stream_fallback():
+    body = b'{"data": {}, "ret": ["FAIL_SYS_TOKEN_EXOIRED::\xe4\xbb\xa4\xe7\x89\x8c"]}'
+    stream = ListResponseStream([body],
+                                fallback=lambda: {'songs': [1], 'pagingVO': {}})
+    assert list(stream) == [('songs', 1)]
+    assert stream.data == {'pagingVO': {}}
+
+
+class StreamResponse:
+    def __init__(self, body, consumed):
+        self._body = body
+        self._consumed = consumed
+
+    def iter_content(self, chunk_size):
+        for chunk in split(self._body, 512):
+            self._consumed.append(len(chunk))
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class StreamSession:
+    def __init__(self, pages):
+        self.headers = {}
+        self.pages = pages
+        self.consumed = []
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        assert stream is True
+        request_str = json.loads(json.loads(params['data'])['requestStr'])
+        page = request_str['model']['pagingVO']['page']
+        songs = []
+        for i, song in enumerate(data_artist_songs):
+            song = dict(song)
+            song['songId'] = str(page * 100 + i)
+            songs.append(song)
+        body = make_body(songs, page=page, pages=self.pages)
+        return StreamResponse(body, self.consumed)
+
+
+def test_create_g_stream():
+    http = StreamSession(pages=2)
+    api = API()
+    api._req_token = 'token'
+    api.set_http(http)
+    g = create_g(api.artist_songs, 1, stream=True)
+    n = len(data_artist_songs)
+    assert g.count == 2 * n
+    ids = [song.identifier for song in g]
+    assert ids == [page * 100 + i for page in (1, 2) for i in range(n)]
+
+
+def test_stream_yields_before_body_is_downloaded():
+    http = StreamSession(pages=1)
+    api = API()
+    api._req_token = 'token'
+    api.set_http(http)
+    body_size = len(make_body(data_artist_songs))
+    stream = api.artist_songs(1, stream=True)
+    next(iter(stream))
+    assert 0 < sum(http.consumed) < body_size
+
+
+def test_model_stream_opt_in():
+    artist = XArtistModel(identifier=1)
+    with patch.object(models, 'create_g') as create_g:
+        artist.create_songs_g()
+        assert create_g.call_args[1]['stream'] is False
+        with patch.object(models, 'STREAM_PAGES', True):
+            artist.create_albums_g()
+        assert create_g.call_args[1]['stream'] is True
@@ -0,0 +1,71 @@
+import gc
+import json
+
+import pytest
+
+from fuo_xiami.loaders import load_song
+from fuo_xiami.models import create_g, identity_map, XSongModel
+from fuo_xiami.table import SongTable
+
+
+with open('data/fixtures/artist_songs.json') as f:
+    data_artist_songs = json.load(f)
+
+
+@pytest.fixture(autouse=True)
+def clear_identity_map():
+    yield
+    gc.collect()
+    identity_map.clear()
+
+
+def test_rows_match_models():
+    table = SongTable()
+    table.extend(data_artist_songs)
+    assert len(table) == len(data_artist_songs)
+    for row, data in zip(table, data_artist_songs):
+        song = load_song(data)
+        assert row.identifier == song.identifier
+        assert row.title == song.title
+        assert row.duration == song.duration
+        assert row.duration_ms == song.duration_ms
+        assert row.album_name == song.album_name
+        assert row.artists_name == song.artists_name
+    assert table[-1].identifier == int(data_artist_songs[-1]['songId'])
+    assert table.index_of(table[1].identifier) == 1
+
+
+def test_albums_and_artists_are_shared():
+    table = SongTable()
+    table.extend(data_artist_songs * 3)
+    album_ids = {int(song['albumId']) for song in data_artist_songs}
+    assert len(table._albums) == len(album_ids)
+    assert table[0].artists is not table[0].artists
+    assert table[0].title is table[len(data_artist_songs)].title
+
+
+def test_row_model():
+    table = SongTable()
+    row = table.append(data_artist_songs[0])
+    song = row.model()
+    assert isinstance(song, XSongModel)
+    assert song.identifier == row.identifier
+    assert song.album.name == row.album_name
+    assert row.model() is song
+    # 播放链接没有被保存
+    assert song.__dict__['q_media_mapping'] is None
+
+
+def test_create_g_fills_table():
+    def func(identifier, page=1, page_size=2):
+        songs = data_artist_songs[(page - 1) * page_size:page * page_size]
+        return {'songs': songs,
+                'pagingVO': {'count': str(len(data_artist_songs)),
+                             'page': str(page),
+                             'pageSize': str(page_size),
+                             'pages': str((len(data_artist_songs) + 1) // 2)}}
+
+    table = SongTable()
+    rows = list(create_g(func, 1, table=table))
+    assert len(table) == len(data_artist_songs)
+    assert rows == list(table)
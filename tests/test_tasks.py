@@ -0,0 +1,166 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from fuo_xiami import Xiami
+from fuo_xiami.library import FULL
+from fuo_xiami.models import XSearchModel, XSongModel, XUserModel
+from fuo_xiami.provider import provider
+from fuo_xiami.tasks import TaskRunner
+
+
+class MainThread:
+    """模拟 Qt 的事件队列：deliver 只是入队，process 时才调用"""
+
+    def __init__(self):
+        self.queue = []
+
+    def deliver(self, callback, *args):
+        self.queue.append((callback, args))
+
+    def process(self):
+        while self.queue:
+            callback, args = self.queue.pop(0)
+            callback(*args)
+
+
+@pytest.fixture(autouse=True)
+def reset_provider():
+    yield
+    # Xiami 会设置 provider.on_remote_search
+    provider.on_remote_search = None
+
+
+def _wait(future):
+    future.result(timeout=5)
+
+
+def test_result_is_delivered():
+    main = MainThread()
+    runner = TaskRunner(deliver=main.deliver)
+    results = []
+    _wait(runner.submit('table', lambda x: x * 2, results.append, 21))
+    assert results == []
+    main.process()
+    assert results == [42]
+
+
+def test_new_task_replaces_previous():
+    main = MainThread()
+    runner = TaskRunner(deliver=main.deliver, workers=1)
+    release = threading.Event()
+    results = []
+    running = runner.submit('table', release.wait, results.append, 5)
+    queued = runner.submit('table', lambda: 'queued', results.append)
+    latest = runner.submit('table', lambda: 'latest', results.append)
+    # 还在排队的任务被直接取消
+    assert queued.cancelled()
+    release.set()
+    _wait(running)
+    _wait(latest)
+    main.process()
+    # 已经在执行的任务，结果被丢弃
+    assert results == ['latest']
+
+
+def test_result_outdated_in_queue():
+    main = MainThread()
+    runner = TaskRunner(deliver=main.deliver)
+    results = []
+    _wait(runner.submit('table', lambda: 'old', results.append))
+    _wait(runner.submit('table', lambda: 'new', results.append))
+    main.process()
+    assert results == ['new']
+
+
+def test_keys_are_independent():
+    runner = TaskRunner()
+    results = []
+    _wait(runner.submit('playlists', lambda: 1, results.append))
+    _wait(runner.submit('fav_playlists', lambda: 2, results.append))
+    assert sorted(results) == [1, 2]
+
+
+def test_error():
+    main = MainThread()
+    runner = TaskRunner(deliver=main.deliver)
+    errors = []
+    _wait(runner.submit('table', lambda: 1 / 0, None, on_error=errors.append))
+    main.process()
+    assert isinstance(errors[0], ZeroDivisionError)
+
+
+def test_show_provider_does_not_block():
+    main = MainThread()
+    app = mock.MagicMock()
+    ctl = Xiami(app, runner=TaskRunner(deliver=main.deliver))
+    ctl._user = XUserModel(identifier=1, name='test')
+    ctl._library = mock.Mock()
+    ctl._library.load.return_value = None
+    with mock.patch.object(XUserModel, 'playlists', new_callable=mock.PropertyMock) \
+            as playlists, \
+            mock.patch.object(XUserModel, 'fav_playlists',
+                              new_callable=mock.PropertyMock) as fav_playlists:
+        playlists.side_effect = lambda: time.sleep(0.3) or ['p']
+        fav_playlists.return_value = ['f']
+        start = time.time()
+        ctl.show_provider()
+        assert time.time() - start < 0.2
+        app.pl_uimgr.add.assert_not_called()
+        ctl._library.start_sync.assert_called_once()
+        deadline = time.time() + 5
+        while len(ctl._playlists) < 2 and time.time() < deadline:
+            main.process()
+            time.sleep(0.01)
+    main.process()
+    app.pl_uimgr.add.assert_any_call(['p'])
+    app.pl_uimgr.add.assert_any_call(['f'], is_fav=True)
+
+
+def test_show_fav_songs_from_library():
+    app = mock.MagicMock()
+    ctl = Xiami(app, runner=TaskRunner())
+    ctl._user = XUserModel(identifier=1, name='test')
+    ctl._library = mock.Mock()
+    ctl._library.load_g.return_value = songs_g = object()
+    _wait(ctl.show_fav_songs())
+    app.ui.songs_table_container.show_songs.assert_called_once_with(songs_g=songs_g)
+
+
+def test_refresh_after_library_sync():
+    app = mock.MagicMock()
+    ctl = Xiami(app, runner=TaskRunner())
+    ctl._user = XUserModel(identifier=1, name='test')
+    ctl._library = mock.Mock()
+    _wait(ctl.show_fav_albums())
+    ctl._on_library_synced('artists', FULL)
+    ctl._on_library_synced('albums', FULL)
+    ctl._runner._executor.shutdown(wait=True)
+    assert app.ui.songs_table_container.show_albums_coll.call_count == 2
+    app.ui.songs_table_container.show_artists_coll.assert_not_called()
+
+
+def test_merge_remote_search_result():
+    main = MainThread()
+    app = mock.MagicMock()
+    ctl = Xiami(app, runner=TaskRunner(deliver=main.deliver))
+    assert provider.on_remote_search == ctl._on_remote_search
+    local = [XSongModel(identifier=1), XSongModel(identifier=2)]
+    other = [mock.Mock(source='other', identifier=1)]
+    model = app.ui.songs_table_container.songs_table.model.return_value
+    model.sourceModel.return_value.songs = other + local
+    result = XSearchModel(songs=local + [XSongModel(identifier=3)])
+    ctl._on_remote_search('keyword', result)
+    app.ui.songs_table_container.show_songs.assert_not_called()
+    main.process()
+    app.ui.songs_table_container.show_songs.assert_called_once_with(
+        songs=other + result.songs)
+
+    # 表格已经在展示其它内容时，不再追加
+    app.ui.songs_table_container.show_songs.reset_mock()
+    model.sourceModel.return_value.songs = other
+    ctl._on_remote_search('keyword', result)
+    main.process()
+    app.ui.songs_table_container.show_songs.assert_not_called()
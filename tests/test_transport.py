@@ -0,0 +1,99 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fuo_xiami.api import API
+from fuo_xiami.scheduler import Scheduler
+from fuo_xiami.transport import PooledSession
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"ret": ["SUCCESS::ok"], "data": {"data": {}}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_pooled_session_reuses_connections(server_url):
+    session = PooledSession(pool_maxsize=4)
+    for _ in range(5):
+        assert session.get(server_url, timeout=3).json()['ret'] == ['SUCCESS::ok']
+    stats = session.stats()['127.0.0.1']
+    assert stats['requests'] == 5
+    assert stats['connections'] == 1
+    assert stats['reuse_rate'] == 0.8
+    assert stats['idle'] == 1
+
+
+def test_pooled_session_warm_up(server_url):
+    session = PooledSession(pool_maxsize=4)
+    assert session.warm_up([server_url], connections=2) == 2
+    session.get(server_url, timeout=3)
+    stats = session.stats()['127.0.0.1']
+    assert stats['connections'] == 2
+    assert stats['idle'] == 2
+
+
+def test_pooled_session_warm_up_again(server_url):
+    session = PooledSession(pool_maxsize=4)
+    assert session.warm_up([server_url], connections=2) == 2
+    # 连接池中已经有连接时直接使用，不会重复建立
+    assert session.warm_up([server_url], connections=2) == 2
+    assert session.stats()['127.0.0.1']['connections'] == 2
+
+
+def test_pooled_session_warm_up_failed():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:{}/'.format(sock.getsockname()[1])
+    session = PooledSession(pool_maxsize=4)
+    assert session.warm_up([url], connections=2) == 0
+    pool = session._pool_for(url)
+    # 连接失败的连接不会放回连接池，连接池的名额也没有减少
+    assert session.stats()['127.0.0.1']['idle'] == 0
+    assert pool.pool.qsize() == 4
+
+
+def test_api_default_transport():
+    api = API()
+    assert api.scheduler is None
+    api.set_scheduler(Scheduler(max_concurrency=32))
+    assert isinstance(api.http, PooledSession)
+    assert api.http.pool_maxsize >= api.scheduler.max_concurrency
+    assert api.transport_stats() == {}
+
+
+def test_http2_session(server_url):
+    pytest.importorskip('httpx')
+    from fuo_xiami.transport import HTTP2Session
+
+    # 本地服务器只支持 HTTP/1.1，这里只验证接口和统计
+    session = HTTP2Session(upgrade_scheme=False)
+    for _ in range(3):
+        response = session.get(server_url, timeout=3)
+        assert response.json()['ret'] == ['SUCCESS::ok']
+        assert response.cookies.get_dict() == {}
+    stats = session.stats()
+    assert stats['127.0.0.1']['requests'] == 3
+    assert stats['127.0.0.1']['connections'] == 1
+    session.close()